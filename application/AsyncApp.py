@@ -0,0 +1,421 @@
+"""
+asyncio front-end for TestApp.
+
+AsyncTestApp reads the TWS socket with loop.add_reader() and decodes every
+message right in the event loop, so there is no EReader thread and no
+message queue to poll. Requests made through it return awaitables:
+
+    bars = await app.reqHistoricalDataAsync(contract, "", "1 D", "1 day", "TRADES")
+    record = await app.placeOrderAsync(contract, order)       # when done
+    async for bar in app.realTimeBarsAsync(contract):        # until break
+        ...
+
+Responses resolve futures keyed by reqId/orderId. The trading plan strategy
+runs unchanged, and the plan file is watched by a task on the same loop.
+
+    python AsyncApp.py --plan trading_plan.yml -p 7497
+"""
+
+import argparse
+import asyncio
+import datetime
+import functools
+import logging
+import signal
+import socket
+import time
+
+from ibapi import comm
+from ibapi import decoder
+from ibapi.client import EClient
+from ibapi.common import *
+from ibapi.connection import Connection
+from ibapi.contract import Contract
+from ibapi.order import Order
+from ibapi.server_versions import MAX_CLIENT_VER, MIN_CLIENT_VER
+from ibapi.utils import iswrapper
+
+from HistoricalBarStore import HistoricalBarStore
+from MetricsExporter import MetricsExporter
+from Program import SetupLogger, TestApp, addAppArguments, createApp, riskGateOf
+from RequestPacer import RequestPacer
+from TradingPlan import TradingPlan
+from TradingPlanWatcher import TradingPlanWatcher
+
+
+class RequestError(Exception):
+
+    def __init__(self, reqId: int, errorCode: int, errorString: str):
+        Exception.__init__(self, "request %d failed with %d: %s" % (reqId, errorCode, errorString))
+        self.reqId = reqId
+        self.errorCode = errorCode
+        self.errorString = errorString
+
+
+class AsyncConnection(Connection):
+
+    """ An ibapi Connection over a non-blocking socket. sendMsg() must be
+    called on the loop; what the socket does not take right away is sent
+    when it becomes writable. """
+
+    def __init__(self, host: str, port: int, loop: asyncio.AbstractEventLoop):
+        Connection.__init__(self, host, port)
+        self.loop = loop
+        self.pendingOut = bytearray()
+
+    async def connectAsync(self):
+        sock = socket.socket()
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            await self.loop.sock_connect(sock, (self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        self.socket = sock
+
+    def sendMsg(self, msg):
+        if not self.isConnected():
+            return 0
+        if self.pendingOut:
+            self.pendingOut += msg
+            return len(msg)
+        try:
+            nSent = self.socket.send(msg)
+        except BlockingIOError:
+            nSent = 0
+        if nSent < len(msg):
+            self.pendingOut += msg[nSent:]
+            self.loop.add_writer(self.socket, self.flush)
+        return len(msg)
+
+    def flush(self):
+        try:
+            nSent = self.socket.send(self.pendingOut)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.disconnect()
+            return
+        del self.pendingOut[:nSent]
+        if not self.pendingOut:
+            self.loop.remove_writer(self.socket)
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.loop.remove_reader(self.socket)
+            self.loop.remove_writer(self.socket)
+        Connection.disconnect(self)
+
+
+class AsyncTestApp(TestApp):
+
+    # Far above the reqIds of the trading plan, which start at 8801
+    ASYNC_REQ_ID_BASE = 1 << 30
+    # Errors about an order that do not end it
+    ORDER_WARNINGS = frozenset((399,))
+
+    def __init__(self, **kwargs):
+        TestApp.__init__(self, **kwargs)
+        self.loop = None
+        self.inBuffer = b""
+        self.handshaking = False
+        self.ready = None
+        self.closed = None
+        self.nextAsyncReqId = self.ASYNC_REQ_ID_BASE
+        # reqId -> (future, bars) of reqHistoricalDataAsync
+        self.historicalRequests = {}
+        # reqId -> asyncio.Queue of realTimeBarsAsync
+        self.barStreams = {}
+        # orderId -> future of placeOrderAsync
+        self.orderFutures = {}
+        self.housekeeping = None
+
+    # Connection
+
+    async def connectAsync(self, host: str, port: int, clientId: int):
+        """ Connects, shakes hands and returns once TWS sent nextValidId. """
+        self.loop = asyncio.get_running_loop()
+        self.ready = self.loop.create_future()
+        self.closed = self.loop.create_future()
+        self.host = host
+        self.port = port
+        self.clientId = clientId
+
+        self.conn = AsyncConnection(host, port, self.loop)
+        await self.conn.connectAsync()
+        self.setConnState(EClient.CONNECTING)
+        self.decoder = decoder.Decoder(self.wrapper, self.serverVersion())
+        self.handshaking = True
+        self.loop.add_reader(self.conn.socket, self.onReadable)
+        self.conn.sendMsg(b"API\0" + comm.make_msg("v%d..%d" % (MIN_CLIENT_VER, MAX_CLIENT_VER)))
+
+        self.housekeeping = self.loop.call_later(0.2, self.onHousekeeping)
+        await self.ready
+
+    def onReadable(self):
+        try:
+            data = self.conn.socket.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.disconnect()
+            return
+        readAt = time.perf_counter_ns() if self.tracer is not None else 0
+
+        buf = self.inBuffer + data if self.inBuffer else data
+        (pos, end) = (0, len(buf))
+        while end - pos >= 4:
+            size = int.from_bytes(buf[pos:pos + 4], "big")
+            if end - pos - 4 < size:
+                break
+            text = buf[pos + 4:pos + 4 + size]
+            pos += 4 + size
+            try:
+                if self.handshaking:
+                    self.onHandshake(comm.read_fields(text))
+                else:
+                    if readAt:
+                        # No queue here; a message waits for those before it in the read
+                        self.tracer.current = (0, readAt, time.perf_counter_ns())
+                    self.decoder.interpret(comm.read_fields(text))
+                    self.msgLoopRec()
+            except Exception:
+                logging.exception("Failed to process %s", text[:40])
+            if self.conn is None or not self.conn.isConnected():
+                return
+        self.inBuffer = buf[pos:]
+
+    def onHandshake(self, fields: list):
+        # TWS may send news before the server version
+        if len(fields) != 2:
+            return
+        self.handshaking = False
+        self.serverVersion_ = int(fields[0])
+        self.connTime = fields[1]
+        self.decoder.serverVersion = self.serverVersion_
+        self.setConnState(EClient.CONNECTED)
+        logging.info("Connected, server version %d", self.serverVersion_)
+        self.startApi()
+        self.wrapper.connectAck()
+
+    def onHousekeeping(self):
+        # What EClient.run() does when the queue stays empty for 0.2s
+        self.msgLoopTmo()
+        if self.isConnected() or self.handshaking:
+            self.housekeeping = self.loop.call_later(0.2, self.onHousekeeping)
+
+    @iswrapper
+    def nextValidId(self, orderId: int):
+        super().nextValidId(orderId)
+        if not self.ready.done():
+            self.ready.set_result(orderId)
+
+    @iswrapper
+    def connectionClosed(self):
+        super().connectionClosed()
+        exc = ConnectionError("connection to TWS closed")
+        for (future, bars) in self.historicalRequests.values():
+            if not future.done():
+                future.set_exception(exc)
+        for future in self.orderFutures.values():
+            if not future.done():
+                future.set_exception(exc)
+        for stream in self.barStreams.values():
+            stream.put_nowait(None)
+        if self.ready is not None and not self.ready.done():
+            self.ready.set_exception(exc)
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(True)
+
+    def keyboardInterrupt(self):
+        super().keyboardInterrupt()
+        if self.done:
+            self.disconnect()
+
+    # Awaitable requests
+
+    def newReqId(self) -> int:
+        reqId = self.nextAsyncReqId
+        self.nextAsyncReqId += 1
+        return reqId
+
+    async def reqHistoricalDataAsync(self, contract: Contract, endDateTime: str, durationStr: str,
+                                     barSizeSetting: str, whatToShow: str, useRTH: int = 1) -> list:
+        """ All bars of the request, once historicalDataEnd arrived. """
+        reqId = self.newReqId()
+        future = self.loop.create_future()
+        self.historicalRequests[reqId] = (future, [])
+        self.pacer.submit(RequestPacer.HISTORICAL_DATA, reqId,
+                          functools.partial(self.reqHistoricalData, reqId, contract, endDateTime,
+                                            durationStr, barSizeSetting, whatToShow, useRTH, 1, False, []))
+        self.pacer.pump()
+        try:
+            return await future
+        finally:
+            del self.historicalRequests[reqId]
+
+    async def realTimeBarsAsync(self, contract: Contract, whatToShow: str = "TRADES", useRTH: bool = True):
+        """ Yields the 5-second RealTimeBar updates until the loop using it
+        stops; the subscription is cancelled then. """
+        reqId = self.newReqId()
+        stream = asyncio.Queue()
+        self.barStreams[reqId] = stream
+        self.pacer.submit(RequestPacer.REALTIME_BARS, reqId,
+                          functools.partial(self.reqRealTimeBars, reqId, contract, 5, whatToShow, useRTH, []))
+        self.pacer.pump()
+        try:
+            while True:
+                bar = await stream.get()
+                if bar is None:
+                    return
+                if isinstance(bar, RequestError):
+                    raise bar
+                yield bar
+        finally:
+            del self.barStreams[reqId]
+            if self.pacer.discard(reqId) and self.isConnected():
+                self.cancelRealTimeBars(reqId)
+
+    async def placeOrderAsync(self, contract: Contract, order: Order):
+        """ Places the order and returns its OrderRecord once it is filled,
+        cancelled or otherwise done. """
+        orderId = self.nextOrderId()
+        future = self.loop.create_future()
+        self.orderFutures[orderId] = future
+        self.orders.placed(orderId, contract.symbol, order.action, order.totalQuantity)
+        self.placeOrder(orderId, contract, order)
+        try:
+            return await future
+        finally:
+            del self.orderFutures[orderId]
+
+    # Callbacks resolving the futures
+
+    @iswrapper
+    def historicalData(self, reqId: int, bar: BarData):
+        request = self.historicalRequests.get(reqId)
+        if request is None:
+            super().historicalData(reqId, bar)
+        else:
+            request[1].append(bar)
+
+    @iswrapper
+    def historicalDataEnd(self, reqId: int, start: str, end: str):
+        super().historicalDataEnd(reqId, start, end)
+        request = self.historicalRequests.get(reqId)
+        if request is not None and not request[0].done():
+            request[0].set_result(request[1])
+
+    @iswrapper
+    def realtimeBar(self, reqId: TickerId, time: int, open_: float, high: float, low: float,
+                    close: float, volume: int, wap: float, count: int):
+        if reqId in self.barStreams:
+            bar = RealTimeBar(time, -1, open_, high, low, close, volume, wap, count)
+            self.barStreams[reqId].put_nowait(bar)
+            return
+        super().realtimeBar(reqId, time, open_, high, low, close, volume, wap, count)
+
+    def orderFinished(self, record):
+        super().orderFinished(record)
+        future = self.orderFutures.get(record.orderId)
+        if future is not None and not future.done():
+            future.set_result(record)
+
+    @iswrapper
+    def error(self, reqId: TickerId, errorCode: int, errorString: str):
+        super().error(reqId, errorCode, errorString)
+        if reqId < 0 or (RequestPacer.isPacingError(errorCode, errorString) and self.pacer.isQueued(reqId)):
+            return
+
+        exc = RequestError(reqId, errorCode, errorString)
+        if reqId in self.historicalRequests:
+            future = self.historicalRequests[reqId][0]
+            if not future.done():
+                future.set_exception(exc)
+        elif reqId in self.barStreams:
+            self.barStreams[reqId].put_nowait(exc)
+        elif reqId in self.orderFutures and errorCode not in self.ORDER_WARNINGS and errorCode < 2000:
+            future = self.orderFutures[reqId]
+            if not future.done():
+                future.set_exception(exc)
+
+    # The trading plan file, watched on the loop
+
+    async def watchTradingPlan(self):
+        watcher = TradingPlanWatcher(self.tradingPlanFile, self.reloadTradingPlan, self.planReloadInterval)
+        while True:
+            await asyncio.sleep(self.planReloadInterval)
+            watcher.checkOnce()
+
+    def reloadTradingPlan(self, fileName: str):
+        self.prepareTradingPlanReload(fileName)
+        if self.pendingPlanUpdate is not None:
+            self.applyPendingPlanUpdate()
+
+
+async def runAsync(args):
+    app = createApp(args, args.plan, args.account, appClass=AsyncTestApp)
+    app.riskGate = riskGateOf(args)
+    if args.history_store:
+        app.historicalBarStore = HistoricalBarStore(args.history_store)
+    app.tradingPlan = TradingPlan("MarketWatcher")
+    app.setupTradingPlan(firstTime=True)
+
+    metricsExporter = None
+    if args.metrics_port:
+        metricsExporter = MetricsExporter([app], args.metrics_port, interval=args.metrics_interval)
+        metricsExporter.start()
+        logging.info("Serving metrics at %s", metricsExporter.address())
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, app.keyboardInterrupt)
+    if app.tracer is not None:
+        loop.add_signal_handler(signal.SIGUSR1, app.requestLatencyDump)
+    try:
+        await app.connectAsync(args.host, args.port, args.client_id)
+        print("serverVersion:%s connectionTime:%s" % (app.serverVersion(), app.twsConnectionTime()))
+        planWatcher = asyncio.ensure_future(app.watchTradingPlan())
+        await app.closed
+        planWatcher.cancel()
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        if app.tracer is not None:
+            loop.remove_signal_handler(signal.SIGUSR1)
+        if metricsExporter is not None:
+            metricsExporter.stop()
+        app.dumpTestCoverageSituation()
+        app.dumpReqAnsErrSituation()
+        app.dumpLatencySituation()
+        if app.riskGate is not None:
+            logging.info("Risk gate: %s", app.riskGate.report())
+        if app.checkpoint is not None:
+            # Only a started app has state worth keeping over the restored one
+            if app.started:
+                app.saveCheckpoint()
+            app.checkpoint.close()
+        if app.historicalBarStore is not None:
+            app.historicalBarStore.close()
+        if app.journal is not None:
+            app.journal.close()
+
+
+def main():
+    logListener = SetupLogger()
+    logging.info("now is %s", datetime.datetime.now())
+
+    cmdLineParser = argparse.ArgumentParser("TWS trading app on asyncio")
+    addAppArguments(cmdLineParser)
+    args = cmdLineParser.parse_args()
+    logging.info("Using args %s", args)
+
+    try:
+        asyncio.run(runAsync(args))
+    finally:
+        logListener.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Replays recorded 5-second bars through the TestApp strategy without a TWS
+connection.
+
+The bars come from memory-mapped BarFile datasets (<dataDir>/<SYMBOL>/
+<YYYYMMDD>.npy). Orders placed by realtimeBar are filled by the simulator and
+fed back through orderStatus and position, so latestPos evolves exactly as it
+would live. Symbols are independent, so they are spread over a process pool;
+the days of one symbol are replayed in order and carry the position over.
+
+    python Backtest.py --data bars/ --plan trading_plan.yml --processes 8
+"""
+
+import argparse
+import contextlib
+import copy
+import datetime
+import logging
+import multiprocessing
+import os
+import time
+
+from ibapi.common import BarData
+from ibapi.contract import Contract
+from ibapi.order import Order
+
+from BarFile import BarFile
+from Contracts import Contracts
+from Orders import Orders
+from Program import TestApp
+from TradingPlan import TradingPlan
+
+
+class BacktestApp(TestApp):
+    ACCOUNT = "BACKTEST"
+
+    def __init__(self, fillAtNextOpen: bool = False, **kwargs):
+        TestApp.__init__(self, **kwargs)
+        self.nextValidOrderId = 1
+        self.started = True
+        self.fillAtNextOpen = fillAtNextOpen
+        self.pendingOrders = []
+        self.lastClose = {}
+        self.positions = {}
+        self.avgCost = {}
+        self.realizedPnl = {}
+        self.nBuys = {}
+        self.nSells = {}
+        self.tradingDate = None
+
+    def placeOrder(self, orderId, contract: Contract, order: Order):
+        if self.fillAtNextOpen:
+            self.pendingOrders.append((orderId, contract, order))
+        else:
+            self.fill(orderId, contract, order, self.lastClose[contract.symbol])
+
+    def fill(self, orderId, contract: Contract, order: Order, price: float):
+        symbol = contract.symbol
+        quantity = order.totalQuantity if order.action == "BUY" else -order.totalQuantity
+        position = self.positions.get(symbol, 0)
+        avgCost = self.avgCost.get(symbol, 0.)
+
+        # Realize PnL on the part of the fill that reduces the position
+        if position * quantity < 0:
+            closed = min(abs(quantity), abs(position))
+            sign = 1 if position > 0 else -1
+            self.realizedPnl[symbol] = self.realizedPnl.get(symbol, 0.) + sign * closed * (price - avgCost)
+
+        newPosition = position + quantity
+        if newPosition == 0:
+            avgCost = 0.
+        elif position == 0 or (position > 0) != (newPosition > 0):
+            avgCost = price
+        elif abs(newPosition) > abs(position):
+            avgCost = (avgCost * position + price * quantity) / newPosition
+        self.positions[symbol] = newPosition
+        self.avgCost[symbol] = avgCost
+
+        counts = self.nBuys if order.action == "BUY" else self.nSells
+        counts[symbol] = counts.get(symbol, 0) + 1
+
+        self.orderStatus(orderId, "Filled", order.totalQuantity, 0, price, orderId, 0, price, 0, "", 0.)
+        self.position(self.ACCOUNT, contract, newPosition, avgCost)
+
+    def fillPendingOrders(self, price: float):
+        pendingOrders = self.pendingOrders
+        self.pendingOrders = []
+        for (orderId, contract, order) in pendingOrders:
+            self.fill(orderId, contract, order, price)
+
+    def replayDay(self, tpItem, tradingDate: str, bars):
+        self.tradingDate = tradingDate
+        reqId = tpItem.reqId
+        symbol = tpItem.symbol
+        if len(bars) == 0:
+            return 0
+
+        # What start() would have received from TWS: the position and today's open
+        self.position(self.ACCOUNT, Contracts.CachedUSStockAtSmart(symbol),
+                      self.positions.get(symbol, 0), self.avgCost.get(symbol, 0.))
+        openBar = BarData()
+        openBar.date = tradingDate
+        openBar.open = float(bars["open"][0])
+        self.historicalData(reqId, openBar)
+
+        realtimeBar = self.realtimeBar
+        lastClose = self.lastClose
+        for (time_, open_, high, low, close, volume, wap, count) in zip(
+                bars["time"].tolist(), bars["open"].tolist(), bars["high"].tolist(),
+                bars["low"].tolist(), bars["close"].tolist(), bars["volume"].tolist(),
+                bars["wap"].tolist(), bars["count"].tolist()):
+            if self.pendingOrders:
+                self.fillPendingOrders(open_)
+            lastClose[symbol] = close
+            realtimeBar(reqId, time_, open_, high, low, close, volume, wap, count)
+
+        # Whatever is still pending at the close never gets filled
+        for (orderId, contract, order) in self.pendingOrders:
+            self.orderStatus(orderId, "Cancelled", 0, order.totalQuantity, 0., orderId, 0, 0., 0, "", 0.)
+        self.pendingOrders = []
+        return len(bars)
+
+
+# Per worker process state, set up once by initWorker()
+workerPlan = None
+workerArgs = None
+
+
+def initWorker(planFileName: str, args):
+    global workerPlan, workerArgs
+    workerArgs = args
+    workerPlan = TradingPlan("Backtest")
+    workerPlan.parseYaml(planFileName, True, 8800)
+    Contracts.CacheUSStockAtSmart(workerPlan.planKeyedBySymbol.keys())
+    Orders.CacheMarketOrders()
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+
+def replaySymbol(task) -> dict:
+    (symbol, dates) = task
+    planItem = workerPlan.planKeyedBySymbol[symbol]
+
+    app = BacktestApp(fillAtNextOpen=workerArgs.fill_at_next_open)
+    app.tradingPlan = TradingPlan("Backtest-" + symbol)
+
+    nBars = 0
+    startedAt = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for tradingDate in dates:
+            # A new trading day starts from a fresh plan item, as a restart would
+            tpItem = copy.copy(planItem)
+            app.tradingPlan.plan = {}
+            app.tradingPlan.planKeyedBySymbol = {}
+            app.tradingPlan.addPlanItem(tpItem)
+            nBars += app.replayDay(tpItem, tradingDate,
+                                   BarFile.read(BarFile.path(workerArgs.data, symbol, tradingDate)))
+
+    position = app.positions.get(symbol, 0)
+    lastClose = app.lastClose.get(symbol, 0.)
+    return {"symbol": symbol,
+            "days": len(dates),
+            "bars": nBars,
+            "seconds": time.perf_counter() - startedAt,
+            "buys": app.nBuys.get(symbol, 0),
+            "sells": app.nSells.get(symbol, 0),
+            "position": position,
+            "realizedPnl": app.realizedPnl.get(symbol, 0.),
+            "unrealizedPnl": position * (lastClose - app.avgCost.get(symbol, 0.))}
+
+
+def main():
+    cmdLineParser = argparse.ArgumentParser("TWS trading plan backtest")
+    cmdLineParser.add_argument("--data", action="store", dest="data", required=True,
+                               help="BarFile dataset directory")
+    cmdLineParser.add_argument("--plan", action="store", dest="plan",
+                               default="trading_plan.yml", help="The trading plan file")
+    cmdLineParser.add_argument("--from", action="store", dest="from_date", default=None,
+                               help="first trading date (YYYYMMDD)")
+    cmdLineParser.add_argument("--to", action="store", dest="to_date", default=None,
+                               help="last trading date (YYYYMMDD)")
+    cmdLineParser.add_argument("--processes", action="store", type=int, dest="processes",
+                               default=os.cpu_count(), help="size of the process pool")
+    cmdLineParser.add_argument("--fill-at-next-open", action="store_true", dest="fill_at_next_open",
+                               default=False, help="fill at the next bar's open instead of the triggering close")
+    cmdLineParser.add_argument("-v", "--verbose", action="store_true", dest="verbose",
+                               default=False, help="keep the strategy's logging")
+    args = cmdLineParser.parse_args()
+
+    if args.verbose:
+        if not os.path.exists("log"):
+            os.makedirs("log")
+        logging.basicConfig(filename=time.strftime("log/backtest.%y%m%d_%H%M%S.log"),
+                            filemode="w", level=logging.WARNING)
+    logging.info("now is %s", datetime.datetime.now())
+
+    plan = TradingPlan("Backtest")
+    plan.parseYaml(args.plan, True, 8800)
+    dataset = BarFile.listDataset(args.data, args.from_date, args.to_date)
+    tasks = [(symbol, dates) for (symbol, dates) in dataset.items() if symbol in plan.planKeyedBySymbol]
+    if not tasks:
+        print("No recorded bars for any symbol of", args.plan)
+        return
+
+    startedAt = time.perf_counter()
+    if args.processes <= 1:
+        initWorker(args.plan, args)
+        results = [replaySymbol(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(args.processes, initializer=initWorker,
+                                  initargs=(args.plan, args)) as pool:
+            results = list(pool.imap_unordered(replaySymbol, tasks))
+    elapsed = time.perf_counter() - startedAt
+
+    print("%-8s %5s %9s %6s %6s %9s %12s %12s" %
+          ("Symbol", "Days", "Bars", "Buys", "Sells", "Position", "RealizedPnL", "Unrealized"))
+    for result in sorted(results, key=lambda r: r["symbol"]):
+        print("%(symbol)-8s %(days)5d %(bars)9d %(buys)6d %(sells)6d %(position)9.0f "
+              "%(realizedPnl)12.2f %(unrealizedPnl)12.2f" % result)
+
+    nBars = sum(r["bars"] for r in results)
+    print("Total realized PnL: %.2f" % sum(r["realizedPnl"] for r in results))
+    print("Replayed %d bars of %d symbols in %.2fs (%.0f bars/s)" %
+          (nBars, len(results), elapsed, nBars / elapsed if elapsed > 0 else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Renders an EventJournal written by TestApp (--journal) as text.
+
+    python JournalReader.py log/events.260105_093000.jrnl [--type TRIGGER]
+"""
+
+import argparse
+import datetime
+
+from EventJournal import EventJournal
+
+
+def main():
+    cmdLineParser = argparse.ArgumentParser("event journal reader")
+    cmdLineParser.add_argument("journal", help="journal file to render")
+    cmdLineParser.add_argument("--type", action="append", dest="types", default=None,
+                               choices=sorted(EventJournal.NAMES.values()),
+                               help="only show records of this type (repeatable)")
+    args = cmdLineParser.parse_args()
+
+    for (recType, timestampNs, fields) in EventJournal.read(args.journal):
+        if args.types and recType not in args.types:
+            continue
+        stamp = datetime.datetime.fromtimestamp(timestampNs / 1e9).strftime("%y%m%d_%H:%M:%S.%f")
+        print("%s %-12s %s" % (stamp, recType,
+                               " ".join("%s=%s" % (name, value) for (name, value) in fields.items())))
+
+
+if __name__ == "__main__":
+    main()
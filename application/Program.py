@@ -6,8 +6,11 @@ Copyright (C) 2019 Interactive Brokers LLC. All rights reserved. This code is su
 import argparse
 import datetime
 import collections
-import inspect
+import functools
 import logging
+import logging.handlers
+import queue
+import signal
 import time
 import os.path
 import threading
@@ -20,16 +23,35 @@ from ibapi.utils import iswrapper
 # types
 from ibapi.common import *
 from ibapi.contract import Contract
+from ibapi.execution import Execution, ExecutionFilter
 from ibapi.order import Order
 from ibapi.order_state import OrderState
 
 # My own modules
+from BarAggregator import BarAggregator
+from CallCounter import CallCounter
+from EventJournal import EventJournal
+from FastDecoder import FastDecoder
+from HistoricalBarStore import HistoricalBarStore
+from LatencyTracer import LatencyTracer
+from LazyQueueHandler import LazyQueueHandler
+from MetricsExporter import MetricsExporter
 from Contracts import Contracts
+from OrderStateManager import OrderStateManager
 from Orders import Orders
+from PlanCheckpoint import PlanCheckpoint
+from PlanRouter import PlanRouter
+from ReconnectSupervisor import ReconnectSupervisor
+from RequestPacer import RequestPacer
+from RiskGate import RiskGate
+from SubscriptionRegistry import SubscriptionRegistry
+from TickCoalescer import TickCoalescer
+from TimestampedQueue import TimestampedQueue
 from TradingPlan import TradingPlan
+from TradingPlanWatcher import TradingPlanWatcher
 
 
-def SetupLogger():
+def SetupLogger(logName: str = "pyibapi"):
     if not os.path.exists("log"):
         os.makedirs("log")
 
@@ -41,97 +63,90 @@ def SetupLogger():
 
     # logging.basicConfig( level=logging.DEBUG,
     #                    format=recfmt, datefmt=timefmt)
-    logging.basicConfig(filename=time.strftime("log/pyibapi.%y%m%d_%H%M%S.log"),
-                        filemode="w",
-                        level=logging.INFO,
-                        format=recfmt, datefmt=timefmt)
-    logger = logging.getLogger()
+    # The file and console handlers run on a listener thread; the threads
+    # that log only enqueue the record, so a slow disk or terminal never
+    # holds up the message loop.
+    logFile = logging.FileHandler(time.strftime("log/" + logName + ".%y%m%d_%H%M%S.log"), mode="w")
+    logFile.setFormatter(logging.Formatter(recfmt, datefmt=timefmt))
     console = logging.StreamHandler()
     console.setLevel(logging.ERROR)
-    logger.addHandler(console)
+    listener = logging.handlers.QueueListener(queue.SimpleQueue(), logFile, console,
+                                              respect_handler_level=True)
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(LazyQueueHandler(listener.queue))
+    listener.start()
+    return listener
 
 
 # ! [socket_declare]
 class TestClient(EClient):
-    def __init__(self, wrapper):
+    # Shared by all instances; only created when call counting is enabled
+    clntCallCounter = None
+
+    def __init__(self, wrapper, countCalls: bool = False):
         EClient.__init__(self, wrapper)
         # ! [socket_declare]
 
         # how many times a method is called to see test coverage
-        self.clntMeth2callCount = collections.defaultdict(int)
-        self.clntMeth2reqIdIdx = collections.defaultdict(lambda: -1)
-        self.reqId2nReq = collections.defaultdict(int)
-        self.setupDetectReqId()
-
-    def countReqId(self, methName, fn):
-        def countReqId_(*args, **kwargs):
-            self.clntMeth2callCount[methName] += 1
-            idx = self.clntMeth2reqIdIdx[methName]
-            if idx >= 0:
-                sign = -1 if 'cancel' in methName else 1
-                self.reqId2nReq[sign * args[idx]] += 1
-            return fn(*args, **kwargs)
-
-        return countReqId_
-
-    def setupDetectReqId(self):
+        if countCalls:
+            self.setupDetectReqId()
+        self.countCalls = TestClient.clntCallCounter is not None
+        if self.countCalls:
+            self.reqId2nReq = TestClient.clntCallCounter.reqId2nCall
+        else:
+            self.reqId2nReq = collections.defaultdict(int)
 
-        methods = inspect.getmembers(EClient, inspect.isfunction)
-        for (methName, meth) in methods:
-            if methName != "send_msg":
-                # don't screw up the nice automated logging in the send_msg()
-                self.clntMeth2callCount[methName] = 0
-                # logging.debug("meth %s", name)
-                sig = inspect.signature(meth)
-                for (idx, pnameNparam) in enumerate(sig.parameters.items()):
-                    (paramName, param) = pnameNparam # @UnusedVariable
-                    if paramName == "reqId":
-                        self.clntMeth2reqIdIdx[methName] = idx
+    @staticmethod
+    def setupDetectReqId():
+        if TestClient.clntCallCounter is not None:
+            return
 
-                setattr(TestClient, methName, self.countReqId(methName, meth))
+        # don't screw up the nice automated logging in the send_msg()
+        TestClient.clntCallCounter = CallCounter(EClient, skipMethods=("send_msg",))
+        TestClient.clntCallCounter.install(TestClient,
+                                           signOf=lambda methName: -1 if 'cancel' in methName else 1)
 
-                # print("TestClient.clntMeth2reqIdIdx", self.clntMeth2reqIdIdx)
+    @property
+    def clntMeth2callCount(self) -> dict:
+        if not self.countCalls:
+            return {}
+        return TestClient.clntCallCounter.callCounts()
 
 
 # ! [ewrapperimpl]
 class TestWrapper(wrapper.EWrapper):
     # ! [ewrapperimpl]
-    def __init__(self):
-        wrapper.EWrapper.__init__(self)
-
-        self.wrapMeth2callCount = collections.defaultdict(int)
-        self.wrapMeth2reqIdIdx = collections.defaultdict(lambda: -1)
-        self.reqId2nAns = collections.defaultdict(int)
-        self.setupDetectWrapperReqId()
-
-    # TODO: see how to factor this out !!
+    # Shared by all instances; only created when call counting is enabled
+    wrapCallCounter = None
 
-    def countWrapReqId(self, methName, fn):
-        def countWrapReqId_(*args, **kwargs):
-            self.wrapMeth2callCount[methName] += 1
-            idx = self.wrapMeth2reqIdIdx[methName]
-            if idx >= 0:
-                self.reqId2nAns[args[idx]] += 1
-            return fn(*args, **kwargs)
-
-        return countWrapReqId_
+    def __init__(self, countCalls: bool = False):
+        wrapper.EWrapper.__init__(self)
 
-    def setupDetectWrapperReqId(self):
+        if countCalls:
+            self.setupDetectWrapperReqId()
+        self.countWrapCalls = TestWrapper.wrapCallCounter is not None
+        if self.countWrapCalls:
+            self.reqId2nAns = TestWrapper.wrapCallCounter.reqId2nCall
+        else:
+            self.reqId2nAns = collections.defaultdict(int)
 
-        methods = inspect.getmembers(wrapper.EWrapper, inspect.isfunction)
-        for (methName, meth) in methods:
-            self.wrapMeth2callCount[methName] = 0
-            # logging.debug("meth %s", name)
-            sig = inspect.signature(meth)
-            for (idx, pnameNparam) in enumerate(sig.parameters.items()):
-                (paramName, param) = pnameNparam # @UnusedVariable
-                # we want to count the errors as 'error' not 'answer'
-                if 'error' not in methName and paramName == "reqId":
-                    self.wrapMeth2reqIdIdx[methName] = idx
+    @staticmethod
+    def setupDetectWrapperReqId():
+        if TestWrapper.wrapCallCounter is not None:
+            return
 
-            setattr(TestWrapper, methName, self.countWrapReqId(methName, meth))
+        # we want to count the errors as 'error' not 'answer'
+        TestWrapper.wrapCallCounter = CallCounter(wrapper.EWrapper,
+                                                  countReqId=lambda methName: 'error' not in methName)
+        TestWrapper.wrapCallCounter.install(TestWrapper)
 
-            # print("TestClient.wrapMeth2reqIdIdx", self.wrapMeth2reqIdIdx)
+    @property
+    def wrapMeth2callCount(self) -> dict:
+        if not self.countWrapCalls:
+            return {}
+        return TestWrapper.wrapCallCounter.callCounts()
 
 
 # this is here for documentation generation
@@ -145,26 +160,116 @@ class TestWrapper(wrapper.EWrapper):
 
 # ! [socket_init]
 class TestApp(TestWrapper, TestClient):
-    def __init__(self):
-        TestWrapper.__init__(self)
-        TestClient.__init__(self, wrapper=self)
+    # Tick-by-tick requests TWS turned down, e.g. over the subscription limit
+    TICK_BY_TICK_REJECTED = frozenset((10189, 10190))
+    # Errors after which an order is not working: duplicate ID, price,
+    # contract or validation errors, rejected, cancelled, not found
+    ORDER_REJECTED = frozenset((103, 110, 200, 201, 202, 203, 321, 10147))
+
+    def __init__(self, countCalls: bool = False, fastDecode: bool = False,
+                 traceLatency: bool = False):
+        TestWrapper.__init__(self, countCalls=countCalls)
+        TestClient.__init__(self, wrapper=self, countCalls=countCalls)
         # ! [socket_init]
         self.nKeybInt = 0
+        # Set to finish the run for good, see ReconnectSupervisor
+        self.done = False
         self.started = False
+        # Reconnects when the connection drops, see ReconnectSupervisor;
+        # resuming from the drop until the next start()
+        self.reconnector = None
+        self.resuming = False
+        # orderId -> record of the orders working when the connection
+        # dropped that the new one has not reported yet, see openOrderEnd()
+        self.resumeOrders = None
         self.nextValidOrderId = None
-        self.permId2ord = {}
+        # Our orders by orderId, permId and symbol, see OrderStateManager
+        self.orders = OrderStateManager()
         self.reqId2nErr = collections.defaultdict(int)
+        # Realtime bars per reqId, counted once a MetricsExporter sets it
+        self.reqId2nBar = None
+        self.symbol2nOrder = collections.defaultdict(int)
         self.globalCancelOnly = False
+        # Cancels all orders of the account at the first start(); off for
+        # Supervisor workers, the supervisor cancels them once for all
+        self.globalCancelAtStart = True
         self.simplePlaceOid = None
+        self.tradingPlanFile = "trading_plan.yml"
+        # Plan items get reqIds from here on
+        self.firstReqId = 8800
+        # The account orders go to, "" for the default one of the connection
+        self.account = ""
+        # When several plans share the connection, see PlanRouter: the app
+        # owning the connection, the apps of the other plans (on the owner)
+        # and their market data subscriptions
+        self.owner = None
+        self.followers = []
+        self.subscriptions = None
+        # Rolling bars and indicators per symbol when barHistoryCapacity > 0
+        self.barHistoryCapacity = 0
+        self.barHistory = None
+        # 1-minute, 5-minute and session bars per symbol when aggregateBars
+        self.aggregateBars = False
+        self.barAggregator = None
+        # reqId -> when it was subscribed, for the items whose open price
+        # comes with the first bar of the next session
+        self.awaitingSessionOpen = {}
+        # Binary journal of bars, triggers and order events, see EventJournal
+        self.journal = None
+        # Set by the TradingPlanWatcher thread, swapped in on the message thread
+        self.pendingPlanUpdate = None
+        # Seconds between two looks of the TradingPlanWatcher at the plan file
+        self.planReloadInterval = 1.
+        # Paces the market data subscriptions, pumped from the message loop
+        self.pacer = RequestPacer()
+        # Set by the Supervisor so that its workers use disjoint order IDs
+        self.orderIdAllocator = None
+        self.orderIdBlockEnd = None
+        self.nOrdersPlaced = 0
+        # Pre-trade limits the orders must pass, see RiskGate
+        self.riskGate = None
+        # Decodes realtimeBar/orderStatus/position straight from the received
+        # bytes, see FastDecoder; created once the server version is known
+        self.fastDecode = fastDecode
+        self.fastDecoder = None
+        # Daily bars from earlier runs; start() only requests the missing ones
+        self.historicalBarStore = None
+        # Item state saved every checkpointInterval seconds and after each
+        # trigger, restored by the first setupTradingPlan()
+        self.checkpoint = None
+        self.checkpointInterval = 1.0
+        self.checkpointDue = False
+        self.nextCheckpointAt = 0.
+        # priceFiveSecsAgo is only restored from a checkpoint this recent
+        self.checkpointMaxPriceAge = 10.
+        # Symbols whose restored position TWS has not reported yet
+        self.unconfirmedPositions = set()
+        # "Last", "AllLast" or "BidAsk" to run enabled items on tick-by-tick
+        # data coalesced by tickCoalescer instead of on 5-second bars
+        self.tickType = None
+        self.tickCoalescer = None
+        self.tickReqIds = set()
+        # Per-stage latency histograms from socket read to placeOrder; the
+        # queue stamps each message with when it was read and queued
+        self.tracer = None
+        if traceLatency:
+            self.tracer = LatencyTracer()
+            self.msg_queue = TimestampedQueue(self.tracer)
 
     def dumpTestCoverageSituation(self):
-        for clntMeth in sorted(self.clntMeth2callCount.keys()):
+        if not (self.countCalls or self.countWrapCalls):
+            logging.debug("Call counting is disabled, run with --count-calls to enable it")
+            return
+
+        clntMeth2callCount = self.clntMeth2callCount
+        for clntMeth in sorted(clntMeth2callCount.keys()):
             logging.debug("ClntMeth: %-30s %6d" % (clntMeth,
-                                                   self.clntMeth2callCount[clntMeth]))
+                                                   clntMeth2callCount[clntMeth]))
 
-        for wrapMeth in sorted(self.wrapMeth2callCount.keys()):
+        wrapMeth2callCount = self.wrapMeth2callCount
+        for wrapMeth in sorted(wrapMeth2callCount.keys()):
             logging.debug("WrapMeth: %-30s %6d" % (wrapMeth,
-                                                   self.wrapMeth2callCount[wrapMeth]))
+                                                   wrapMeth2callCount[wrapMeth]))
 
     def dumpReqAnsErrSituation(self):
         logging.debug("%s\t%s\t%s\t%s" % ("ReqId", "#Req", "#Ans", "#Err"))
@@ -174,11 +279,42 @@ class TestApp(TestWrapper, TestClient):
             nErr = self.reqId2nErr.get(reqId, 0)
             logging.debug("%d\t%d\t%s\t%d" % (reqId, nReq, nAns, nErr))
 
+    def dumpLatencySituation(self):
+        if self.tracer is None:
+            return
+        self.tracer.dumpDue = False
+        logging.info("Latency by stage, then tick-to-trade by symbol")
+        for line in self.tracer.report():
+            logging.info("%s", line)
+
+    def requestLatencyDump(self, *args):
+        """ SIGUSR1 handler: the message loop dumps the histograms next. """
+        if self.tracer is not None:
+            self.tracer.dumpDue = True
+
+    def shareConnectionOf(self, owner):
+        """ Sends requests over the connection of owner, which receives the
+        answers for us, see PlanRouter. Messages are paced, queued and traced
+        per connection. """
+        self.conn = owner.conn
+        self.connState = owner.connState
+        self.serverVersion_ = owner.serverVersion_
+        self.connTime = owner.connTime
+        self.clientId = owner.clientId
+        self.msg_queue = owner.msg_queue
+        self.pacer = owner.pacer
+        self.tracer = owner.tracer
+
     @iswrapper
     # ! [connectack]
     def connectAck(self):
         if self.asynchronous:
             self.startApi()
+        if self.fastDecode:
+            # The message loop decodes through it from now on
+            self.decoder = self.fastDecoder = FastDecoder(self.wrapper, self.decoder)
+        if self.tracer is not None and self.reader is not None:
+            self.msg_queue.timeReads(self.conn)
     # ! [connectack]
 
     @iswrapper
@@ -186,6 +322,13 @@ class TestApp(TestWrapper, TestClient):
     def nextValidId(self, orderId: int):
         super().nextValidId(orderId)
 
+        if self.resuming and self.nextValidOrderId is not None:
+            # Never hand out an ID of the previous connection again
+            orderId = max(orderId, self.nextValidOrderId)
+        if self.orderIdAllocator is not None:
+            self.orderIdAllocator.advanceTo(orderId)
+            (orderId, self.orderIdBlockEnd) = self.orderIdAllocator.allocate()
+
         logging.debug("setting nextValidOrderId: %d", orderId)
         self.nextValidOrderId = orderId
         print("NextValidId:", orderId)
@@ -195,13 +338,68 @@ class TestApp(TestWrapper, TestClient):
         self.start()
 
     def setupTradingPlan(self, firstTime: bool):
-        # ReqId begins at 8800
-        self.tradingPlan.parseYaml("trading_plan.yml", firstTime, 8800)
+        self.tradingPlan.parseYaml(self.tradingPlanFile, firstTime, self.firstReqId)
+        if firstTime and self.checkpoint is not None:
+            self.restoreCheckpoint()
+
+        # Build the per-symbol contracts and the order templates used by the
+        # trigger path once per (re)load
+        Contracts.CacheUSStockAtSmart(self.tradingPlan.planKeyedBySymbol.keys())
+        Orders.CacheMarketOrders()
+
+        if self.barHistoryCapacity > 0:
+            if self.barHistory is None:
+                from BarHistory import BarHistory
+                self.barHistory = BarHistory(self.tradingPlan, self.barHistoryCapacity)
+                logging.info("Bar history: %d bars per symbol, %d bytes",
+                             self.barHistoryCapacity, self.barHistory.memoryBytes())
+            else:
+                self.barHistory.load(self.tradingPlan)
+
+        if self.aggregateBars:
+            if self.barAggregator is None:
+                self.barAggregator = BarAggregator(self.tradingPlan)
+            else:
+                self.barAggregator.load(self.tradingPlan)
+
+        self.loadRiskGate()
+
         if firstTime:
             logging.critical("First time setting up the trading plan.")
         else:
             logging.critical("Refreshing trading plan.")
-        logging.critical(self.tradingPlan)
+        logging.critical(str(self.tradingPlan))
+
+    def restoreCheckpoint(self):
+        """ Warm restart: puts back the item state of today's last checkpoint.
+        The position callbacks that follow confirm or correct the positions. """
+        startedAt = time.perf_counter()
+        loaded = self.checkpoint.load()
+        if loaded is None:
+            logging.info("No checkpoint of today in %s", self.checkpoint.fileName)
+            return
+
+        (savedAt, states) = loaded
+        # The first bar would otherwise be compared against a stale price
+        restorePrice = time.time() - savedAt <= self.checkpointMaxPriceAge
+        nRestored = 0
+        for tpItem in self.tradingPlan.plan.values():
+            state = states.get(tpItem.symbol)
+            if state is None:
+                continue
+            PlanCheckpoint.restoreItem(tpItem, state, restorePrice)
+            if tpItem.positionInitialized:
+                self.unconfirmedPositions.add(tpItem.symbol)
+            nRestored += 1
+        logging.critical("Restored %d of %d plan items from the checkpoint saved %.1fs ago in %.2fms%s",
+                         nRestored, len(self.tradingPlan.plan), time.time() - savedAt,
+                         (time.perf_counter() - startedAt) * 1000,
+                         "" if restorePrice else ", without the prices")
+
+    def saveCheckpoint(self):
+        self.checkpoint.save(self.tradingPlan.plan.values())
+        self.checkpointDue = False
+        self.nextCheckpointAt = time.monotonic() + self.checkpointInterval
 
     def start(self):
         if self.started:
@@ -214,23 +412,216 @@ class TestApp(TestWrapper, TestClient):
             self.reqGlobalCancel()
         else:
             print("Executing requests")
-            # Cancel all orders
-            self.reqGlobalCancel()
-            # Request RealTime market data
-            self.reqMarketDataType(MarketDataTypeEnum.REALTIME)
-
-            # Request position updates
-            self.reqPositions()
+            # The owner of a shared connection makes these for all plans
+            if self.owner is None:
+                if self.resuming or not self.globalCancelAtStart:
+                    # Our orders kept working while we were away, or other
+                    # workers trade the account already; get their state
+                    self.reqOpenOrders()
+                else:
+                    # Cancel all orders
+                    self.reqGlobalCancel()
+                # Request RealTime market data
+                self.reqMarketDataType(MarketDataTypeEnum.REALTIME)
+
+                # Request position updates
+                self.reqPositions()
 
             queryTime = (datetime.datetime.today()).strftime("%Y%m%d %H:%M:%S")
 
             # Request market data and today's Open price
-            for reqId,v in self.tradingPlan.plan.items():
-                self.reqRealTimeBars(reqId, Contracts.USStockAtSmart(v.symbol), 5, "TRADES", True, [])
-                self.reqHistoricalData(reqId, Contracts.USStockAtSmart(v.symbol), queryTime,
-                                       "1 D", "1 day", "TRADES", 1, 1, False, [])
+            for tpItem in self.tradingPlan.plan.values():
+                self.subscribeMarketData(tpItem, queryTime)
+            self.pacer.pump()
+
+            print("Executing requests ... %d queued" % self.pacer.pending)
+
+        if self.resuming:
+            self.resuming = False
+            if self.reconnector is not None:
+                self.reconnector.resumed()
+
+    def prepareResume(self):
+        """ After the connection dropped: forgets the requests made over it, so
+        that start() makes them all again once the next connection reports
+        its nextValidId. Plan items, positions and orders are kept; ticks not
+        evaluated yet are not, they may be long stale by then. """
+        self.started = False
+        self.resuming = True
+        self.resumeOrders = {record.orderId: record for working in self.orders.workingBySymbol.values()
+                             for record in working.values()}
+        self.pacer.reset()
+        self.tickReqIds.clear()
+        if self.tickCoalescer is not None:
+            self.tickCoalescer.clear()
+        if self.subscriptions is not None and self.owner is None:
+            self.subscriptions.clear()
+        for app in self.followers:
+            app.prepareResume()
+
+    def subscribeMarketData(self, tpItem, queryTime: str):
+        """ Queues the subscriptions with the pacer; enabled symbols go first.
+        Today's open price is only requested if the bar store lacks it and,
+        with bar aggregation, the session is under way: otherwise the first
+        bar of the session brings it. """
+        contract = Contracts.CachedUSStockAtSmart(tpItem.symbol)
+        priority = 0 if tpItem.enabled else 1
+        if self.tickType is not None and tpItem.enabled:
+            self.tickReqIds.add(tpItem.reqId)
+            reqId = self.marketDataReqId(tpItem, self.tickType)
+            if reqId is not None:
+                self.pacer.submit(RequestPacer.TICK_BY_TICK, reqId,
+                                  functools.partial(self.reqTickByTickData, reqId, contract,
+                                                    self.tickType, 0, False),
+                                  priority)
+        else:
+            self.subscribeRealTimeBars(tpItem, priority)
+        # Known already when restored from a checkpoint
+        if tpItem.todayOpenPrice is not None:
+            return
+        if self.historicalBarStore is not None:
+            bars = self.historicalBarStore.bars(tpItem.symbol, "1 day", queryTime[:8])
+            if bars:
+                tpItem.todayOpenPrice = bars[-1].open
+                logging.info("Set %s Open price to %f from the bar store", tpItem.symbol, bars[-1].open)
+                return
+        # Bid/ask ticks carry no trades to aggregate
+        if (self.barAggregator is not None and not self.barAggregator.inSession(time.time()) and
+            not (self.tickType == "BidAsk" and tpItem.reqId in self.tickReqIds)):
+            self.awaitingSessionOpen[tpItem.reqId] = time.time()
+            return
+        self.pacer.submit(RequestPacer.HISTORICAL_DATA, tpItem.reqId,
+                          functools.partial(self.reqHistoricalData, tpItem.reqId, contract, queryTime,
+                                            "1 D", "1 day", "TRADES", 1, 1, False, []),
+                          priority)
+
+    def subscribeRealTimeBars(self, tpItem, priority: int):
+        reqId = self.marketDataReqId(tpItem, SubscriptionRegistry.BARS)
+        if reqId is None:
+            return
+        contract = Contracts.CachedUSStockAtSmart(tpItem.symbol)
+        self.pacer.submit(RequestPacer.REALTIME_BARS, reqId,
+                          functools.partial(self.reqRealTimeBars, reqId, contract,
+                                            5, "TRADES", True, []),
+                          priority)
+
+    def marketDataReqId(self, tpItem, kind: str):
+        """ The reqId to request the bars or ticks of tpItem under; None if
+        the item of another plan on the connection has requested them. """
+        if self.subscriptions is None:
+            return tpItem.reqId
+        (reqId, isNew) = self.subscriptions.subscribe((kind, tpItem.symbol), self, tpItem.reqId)
+        return reqId if isNew else None
+
+    def cancelMarketData(self, reqId: TickerId):
+        """ Cancels the market data of the item of reqId, or drops its
+        requests the pacer has not sent yet. A subscription shared with other
+        plans is cancelled with its last subscriber. """
+        wasSent = self.pacer.discard(reqId)
+        isTicks = reqId in self.tickReqIds
+        self.tickReqIds.discard(reqId)
+        if self.subscriptions is not None:
+            reqId = self.subscriptions.unsubscribe(self, reqId)
+            if reqId is None:
+                return
+            wasSent = self.pacer.discard(reqId)
+        if not wasSent:
+            return
+        if isTicks:
+            self.cancelTickByTickData(reqId)
+        else:
+            self.cancelRealTimeBars(reqId)
 
-            print("Executing requests ... finished")
+    def prepareTradingPlanReload(self, fileName: str):
+        """ Runs on the TradingPlanWatcher thread: parses and diffs the file
+        and leaves the new snapshot for the message thread to swap in. """
+        # Diff against the plan that is live, not one that is about to be replaced
+        while self.pendingPlanUpdate is not None:
+            time.sleep(self.planReloadInterval)
+
+        update = self.tradingPlan.diffYaml(fileName)
+        if update.isEmpty():
+            logging.info("Trading plan %s saved without changes", fileName)
+            return
+
+        # Contracts for the new symbols are built here, off the message thread
+        for tpItem in update.added:
+            Contracts.CachedUSStockAtSmart(tpItem.symbol)
+        self.pendingPlanUpdate = update
+
+    def applyPendingPlanUpdate(self):
+        """ Swaps in the snapshot prepared by prepareTradingPlanReload().
+        Runs on the message thread between two messages, so realtimeBar never
+        sees a half-updated plan and needs no lock. """
+        update = self.pendingPlanUpdate
+        update.apply()
+        self.tradingPlan = update.plan
+        self.pendingPlanUpdate = None
+
+        if self.barHistory is not None:
+            self.barHistory.load(self.tradingPlan)
+        if self.barAggregator is not None:
+            self.barAggregator.load(self.tradingPlan)
+        self.loadRiskGate()
+
+        if self.started and not self.globalCancelOnly:
+            for tpItem in update.removed:
+                self.cancelMarketData(tpItem.reqId)
+            queryTime = (datetime.datetime.today()).strftime("%Y%m%d %H:%M:%S")
+            for tpItem in update.added:
+                self.subscribeMarketData(tpItem, queryTime)
+
+        logging.critical("Refreshed trading plan: %s", update)
+        logging.critical(str(self.tradingPlan))
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            if self.fastDecoder is not None:
+                logging.info("%s", self.fastDecoder.report())
+
+    def msgLoopTmo(self):
+        if self.pendingPlanUpdate is not None:
+            self.applyPendingPlanUpdate()
+        # The pacer and tracer of a shared connection are those of owner,
+        # which runs them once for all plans
+        if self.owner is None:
+            self.pumpConnection()
+        if self.tickCoalescer is not None and self.tickCoalescer.due(time.time(), not self.msg_queue.empty()):
+            self.flushTicks()
+        if self.checkpoint is not None and (self.checkpointDue or time.monotonic() >= self.nextCheckpointAt):
+            self.saveCheckpoint()
+        if self.historicalBarStore is not None and self.historicalBarStore.nPending:
+            self.historicalBarStore.flush()
+        if self.owner is None and self.tracer is not None and self.tracer.dumpDue:
+            self.dumpLatencySituation()
+        for app in self.followers:
+            app.msgLoopTmo()
+
+    def msgLoopRec(self):
+        if self.pendingPlanUpdate is not None:
+            self.applyPendingPlanUpdate()
+        if self.owner is None:
+            self.pumpConnection()
+        if self.tickCoalescer is not None and self.tickCoalescer.due(time.time(), not self.msg_queue.empty()):
+            self.flushTicks()
+        if self.checkpoint is not None and (self.checkpointDue or time.monotonic() >= self.nextCheckpointAt):
+            self.saveCheckpoint()
+        if self.owner is None and self.tracer is not None:
+            self.tracer.messageDone()
+            if self.tracer.dumpDue:
+                self.dumpLatencySituation()
+        for app in self.followers:
+            app.msgLoopRec()
+
+    def pumpConnection(self):
+        """ Sends the requests the pacer lets through now, for every plan
+        on the connection. """
+        if self.pacer.pending:
+            self.pacer.pump()
+        elif self.reconnector is not None and self.reconnector.resubscribing:
+            self.reconnector.resubscribed()
 
     def keyboardInterrupt(self):
         self.nKeybInt += 1
@@ -242,13 +633,19 @@ class TestApp(TestWrapper, TestClient):
 
     def stop(self):
         print("Executing cancels")
+        self.pacer.clear()
         for reqId, v in self.tradingPlan.plan.items():
-            self.cancelRealTimeBars(reqId)
+            self.cancelMarketData(reqId)
+        for app in self.followers:
+            app.stop()
         print("Executing cancels ... finished")
 
     def nextOrderId(self):
+        if self.orderIdBlockEnd is not None and self.nextValidOrderId >= self.orderIdBlockEnd:
+            (self.nextValidOrderId, self.orderIdBlockEnd) = self.orderIdAllocator.allocate()
         oid = self.nextValidOrderId
         self.nextValidOrderId += 1
+        self.nOrdersPlaced += 1
         return oid
 
     @iswrapper
@@ -259,160 +656,378 @@ class TestApp(TestWrapper, TestClient):
                     whyHeld: str, mktCapPrice: float):
         super().orderStatus(orderId, status, filled, remaining,
                             avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice)
-        print("OrderStatus. Id:", orderId, "Status:", status, "Filled:", filled,
-              "Remaining:", remaining, "AvgFillPrice:", avgFillPrice,
-              "PermId:", permId, "ParentId:", parentId, "LastFillPrice:",
-              lastFillPrice, "ClientId:", clientId, "WhyHeld:",
-              whyHeld, "MktCapPrice:", mktCapPrice)
+        logging.info("OrderStatus. Id: %s Status: %s Filled: %s Remaining: %s AvgFillPrice: %s"
+                     " PermId: %s ParentId: %s LastFillPrice: %s ClientId: %s WhyHeld: %s MktCapPrice: %s",
+                     orderId, status, filled, remaining, avgFillPrice, permId, parentId,
+                     lastFillPrice, clientId, whyHeld, mktCapPrice)
+        if self.journal is not None:
+            self.journal.orderStatus(orderId, status, filled, remaining, avgFillPrice)
+        if self.resumeOrders:
+            self.resumeOrders.pop(orderId, None)
+
+        (record, finished) = self.orders.orderStatus(orderId, status, filled, remaining,
+                                                     avgFillPrice, permId, lastFillPrice)
+        if finished:
+            self.orderFinished(record)
     # ! [orderstatus]
 
+    @iswrapper
+    # ! [openorder]
+    def openOrder(self, orderId: OrderId, contract: Contract, order: Order,
+                  orderState: OrderState):
+        super().openOrder(orderId, contract, order, orderState)
+        if self.resumeOrders:
+            self.resumeOrders.pop(orderId, None)
+        (record, finished) = self.orders.openOrder(orderId, contract, order, orderState)
+        if finished:
+            self.orderFinished(record)
+    # ! [openorder]
+
+    @iswrapper
+    # ! [openorderend]
+    def openOrderEnd(self):
+        super().openOrderEnd()
+        # Our orders that stopped working while we were away: their
+        # executions tell whether they filled
+        if not self.resumeOrders:
+            self.resumeOrders = None
+            return
+        logging.warning("%d order(s) no longer open after the reconnect: %s, requesting the executions",
+                        len(self.resumeOrders), sorted(self.resumeOrders))
+        self.reqExecutions(self.firstReqId, ExecutionFilter())
+    # ! [openorderend]
+
+    @iswrapper
+    # ! [execdetails]
+    def execDetails(self, reqId: int, contract: Contract, execution: Execution):
+        super().execDetails(reqId, contract, execution)
+        logging.info("ExecDetails. ReqId: %s Symbol: %s Side: %s Shares: %s Price: %s OrderId: %s ExecId: %s",
+                     reqId, contract.symbol, execution.side, execution.shares, execution.price,
+                     execution.orderId, execution.execId)
+
+        quantity = self.orders.execution(contract, execution)
+        tpItem = self.tradingPlan.planKeyedBySymbol.get(contract.symbol)
+        if quantity == 0 or tpItem is None:
+            return
+
+        # Move the position now, unless the position callback has already
+        # reported this fill; it confirms it otherwise
+        tpItem.lastPos = tpItem.latestPos
+        tpItem.latestPos += quantity
+        if self.riskGate is not None and not self.orders.hasWorkingOrder(contract.symbol):
+            self.riskGate.setPosition(contract.symbol, tpItem.latestPos)
+    # ! [execdetails]
+
+    @iswrapper
+    # ! [execdetailsend]
+    def execDetailsEnd(self, reqId: int):
+        super().execDetailsEnd(reqId)
+        if reqId != self.firstReqId or self.resumeOrders is None:
+            return
+        for record in self.resumeOrders.values():
+            status = "Filled" if record.executed >= record.totalQuantity else "Cancelled"
+            if self.orders.setStatus(record, status):
+                logging.warning("Order %d of %s ended while disconnected: %s %s of %s",
+                                record.orderId, record.symbol, status, record.executed, record.totalQuantity)
+                self.orderFinished(record)
+        self.resumeOrders = None
+    # ! [execdetailsend]
+
+    def orderFinished(self, record):
+        logging.info("Order %d of %s is done: %s", record.orderId, record.symbol, record.status)
+        tpItem = self.tradingPlan.planKeyedBySymbol.get(record.symbol)
+        if self.riskGate is not None:
+            # What did not fill no longer counts against the limits
+            self.riskGate.orderFinished(record, tpItem.latestPos if tpItem is not None else None)
+
     @iswrapper
     # ! [position]
     def position(self, account: str, contract: Contract, position: float,
                  avgCost: float):
         super().position(account, contract, position, avgCost)
-        print("Position.", "Account:", account, "Symbol:", contract.symbol, "SecType:",
-              contract.secType, "Currency:", contract.currency,
-              "Position:", position, "Avg cost:", avgCost)
-
-        tpItem = self.tradingPlan.planKeyedBySymbol[contract.symbol]
+        logging.info("Position. Account: %s Symbol: %s SecType: %s Currency: %s Position: %s Avg cost: %s",
+                     account, contract.symbol, contract.secType, contract.currency, position, avgCost)
+        if self.journal is not None:
+            self.journal.position(contract.symbol, position, avgCost)
 
         tpItem = None
         if contract.symbol in self.tradingPlan.planKeyedBySymbol:
             tpItem = self.tradingPlan.planKeyedBySymbol[contract.symbol]
+        elif not self.tradingPlan.inShard(contract.symbol):
+            # Another Supervisor worker trades this one
+            return
         else:
-            logging.error("ERROR: {}. Cannot find item in trading plan matching symbol={}".format(__name__, contract.symbol))
+            logging.error("ERROR: %s. Cannot find item in trading plan matching symbol=%s", __name__, contract.symbol)
             return
 
+        if contract.symbol in self.unconfirmedPositions:
+            self.unconfirmedPositions.discard(contract.symbol)
+            if position != tpItem.latestPos:
+                logging.warning("Position of %s is %s, the checkpoint had %s",
+                                contract.symbol, position, tpItem.latestPos)
+
+        # Fills execDetails has reported, but the position does not include yet
+        unreported = self.orders.positionReported(contract.symbol, position)
+
         # Update position info
         if (tpItem.positionInitialized):
             tpItem.lastPos     = tpItem.latestPos
-            tpItem.latestPos   = position
+            tpItem.latestPos   = position + unreported
         else:
             tpItem.positionInitialized = True
             tpItem.lastPos   = position
             tpItem.latestPos = position
-            logging.critical("lastPos & latestPos of {} is initialized to {}".format(tpItem.symbol, position))
+            logging.critical("lastPos & latestPos of %s is initialized to %s", tpItem.symbol, position)
+
+        if self.riskGate is not None and not self.orders.hasWorkingOrder(contract.symbol):
+            # A working order is booked as filled already
+            self.riskGate.setPosition(contract.symbol, tpItem.latestPos)
 
     # ! [position]
 
+    @iswrapper
+    # ! [positionend]
+    def positionEnd(self):
+        super().positionEnd()
+        # The symbols TWS did not report are flat
+        self.orders.positionsEnd(self.tradingPlan.planKeyedBySymbol)
+    # ! [positionend]
+
     @iswrapper
     # ! [realtimebar]
     def realtimeBar(self, reqId: TickerId, time:int, open_: float, high: float, low: float, close: float,
                         volume: int, wap: float, count: int):
+        if self.tracer is not None:
+            receivedAt = self.tracer.priceReceived(reqId)
         super().realtimeBar(reqId, time, open_, high, low, close, volume, wap, count)
+        if self.reqId2nBar is not None:
+            self.reqId2nBar[reqId] += 1
+
+        if self.journal is not None:
+            self.journal.bar(reqId, time, open_, high, low, close, volume, wap, count)
+
+        if self.barHistory is not None:
+            self.barHistory.addBar(reqId, time, open_, high, low, close, volume, wap)
+
+        if (self.barAggregator is not None and
+            self.barAggregator.addBar(reqId, time, open_, high, low, close, volume, wap) and
+            reqId in self.awaitingSessionOpen):
+            self.takeSessionOpen(reqId)
+
+        self.evaluatePrice(reqId, close)
+
+        if self.tracer is not None:
+            self.tracer.priceEvaluated(receivedAt)
+
+    # ! [realtimebar]
+
+    @iswrapper
+    def tickByTickAllLast(self, reqId: int, tickType: int, time: int, price: float, size: int,
+                          tickAttribLast: TickAttribLast, exchange: str, specialConditions: str):
+        if self.tracer is not None:
+            self.tracer.priceReceived(reqId)
+        super().tickByTickAllLast(reqId, tickType, time, price, size, tickAttribLast, exchange,
+                                  specialConditions)
+        if (self.barAggregator is not None and
+            self.barAggregator.addBar(reqId, time, price, price, price, price, size, price) and
+            reqId in self.awaitingSessionOpen):
+            self.takeSessionOpen(reqId)
+        self.tickCoalescer.add(reqId, price)
 
+    @iswrapper
+    def tickByTickBidAsk(self, reqId: int, time: int, bidPrice: float, askPrice: float,
+                         bidSize: int, askSize: int, tickAttribBidAsk: TickAttribBidAsk):
+        if self.tracer is not None:
+            self.tracer.priceReceived(reqId)
+        super().tickByTickBidAsk(reqId, time, bidPrice, askPrice, bidSize, askSize, tickAttribBidAsk)
+        if bidPrice > 0 and askPrice > 0:
+            self.tickCoalescer.add(reqId, (bidPrice + askPrice) / 2)
+
+    def takeSessionOpen(self, reqId: TickerId):
+        # Pre-market trades still belong to the previous session
+        if self.barAggregator.bar(reqId, "session")[0] < self.awaitingSessionOpen[reqId]:
+            return
+        del self.awaitingSessionOpen[reqId]
+        tpItem = self.tradingPlan.plan.get(reqId)
+        if tpItem is not None and tpItem.todayOpenPrice is None:
+            tpItem.todayOpenPrice = self.barAggregator.sessionOpen(reqId)
+            logging.critical("Set %s Open price to %f from the first bar of the session",
+                             tpItem.symbol, tpItem.todayOpenPrice)
+            self.checkpointDue = True
+
+    def flushTicks(self):
+        """ Evaluates the latest price of each symbol that ticked. """
+        for (reqId, price) in self.tickCoalescer.drain(time.time()):
+            self.evaluatePrice(reqId, price)
+
+    def evaluatePrice(self, reqId: TickerId, close: float):
+        """ Runs the buy and sell rules of the item of reqId on close, the
+        close of a bar or the latest coalesced tick. """
         tpItem = None
         if reqId in self.tradingPlan.plan:
             tpItem = self.tradingPlan.plan[reqId]
         else:
-            logging.error("ERROR: {}. Cannot find item in trading plan matching reqId={}".format(__name__, reqId))
+            logging.error("ERROR: %s. Cannot find item in trading plan matching reqId=%s", __name__, reqId)
             return
 
-        targetBuyPrice  = tpItem.targetBuyPrice
-        targetSellPrice = tpItem.targetSellPrice
-
         # If we've tried more than X times to establish a position, we'll clear
         # our target position, so we'd stay away from the stock for a while.
         if (tpItem.buyAttempted >= tpItem.buyAttemptLimit and
             tpItem.targetLongPos > 0):
 
-            logging.critical(f"Resetting targetLongPos for {tpItem.symbol} to 0; buyAttempted is {tpItem.buyAttempted}")
+            logging.critical("Resetting targetLongPos for %s to 0; buyAttempted is %d", tpItem.symbol, tpItem.buyAttempted)
             tpItem.targetLongPos = 0
 
         if (tpItem.sellAttempted >= tpItem.sellAttemptLimit and
             tpItem.targetShortPos < 0):
 
-            logging.critical(f"Resetting targetShortPos for {tpItem.symbol} to 0; sellAttempted is {tpItem.sellAttempted}")
+            logging.critical("Resetting targetShortPos for %s to 0; sellAttempted is %d", tpItem.symbol, tpItem.sellAttempted)
             tpItem.targetShortPos   = 0
 
-        # Detect price movement with reference to the price target
-        # Buy
-        if (tpItem.enabled and
-            tpItem.latestPos < tpItem.targetLongPos and
-            tpItem.priceFiveSecsAgo is not None and
-            close >= targetBuyPrice and
-            close >= tpItem.priceFiveSecsAgo and
-            targetBuyPrice >= tpItem.priceFiveSecsAgo):
-
-            ## Cancel the open order. Maybe the order has not been filled already.
-            #if (tpItem.lastOrderId is not None):
-            #    self.cancelOrder(tpItem.lastOrderId)
-
-            # Place a buy order
-            myContract  = Contracts.USStockAtSmart(tpItem.symbol)
-            myOrderId   = self.nextOrderId()
-            myOrderSize = tpItem.targetLongPos - tpItem.latestPos
-            #myOrder     = Orders.PeggedToMarket("BUY", myOrderSize, 0.1)
-            myOrder     = Orders.MarketOrder("BUY", myOrderSize)
-
-            self.placeOrder(myOrderId, myContract, myOrder)
-
-            tpItem.lastOrderId = myOrderId
-
-            # Increment buy attempt count
-            tpItem.buyAttempted += 1
-
-            logging.critical("@@@ BUY {} is triggered. "
-                             " current price={}"
-                             " targetBuyPrice={}"
-                             " priceFiveSecsAgo={}"
-                             " targetLongPos={}"
-                             " latestPos={}"
-                             " buyAttempted={}".format(tpItem.symbol,
-                                                        close,
-                                                        targetBuyPrice,
-                                                        tpItem.priceFiveSecsAgo,
-                                                        tpItem.targetLongPos,
-                                                        tpItem.latestPos,
-                                                        tpItem.buyAttempted))
-
-        # Sell
-        if (tpItem.enabled and
-            tpItem.latestPos > tpItem.targetShortPos and
-            tpItem.priceFiveSecsAgo is not None and
-            close < targetSellPrice and
-            close < tpItem.priceFiveSecsAgo and
-            targetSellPrice <= tpItem.priceFiveSecsAgo):
-
-            ## Cancel the open order. Maybe the order has not been filled already.
-            #if (tpItem.lastOrderId != None):
-            #    self.cancelOrder(tpItem.lastOrderId)
-
-            # Place a sell order
-            myContract  = Contracts.USStockAtSmart(tpItem.symbol)
-            myOrderId   = self.nextOrderId()
-            myOrderSize = tpItem.latestPos - tpItem.targetShortPos
-            myOrder     = Orders.MarketOrder("SELL", myOrderSize)
-
-            self.placeOrder(myOrderId, myContract, myOrder)
-
-            tpItem.lastOrderId = myOrderId
-
-            # Increment sell attempt count
-            tpItem.sellAttempted += 1
-
-            logging.critical("@@@ SELL {} is triggered."
-                   " current price={}"
-                   " targetSellPrice={}"
-                   " priceFiveSecsAgo={}"
-                   " targetShortPos={}"
-                   " latestPos={}"
-                   " sellAttempted={}".format(tpItem.symbol,
-                                              close,
-                                              targetSellPrice,
-                                              tpItem.priceFiveSecsAgo,
-                                              tpItem.targetShortPos,
-                                              tpItem.latestPos,
-                                              tpItem.sellAttempted))
+        # Detect price movement with the buy and sell rules of the item; by
+        # default, crossing the price target, see RuleCompiler. Either
+        # trigger leaves an order working, which holds the other one back.
+        priceFiveSecsAgo = tpItem.priceFiveSecsAgo
+        if tpItem.enabled and priceFiveSecsAgo is not None:
+            try:
+                side = tpItem.signal(tpItem, close, priceFiveSecsAgo)
+            except (ArithmeticError, TypeError, ValueError) as e:
+                # E.g. a rule dividing by latestPos while it is 0
+                logging.error("ERROR: rules of %s failed on close=%s: %s", tpItem.symbol, close, e)
+                side = 0
+            if side and not self.orders.hasWorkingOrder(tpItem.symbol):
+                if side > 0:
+                    self.triggerBuy(tpItem, close, priceFiveSecsAgo)
+                else:
+                    self.triggerSell(tpItem, close, priceFiveSecsAgo)
 
         if tpItem.priceFiveSecsAgo is None:
-            logging.critical("priceFiveSecsAgo of {} is initialized to {}".format(tpItem.symbol, close))
+            logging.critical("priceFiveSecsAgo of %s is initialized to %s", tpItem.symbol, close)
 
         # Update priceFiveSecsAgo
         tpItem.priceFiveSecsAgo = close
 
-    # ! [realtimebar]
+    def placePlanOrder(self, tpItem, orderId: OrderId, contract: Contract, order: Order):
+        if self.account:
+            order.account = self.account
+        self.symbol2nOrder[tpItem.symbol] += 1
+        if self.tracer is None:
+            self.placeOrder(orderId, contract, order)
+            return
+        placingAt = self.tracer.orderPlacing(tpItem.reqId)
+        self.placeOrder(orderId, contract, order)
+        self.tracer.orderPlaced(tpItem.reqId, tpItem.symbol, placingAt)
+
+    def triggerBuy(self, tpItem, close: float, priceFiveSecsAgo: float):
+        ## Cancel the open order. Maybe the order has not been filled already.
+        #if (tpItem.lastOrderId is not None):
+        #    self.cancelOrder(tpItem.lastOrderId)
+
+        # Place a buy order
+        myOrderSize = tpItem.targetLongPos - tpItem.latestPos
+        if self.riskGate is not None:
+            reason = self.riskGate.check(tpItem, myOrderSize, close)
+            if reason is not None:
+                self.riskGateRefused(tpItem, "BUY", myOrderSize, reason)
+                return
+        myContract  = Contracts.CachedUSStockAtSmart(tpItem.symbol)
+        myOrderId   = self.nextOrderId()
+        if self.riskGate is not None:
+            self.riskGate.placed(myOrderId, close)
+        #myOrder     = Orders.PeggedToMarket("BUY", myOrderSize, 0.1)
+        myOrder     = Orders.MarketOrderFromTemplate("BUY", myOrderSize)
+
+        # Registered first, the fill may be reported before placeOrder returns
+        self.orders.placed(myOrderId, tpItem.symbol, "BUY", myOrderSize)
+        self.placePlanOrder(tpItem, myOrderId, myContract, myOrder)
+
+        tpItem.lastOrderId = myOrderId
+
+        # Increment buy attempt count
+        tpItem.buyAttempted += 1
+        self.checkpointDue = True
+
+        if self.journal is not None:
+            self.journal.trigger(myOrderId, tpItem.symbol, "BUY", myOrderSize, close, priceFiveSecsAgo)
+
+        logging.critical("@@@ BUY %s is triggered. "
+                         " current price=%s"
+                         " targetBuyPrice=%s"
+                         " priceFiveSecsAgo=%s"
+                         " targetLongPos=%s"
+                         " latestPos=%s"
+                         " buyAttempted=%s", tpItem.symbol,
+                                             close,
+                                             tpItem.targetBuyPrice,
+                                             priceFiveSecsAgo,
+                                             tpItem.targetLongPos,
+                                             tpItem.latestPos,
+                                             tpItem.buyAttempted)
+
+    def triggerSell(self, tpItem, close: float, priceFiveSecsAgo: float):
+        ## Cancel the open order. Maybe the order has not been filled already.
+        #if (tpItem.lastOrderId != None):
+        #    self.cancelOrder(tpItem.lastOrderId)
+
+        # Place a sell order
+        myOrderSize = tpItem.latestPos - tpItem.targetShortPos
+        if self.riskGate is not None:
+            reason = self.riskGate.check(tpItem, -myOrderSize, close)
+            if reason is not None:
+                self.riskGateRefused(tpItem, "SELL", myOrderSize, reason)
+                return
+        myContract  = Contracts.CachedUSStockAtSmart(tpItem.symbol)
+        myOrderId   = self.nextOrderId()
+        if self.riskGate is not None:
+            self.riskGate.placed(myOrderId, close)
+        myOrder     = Orders.MarketOrderFromTemplate("SELL", myOrderSize)
+
+        # Registered first, the fill may be reported before placeOrder returns
+        self.orders.placed(myOrderId, tpItem.symbol, "SELL", myOrderSize)
+        self.placePlanOrder(tpItem, myOrderId, myContract, myOrder)
+
+        tpItem.lastOrderId = myOrderId
+
+        # Increment sell attempt count
+        tpItem.sellAttempted += 1
+        self.checkpointDue = True
+
+        if self.journal is not None:
+            self.journal.trigger(myOrderId, tpItem.symbol, "SELL", myOrderSize, close, priceFiveSecsAgo)
+
+        logging.critical("@@@ SELL %s is triggered."
+               " current price=%s"
+               " targetSellPrice=%s"
+               " priceFiveSecsAgo=%s"
+               " targetShortPos=%s"
+               " latestPos=%s"
+               " sellAttempted=%s", tpItem.symbol,
+                                    close,
+                                    tpItem.targetSellPrice,
+                                    priceFiveSecsAgo,
+                                    tpItem.targetShortPos,
+                                    tpItem.latestPos,
+                                    tpItem.sellAttempted)
+
+    def loadRiskGate(self):
+        # MAX_NOTIONAL in the plan is a limit of its own, even with none on
+        # the command line
+        if self.riskGate is None and any(item.maxNotional is not None
+                                         for item in self.tradingPlan.plan.values()):
+            self.riskGate = RiskGate()
+        if self.riskGate is not None:
+            self.riskGate.load(self.tradingPlan)
+
+    def riskGateRefused(self, tpItem, action: str, quantity: float, reason: str):
+        # Still an attempt, so a symbol held back by a limit gives up at its
+        # attempt limit
+        if action == "BUY":
+            tpItem.buyAttempted += 1
+        else:
+            tpItem.sellAttempted += 1
+        self.checkpointDue = True
+        logging.critical("@@@ %s %s of %s refused by the risk gate: %s",
+                         action, quantity, tpItem.symbol, reason)
 
     @iswrapper
     # ! [historicaldata]
@@ -421,33 +1036,196 @@ class TestApp(TestWrapper, TestClient):
         if reqId in self.tradingPlan.plan:
             tpItem = self.tradingPlan.plan[reqId]
         else:
-            logging.error("ERROR: {}. Cannot find item in trading plan matching reqId={}".format(__name__, reqId))
+            logging.error("ERROR: %s. Cannot find item in trading plan matching reqId=%s", __name__, reqId)
             return
 
         if (tpItem.todayOpenPrice == None):
             tpItem.todayOpenPrice = bar.open
-            logging.critical("Set %s Open price to %f" % (tpItem.symbol, bar.open))
+            logging.critical("Set %s Open price to %f", tpItem.symbol, bar.open)
+        if self.historicalBarStore is not None:
+            self.historicalBarStore.put(tpItem.symbol, "1 day", bar)
         super().historicalData(reqId, bar)
     # ! [historicaldata]
 
+    @iswrapper
+    # ! [historicaldataend]
+    def historicalDataEnd(self, reqId: int, start: str, end: str):
+        super().historicalDataEnd(reqId, start, end)
+        self.pacer.done(RequestPacer.HISTORICAL_DATA, reqId)
+    # ! [historicaldataend]
+
+    @iswrapper
+    # ! [error]
+    def error(self, reqId: TickerId, errorCode: int, errorString: str):
+        super().error(reqId, errorCode, errorString)
+        self.reqId2nErr[reqId] += 1
+        if self.pacer.onError(reqId, errorCode, errorString):
+            logging.warning("Request %d was paced out (%d: %s), queued again",
+                            reqId, errorCode, errorString)
+        elif errorCode in self.TICK_BY_TICK_REJECTED and reqId in self.tickReqIds:
+            self.pacer.done(RequestPacer.TICK_BY_TICK, reqId)
+            self.tickByTickRejected(reqId, errorCode, errorString)
+        elif errorCode in self.ORDER_REJECTED and reqId in self.orders.byOrderId:
+            (record, finished) = self.orders.rejected(reqId)
+            if finished:
+                logging.warning("Order %d of %s rejected (%d: %s)", reqId, record.symbol, errorCode, errorString)
+                self.orderFinished(record)
+    # ! [error]
+
+    def tickByTickRejected(self, reqId: TickerId, errorCode: int, errorString: str):
+        tpItem = self.tradingPlan.plan.get(reqId)
+        self.tickReqIds.discard(reqId)
+        if tpItem is not None:
+            logging.warning("No tick-by-tick data for %s (%d: %s), using realtime bars",
+                            tpItem.symbol, errorCode, errorString)
+            self.subscribeRealTimeBars(tpItem, 0)
+
+
+def addAppArguments(cmdLineParser):
+    # Paper trading port number: 7497
+    # Live trading port number:  7496
+    cmdLineParser.add_argument("-p", "--port", action="store", type=int,
+                               dest="port", default=7496, help="The TCP port to use")
+    cmdLineParser.add_argument("--host", action="store", dest="host",
+                               default="127.0.0.1", help="The host running TWS")
+    cmdLineParser.add_argument("--client-id", action="store", type=int, dest="client_id",
+                               default=95131, help="The API client ID")
+    cmdLineParser.add_argument("--plan", action="store", dest="plan",
+                               default="trading_plan.yml", help="The trading plan file")
+    cmdLineParser.add_argument("--account", action="store", dest="account",
+                               default="", help="the account to trade the plan in, by default that of the login")
+    cmdLineParser.add_argument("-c", "--count-calls", action="store_true", dest="count_calls",
+                               default=False, help="count EClient/EWrapper calls for the exit-time coverage reports")
+    cmdLineParser.add_argument("--bar-history", action="store", type=int, dest="bar_history",
+                               default=0, help="keep this many recent bars and rolling indicators per symbol (needs numpy)")
+    cmdLineParser.add_argument("--aggregate-bars", action="store_true", dest="aggregate_bars",
+                               default=False, help="build 1-minute, 5-minute and session bars from the realtime bars; "
+                                                   "before the session the open price is taken from its first bar")
+    cmdLineParser.add_argument("-f", "--fast-decode", action="store_true", dest="fast_decode",
+                               default=False, help="decode realtime bars, order status and positions on a fast path")
+    cmdLineParser.add_argument("--history-store", action="store", dest="history_store",
+                               default="history", help="directory of the historical bar store, empty to disable it")
+    cmdLineParser.add_argument("--checkpoint", action="store", dest="checkpoint",
+                               default="log/plan_state.ckpt", help="file the plan item state is checkpointed to, empty to disable it")
+    cmdLineParser.add_argument("--tick-by-tick", action="store", dest="tick_by_tick",
+                               choices=("Last", "AllLast", "BidAsk"), default=None,
+                               help="evaluate enabled symbols on tick-by-tick data of this type instead of 5-second bars")
+    cmdLineParser.add_argument("--tick-window", action="store", type=float, dest="tick_window",
+                               default=0., help="seconds of ticks coalesced per evaluation, 0 for every tick "
+                                                "the message loop keeps up with, 5 for the cadence of the bars")
+    cmdLineParser.add_argument("-t", "--trace-latency", action="store_true", dest="trace_latency",
+                               default=False, help="keep latency histograms from socket read to placeOrder, "
+                                                   "logged at exit and on SIGUSR1")
+    cmdLineParser.add_argument("-j", "--journal", action="store_true", dest="journal",
+                               default=False, help="record bars, triggers and order events in log/events.*.jrnl")
+    cmdLineParser.add_argument("--max-notional", action="store", type=float, dest="max_notional",
+                               default=0., help="refuse orders taking a symbol's position over this notional, "
+                                                "unless its MAX_NOTIONAL says otherwise; 0 for no limit")
+    cmdLineParser.add_argument("--max-account-notional", action="store", type=float, dest="max_account_notional",
+                               default=0., help="refuse orders once those placed in the account reach this notional")
+    cmdLineParser.add_argument("--max-order-rate", action="store", type=float, dest="max_order_rate",
+                               default=0., help="refuse orders beyond this many per second in the account")
+    cmdLineParser.add_argument("--price-band", action="store", type=float, dest="price_band",
+                               default=0., help="refuse orders priced further than this fraction from today's open")
+    cmdLineParser.add_argument("--max-exposure", action="store", type=float, dest="max_exposure",
+                               default=0., help="refuse orders taking the notional of all positions over this")
+    cmdLineParser.add_argument("--metrics-port", action="store", type=int, dest="metrics_port",
+                               default=0, help="serve live counters in the Prometheus text format on this local "
+                                               "port, 0 to disable it; per reqId counts need --count-calls")
+    cmdLineParser.add_argument("--metrics-interval", action="store", type=float, dest="metrics_interval",
+                               default=5., help="seconds between two samples of the served counters")
+    cmdLineParser.add_argument("--plan-reload-interval", action="store", type=float, dest="plan_reload_interval",
+                               default=1., help="seconds between two checks of the trading plan file for changes")
+    cmdLineParser.add_argument("--no-reconnect", action="store_false", dest="reconnect",
+                               default=True, help="stop when the connection to TWS drops instead of reconnecting; "
+                                               "AsyncApp always stops")
+    cmdLineParser.add_argument("--reconnect-max-delay", action="store", type=float, dest="reconnect_max_delay",
+                               default=30., help="longest wait in seconds between two connection attempts")
+
+
+def riskGateOf(args, nWorkers: int = 1) -> RiskGate:
+    """ The RiskGate of the limits on the command line, None without any.
+    The account limits are split evenly between nWorkers processes trading
+    the account, each with a gate of its own. """
+    limits = (args.max_notional, args.max_account_notional / nWorkers, args.max_order_rate / nWorkers,
+              args.price_band, args.max_exposure / nWorkers)
+    if not any(limits):
+        return None
+    return RiskGate(*limits)
+
+
+def createApp(args, planFile: str, account: str, suffix: str = "", appClass: type = TestApp) -> TestApp:
+    """ An appClass set up from the command line to trade planFile in
+    account; suffix tells its checkpoint and journal from those of other
+    plans or workers. The risk gate and the bar store are left to the
+    caller, which may share them between apps. """
+    app = appClass(countCalls=args.count_calls,
+                   fastDecode=args.fast_decode, traceLatency=args.trace_latency)
+    app.tradingPlanFile = planFile
+    app.account = account
+    app.barHistoryCapacity = args.bar_history
+    app.aggregateBars = args.aggregate_bars
+    app.planReloadInterval = args.plan_reload_interval
+    if args.tick_by_tick:
+        app.tickType = args.tick_by_tick
+        app.tickCoalescer = TickCoalescer(args.tick_window)
+    if args.checkpoint:
+        app.checkpoint = PlanCheckpoint(args.checkpoint + suffix)
+    if args.journal:
+        app.journal = EventJournal(time.strftime("log/events%s.%%y%%m%%d_%%H%%M%%S.jrnl" % suffix))
+    return app
 
-def wait_and_refresh_trading_plan(app: TestApp):
-    while True:
-        do_refresh = input("Do you want to refresh trading plan?[yes or no]:\n")
-        if do_refresh == "yes":
-            app.setupTradingPlan(firstTime=False)
 
 def main():
-    SetupLogger()
+    logListener = SetupLogger()
     logging.getLogger().setLevel(logging.INFO)
     logging.info("now is %s", datetime.datetime.now())
 
+    cmdLineParser = argparse.ArgumentParser("TWS trading app")
+    addAppArguments(cmdLineParser)
+    cmdLineParser.add_argument("--add-plan", action="append", dest="add_plans", default=[],
+                               metavar="FILE[@ACCOUNT]",
+                               help="trade this plan too, over the same connection and market data subscriptions")
+    args = cmdLineParser.parse_args()
+    logging.info("Using args %s", args)
+
+    planWatchers = []
+    followers = []
+    metricsExporter = None
+    reconnector = None
     try:
-        app = TestApp()
+        app = createApp(args, args.plan, args.account)
+        # Plans trading the same account are held to the same limits
+        app.riskGate = riskGateOf(args)
+        riskGates = {args.account: app.riskGate}
+        if app.tracer is not None and hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, app.requestLatencyDump)
+        if args.history_store:
+            app.historicalBarStore = HistoricalBarStore(args.history_store)
+        # One more app per plan, all of them served by one connection
+        for (index, planSpec) in enumerate(args.add_plans, 1):
+            (planFile, _, account) = planSpec.partition("@")
+            followers.append(createApp(args, planFile, account, ".p%d" % index))
+            followers[-1].historicalBarStore = app.historicalBarStore
+            if account not in riskGates:
+                riskGates[account] = riskGateOf(args)
+            followers[-1].riskGate = riskGates[account]
+        router = PlanRouter(app, followers) if followers else None
+        if args.metrics_port:
+            metricsExporter = MetricsExporter([app] + followers, args.metrics_port,
+                                              interval=args.metrics_interval)
+            metricsExporter.start()
+            logging.info("Serving metrics at %s", metricsExporter.address())
         # ! [connect]
-        # Paper trading port number: 7497
-        # Live trading port number:  7496
-        app.connect("127.0.0.1", 7496, clientId=95131)
+        if args.reconnect:
+            reconnector = ReconnectSupervisor(app, args.host, args.port, args.client_id,
+                                              maxDelay=args.reconnect_max_delay,
+                                              onConnected=router.shareConnection if router is not None else None)
+            reconnector.connect()
+        else:
+            app.connect(args.host, args.port, clientId=args.client_id)
+            if router is not None:
+                router.shareConnection()
         # ! [connect]
         print("serverVersion:%s connectionTime:%s" % (app.serverVersion(),
                                                       app.twsConnectionTime()))
@@ -455,18 +1233,50 @@ def main():
         # setup tranding plan
         app.tradingPlan = TradingPlan("MarketWatcher")
         app.setupTradingPlan(firstTime=True)
+        for (index, follower) in enumerate(followers, 1):
+            follower.tradingPlan = TradingPlan("MarketWatcher-%d" % index)
+            follower.setupTradingPlan(firstTime=True)
 
-        refresh_tplan = threading.Thread(target=wait_and_refresh_trading_plan, args=(app,))
-        refresh_tplan.start()
+        # Reload the plans whenever their file is saved
+        for planApp in [app] + followers:
+            planWatchers.append(TradingPlanWatcher(planApp.tradingPlanFile, planApp.prepareTradingPlanReload,
+                                                  planApp.planReloadInterval))
+            planWatchers[-1].start()
 
         # ! [clientrun]
-        app.run()
+        if reconnector is not None:
+            reconnector.run()
+        else:
+            app.run()
         # ! [clientrun]
     except:
         raise
     finally:
+        for planWatcher in planWatchers:
+            planWatcher.stop()
+        if metricsExporter is not None:
+            metricsExporter.stop()
         app.dumpTestCoverageSituation()
-        app.dumpReqAnsErrSituation()
+        app.dumpLatencySituation()
+        if reconnector is not None:
+            logging.info("Reconnects: %s", reconnector.report())
+        reportedGates = set()
+        for planApp in [app] + followers:
+            planApp.dumpReqAnsErrSituation()
+            if planApp.riskGate is not None and planApp.riskGate not in reportedGates:
+                # Once per gate, plans of the same account share it
+                reportedGates.add(planApp.riskGate)
+                logging.info("Risk gate of account %s: %s", planApp.account or "(login)", planApp.riskGate.report())
+            if planApp.checkpoint is not None:
+                # Only a started app has state worth keeping over the restored one
+                if planApp.started:
+                    planApp.saveCheckpoint()
+                planApp.checkpoint.close()
+            if planApp.journal is not None:
+                planApp.journal.close()
+        if app.historicalBarStore is not None:
+            app.historicalBarStore.close()
+        logListener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+"""
+Runs the trading plan sharded over several TestApp worker processes.
+
+Every worker connects to TWS with its own client ID (--client-id + worker
+index) and trades the symbols whose crc32 falls into its shard, so bars are
+decoded and evaluated on as many cores as there are workers. Order IDs come
+from a shared OrderIdAllocator in disjoint blocks. The supervisor cancels
+the open orders of the account once before starting the workers, which only
+ask TWS for their own. Each worker reports its positions and counters to the
+supervisor, which prints the aggregate.
+
+    python Supervisor.py --workers 4 --plan trading_plan.yml -p 7497
+"""
+
+import argparse
+import datetime
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+from ibapi.client import EClient
+from ibapi.wrapper import EWrapper
+
+from HistoricalBarStore import HistoricalBarStore
+from MetricsExporter import MetricsExporter
+from OrderIdAllocator import OrderIdAllocator
+from ReconnectSupervisor import ReconnectSupervisor
+from Program import SetupLogger, TestApp, addAppArguments, createApp, riskGateOf
+from TradingPlan import TradingPlan
+from TradingPlanWatcher import TradingPlanWatcher
+
+
+def workerStatus(app: TestApp, workerIndex: int, clientId: int) -> dict:
+    # Read from the reporter thread; the plan is a snapshot that is swapped,
+    # never mutated, by hot reloads
+    plan = app.tradingPlan.plan
+    return {"worker": workerIndex,
+            "clientId": clientId,
+            "connected": app.isConnected(),
+            "symbols": len(plan),
+            "positions": {tpItem.symbol: tpItem.latestPos for tpItem in list(plan.values())
+                          if tpItem.latestPos != 0},
+            "orders": app.nOrdersPlaced,
+            "errors": sum(app.reqId2nErr.values()),
+            "queued": app.pacer.pending,
+            "at": time.time()}
+
+
+def runWorker(workerIndex: int, args, orderIdAllocator: OrderIdAllocator,
+              statusQueue, stopping):
+    # Ctrl-C goes to the whole process group; the supervisor decides
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    clientId = args.client_id + workerIndex
+    logListener = SetupLogger("pyibapi.w%d" % workerIndex)
+    logging.info("Worker %d of %d, clientId %d", workerIndex, args.workers, clientId)
+
+    app = createApp(args, args.plan, args.account, ".w%d" % workerIndex)
+    if app.tracer is not None and hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, app.requestLatencyDump)
+    # Each worker keeps its share of the account limits
+    app.riskGate = riskGateOf(args, args.workers)
+    if args.history_store:
+        app.historicalBarStore = HistoricalBarStore(args.history_store)
+    app.orderIdAllocator = orderIdAllocator
+    # Cancelling would take the orders of the other workers with ours
+    app.globalCancelAtStart = False
+
+    app.tradingPlan = TradingPlan("Shard-%d" % workerIndex)
+    app.tradingPlan.shard = (workerIndex, args.workers)
+    app.setupTradingPlan(firstTime=True)
+
+    planWatcher = TradingPlanWatcher(app.tradingPlanFile, app.prepareTradingPlanReload, app.planReloadInterval)
+
+    def report():
+        while not stopping.wait(args.report_interval):
+            statusQueue.put(workerStatus(app, workerIndex, clientId))
+        app.stop()
+        app.done = True
+        app.disconnect()
+
+    metricsExporter = None
+    if args.metrics_port:
+        # One port per worker, from metrics_port on
+        metricsExporter = MetricsExporter([app], args.metrics_port + workerIndex, interval=args.metrics_interval)
+        metricsExporter.start()
+        logging.info("Serving metrics at %s", metricsExporter.address())
+
+    reconnector = None
+    if args.reconnect:
+        reconnector = ReconnectSupervisor(app, args.host, args.port, clientId, maxDelay=args.reconnect_max_delay)
+
+    reporter = threading.Thread(target=report, name="WorkerReporter", daemon=True)
+    try:
+        # Started first, the reporter also stops a worker still connecting
+        planWatcher.start()
+        reporter.start()
+        if reconnector is not None:
+            reconnector.connect()
+            reconnector.run()
+        else:
+            app.connect(args.host, args.port, clientId=clientId)
+            app.run()
+    finally:
+        planWatcher.stop()
+        statusQueue.put(workerStatus(app, workerIndex, clientId))
+        if metricsExporter is not None:
+            metricsExporter.stop()
+        app.dumpTestCoverageSituation()
+        app.dumpReqAnsErrSituation()
+        app.dumpLatencySituation()
+        if reconnector is not None:
+            logging.info("Reconnects: %s", reconnector.report())
+        if app.riskGate is not None:
+            logging.info("Risk gate: %s", app.riskGate.report())
+        if app.checkpoint is not None:
+            # Only a started app has state worth keeping over the restored one
+            if app.started:
+                app.saveCheckpoint()
+            app.checkpoint.close()
+        if app.historicalBarStore is not None:
+            app.historicalBarStore.close()
+        if app.journal is not None:
+            app.journal.close()
+        logListener.stop()
+
+
+def cancelAllOrders(args, clientId: int) -> bool:
+    """ Cancels the open orders of the account, from every client, before
+    the workers connect. Returns False if TWS could not be reached. """
+    client = EClient(EWrapper())
+    client.connect(args.host, args.port, clientId)
+    if not client.isConnected():
+        return False
+    client.reqGlobalCancel()
+    client.disconnect()
+    return True
+
+
+def printReport(statusByWorker: dict, nWorkers: int):
+    positions = {}
+    for status in statusByWorker.values():
+        positions.update(status["positions"])
+    print("%s workers connected %d/%d, symbols %d, orders %d, errors %d, queued %d, "
+          "open positions %d (gross %.0f shares)" %
+          (datetime.datetime.now().strftime("%H:%M:%S"),
+           sum(1 for status in statusByWorker.values() if status["connected"]), nWorkers,
+           sum(status["symbols"] for status in statusByWorker.values()),
+           sum(status["orders"] for status in statusByWorker.values()),
+           sum(status["errors"] for status in statusByWorker.values()),
+           sum(status["queued"] for status in statusByWorker.values()),
+           len(positions), sum(abs(position) for position in positions.values())))
+
+
+def main():
+    cmdLineParser = argparse.ArgumentParser("TWS trading app supervisor")
+    addAppArguments(cmdLineParser)
+    cmdLineParser.add_argument("--workers", action="store", type=int, dest="workers",
+                               default=os.cpu_count(), help="number of worker processes; each gets an equal share "
+                                                            "of the account limits of the risk gate")
+    cmdLineParser.add_argument("--order-id-block", action="store", type=int, dest="order_id_block",
+                               default=1000, help="order IDs handed to a worker at a time")
+    cmdLineParser.add_argument("--report-interval", action="store", type=float, dest="report_interval",
+                               default=5., help="seconds between worker status reports")
+    args = cmdLineParser.parse_args()
+
+    # Once for all workers, with a client ID none of them uses
+    if not cancelAllOrders(args, args.client_id + args.workers):
+        print("Could not connect to cancel the open orders")
+        return
+
+    orderIdAllocator = OrderIdAllocator(args.order_id_block)
+    statusQueue = multiprocessing.Queue()
+    stopping = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=runWorker, name="Worker-%d" % workerIndex,
+                                       args=(workerIndex, args, orderIdAllocator, statusQueue, stopping))
+               for workerIndex in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    statusByWorker = {}
+    lastReportAt = time.monotonic()
+    stopDeadline = None
+    # Keep draining the status queue while the workers shut down; a worker
+    # does not exit before what it put on the queue was read
+    while any(worker.is_alive() for worker in workers):
+        try:
+            try:
+                status = statusQueue.get(timeout=0.5)
+                statusByWorker[status["worker"]] = status
+            except queue.Empty:
+                pass
+            if time.monotonic() - lastReportAt >= args.report_interval and statusByWorker:
+                printReport(statusByWorker, args.workers)
+                lastReportAt = time.monotonic()
+            if stopDeadline is not None and time.monotonic() > stopDeadline:
+                for worker in workers:
+                    if worker.is_alive():
+                        worker.terminate()
+        except KeyboardInterrupt:
+            if stopDeadline is None:
+                print("Stopping workers")
+                stopping.set()
+                stopDeadline = time.monotonic() + 10
+
+    while True:
+        try:
+            status = statusQueue.get_nowait()
+            statusByWorker[status["worker"]] = status
+        except queue.Empty:
+            break
+    if statusByWorker:
+        printReport(statusByWorker, args.workers)
+
+
+if __name__ == "__main__":
+    main()
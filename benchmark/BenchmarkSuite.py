@@ -0,0 +1,367 @@
+"""
+Benchmark suite of the trading hot paths with regression gates.
+
+Runs each benchmark a few times, keeps the best result of every metric and
+compares it with the baseline stored in benchmark/baseline.json.
+
+Absolute timings depend on the machine, so the gate is on values measured
+against each other in the same run instead:
+
+    ratios          see RATIOS: fast against stock decoding, orders from
+                    templates against from scratch, a warm plan load
+                    against a cold one, the overhead of the risk gate
+    <metric>.norm   every absolute timing in plain method calls, the
+                    calibration loop run next to each benchmark, so a
+                    hot path that gets slower fails the gate even when
+                    the ratios it is part of do not move
+
+A gated value worse than its baseline by more than the threshold
+(20% unless the baseline sets its own) is measured again up to --confirm
+more times, so that a noisy run alone does not fail the gate. If it stays
+worse, the suite exits with status 1, so it can gate a change before it is
+merged:
+
+    python benchmark/BenchmarkSuite.py                   # compare
+    python benchmark/BenchmarkSuite.py --save-baseline   # record a new baseline
+    python benchmark/BenchmarkSuite.py --only realtimeBar parseYaml
+
+The absolute timings are compared and flagged as well, but only fail the
+gate with --absolute, on the machine the baseline was taken on.
+
+Covered:
+    realtimeBar     TestApp.realtimeBar bars/s of a burst, no TWS
+    parseYaml       TradingPlan.parseYaml at several plan sizes, cold and warm
+    orders          Contracts/Orders construction, from scratch and templates
+    callCounter     cost per call of the CallCounter wrappers (--count-calls)
+    decoder         stock and fast decoding of realtime bar messages
+    riskGate        RiskGate.check and triggerBuy through the gate
+
+The baseline records the machine it was taken on and the comparison warns
+when it runs elsewhere.
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+import DecoderBenchmark
+import OrderTemplateBenchmark
+import PlanLoadBenchmark
+import RiskGateBenchmark
+from CallCounter import CallCounter
+from Program import TestApp
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.2
+
+
+class Metric:
+
+    def __init__(self, value: float, unit: str, higherIsBetter: bool, relative: bool = False):
+        self.value = value
+        self.unit = unit
+        self.higherIsBetter = higherIsBetter
+        # A ratio of two results of the same run, which the gate is on
+        self.relative = relative
+
+    def better(self, other) -> bool:
+        return self.value > other.value if self.higherIsBetter else self.value < other.value
+
+
+# realtimeBar
+
+def makeBarApp(nSymbols: int) -> TestApp:
+    app = TestApp()
+    app.tradingPlan = TradingPlan("Benchmark")
+    for i in range(nSymbols):
+        tpItem = TradingPlanItem()
+        tpItem.setup("S%05d" % i, True, 8801 + i, 100.0, 99.7, 100, 0, 4, 4)
+        app.tradingPlan.addPlanItem(tpItem)
+    # Orders are counted instead of sent
+    app.nextValidOrderId = 1
+    app.placeOrder = lambda orderId, contract, order: None
+    return app
+
+
+def benchRealtimeBar(nSymbols: int = 1000, nBursts: int = 50) -> dict:
+    """ Bars/s of the fastest burst of one bar per symbol. """
+    # Prices wander between the targets, so the rules are evaluated in full
+    # without triggering: the common case of a bar
+    closes = [99.9 + 0.05 * (i % 5) for i in range(nBursts)]
+    app = makeBarApp(nSymbols)
+    reqIds = list(app.tradingPlan.plan)
+    fastest = float("inf")
+    for close in closes:
+        startedAt = time.perf_counter()
+        for reqId in reqIds:
+            app.realtimeBar(reqId, 0, close, close, close, close, 100, close, 1)
+        fastest = min(fastest, time.perf_counter() - startedAt)
+    return {"realtimeBar.burst": Metric(nSymbols / fastest, "bars/s", True)}
+
+
+# parseYaml
+
+def benchParseYaml(sizes=(1000, 10000)) -> dict:
+    result = {}
+    with tempfile.TemporaryDirectory() as workDir:
+        for nRows in sizes:
+            fileName = os.path.join(workDir, "plan%d.yml" % nRows)
+            PlanLoadBenchmark.writePlan(fileName, nRows)
+            cold = PlanLoadBenchmark.timed(lambda: PlanLoadBenchmark.loadPlan(fileName))
+            # Only the first load is cold; the best of a few warm ones keeps a
+            # collection or a page fault out of the result
+            warm = min(timeit.repeat(lambda: PlanLoadBenchmark.loadPlan(fileName), number=1, repeat=5))
+            result["parseYaml.%d.cold" % nRows] = Metric(cold * 1000, "ms", False)
+            result["parseYaml.%d.warm" % nRows] = Metric(warm * 1000, "ms", False)
+    return result
+
+
+# Contracts/Orders
+
+def benchOrders() -> dict:
+    measured = OrderTemplateBenchmark.runBenchmark()
+    return {
+        "orders.scratch": Metric(measured["scratchUs"], "us/order", False),
+        "orders.template": Metric(measured["templateUs"], "us/order", False),
+    }
+
+
+# CallCounter
+
+class CountedApi:
+    def realtimeBar(self, reqId: int, time_: int, close: float):
+        pass
+
+    def currentTime(self, time_: int):
+        pass
+
+
+def nsPerCall(fn, number: int = 200000) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9
+
+
+def benchCallCounter() -> dict:
+    class Counted(CountedApi):
+        pass
+    CallCounter(CountedApi).install(Counted)
+    (plain, counted) = (CountedApi(), Counted())
+
+    base = nsPerCall(lambda: plain.realtimeBar(8801, 0, 1.0))
+    return {
+        CALIBRATION: Metric(base, "ns/call", False),
+        "callCounter.reqId": Metric(nsPerCall(lambda: counted.realtimeBar(8801, 0, 1.0)) - base,
+                                    "ns/call", False),
+        "callCounter.noReqId": Metric(nsPerCall(lambda: counted.currentTime(0))
+                                      - nsPerCall(lambda: plain.currentTime(0)), "ns/call", False),
+    }
+
+
+# Calibration: what a plain method call costs on this machine right now
+
+CALIBRATION = "callCounter.plain"
+
+
+def calibrate() -> dict:
+    plain = CountedApi()
+    return {CALIBRATION: Metric(nsPerCall(lambda: plain.realtimeBar(8801, 0, 1.0)), "ns/call", False)}
+
+
+# Decoder
+
+def benchDecoder(nMessages: int = 20000, repeat: int = 5) -> dict:
+    measured = [DecoderBenchmark.runBenchmark(nMessages, DecoderBenchmark.FakeTwsServer.SERVER_VERSION)
+                for _ in range(repeat)]
+    return {
+        "decoder.stock": Metric(max(rates["realtimeBar"][0] for rates in measured), "msg/s", True),
+        "decoder.fast": Metric(max(rates["realtimeBar"][1] for rates in measured), "msg/s", True),
+    }
+
+
+# RiskGate
+
+def benchRiskGate() -> dict:
+    measured = RiskGateBenchmark.runBenchmark()
+    return {
+        "riskGate.check": Metric(measured["checkNs"], "ns/order", False),
+        "riskGate.ungated": Metric(measured["triggerUs"], "us/order", False),
+        "riskGate.trigger": Metric(measured["gatedTriggerUs"], "us/order", False),
+    }
+
+
+BENCHMARKS = {
+    "realtimeBar": benchRealtimeBar,
+    "parseYaml": benchParseYaml,
+    "orders": benchOrders,
+    "callCounter": benchCallCounter,
+    "decoder": benchDecoder,
+    "riskGate": benchRiskGate,
+}
+
+
+# The gated ratios: name -> (numerator, denominator, higherIsBetter)
+RATIOS = {
+    "parseYaml.1000.warmSpeedup": ("parseYaml.1000.cold", "parseYaml.1000.warm", True),
+    "parseYaml.10000.warmSpeedup": ("parseYaml.10000.cold", "parseYaml.10000.warm", True),
+    "orders.speedup": ("orders.scratch", "orders.template", True),
+    "decoder.speedup": ("decoder.fast", "decoder.stock", True),
+    "riskGate.overhead": ("riskGate.trigger", "riskGate.ungated", False),
+}
+
+# Nanoseconds per unit of the absolute timings; rates are turned into the
+# time of one item
+NS_PER_UNIT = {"ns/call": 1., "ns/order": 1., "us/order": 1e3, "ms": 1e6}
+RATE_UNITS = frozenset(("bars/s", "msg/s"))
+
+
+def normalized(metric: Metric, calibration: Metric) -> Metric:
+    """ metric in plain method calls: the time it takes over that of one
+    call, both measured in the same run. """
+    ns = 1e9 / metric.value if metric.unit in RATE_UNITS else metric.value * NS_PER_UNIT[metric.unit]
+    return Metric(ns / calibration.value, "calls", False, relative=True)
+
+
+def runSuite(names: list, repeat: int, best: dict = None) -> dict:
+    """ Best result of repeat runs for every metric, merged into best, and
+    the ratios and normalized timings of the best results. A ratio of two
+    best results is steadier than the best of the ratios of single runs.
+    The calibration loop runs before each benchmark, so its best result
+    comes from the same conditions. """
+    best = {} if best is None else best
+    for name in names:
+        for _ in range(repeat):
+            # realtimeBar logs each trigger and call counting prints; keep both quiet
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                measured = calibrate()
+                measured.update(BENCHMARKS[name]())
+            for (metricName, metric) in measured.items():
+                if metricName not in best or metric.better(best[metricName]):
+                    best[metricName] = metric
+    for (ratioName, (numerator, denominator, higherIsBetter)) in RATIOS.items():
+        if numerator in best and denominator in best and best[denominator].value:
+            best[ratioName] = Metric(best[numerator].value / best[denominator].value, "x",
+                                     higherIsBetter, relative=True)
+    calibration = best[CALIBRATION]
+    for (metricName, metric) in list(best.items()):
+        if not metric.relative and metricName != CALIBRATION and metric.value > 0:
+            best[metricName + ".norm"] = normalized(metric, calibration)
+    return best
+
+
+def machine() -> str:
+    return "%s %s, Python %s" % (platform.machine(), platform.processor() or platform.system(),
+                                 platform.python_version())
+
+
+def loadBaseline(fileName: str) -> dict:
+    if not os.path.exists(fileName):
+        return {"machine": None, "metrics": {}}
+    with open(fileName) as baselineFile:
+        return json.load(baselineFile)
+
+
+def saveBaseline(fileName: str, results: dict, baseline: dict):
+    metrics = baseline["metrics"]
+    for (metricName, metric) in results.items():
+        entry = metrics.setdefault(metricName, {})
+        entry.update(value=round(metric.value, 3), unit=metric.unit, higherIsBetter=metric.higherIsBetter,
+                     relative=metric.relative)
+    baseline["machine"] = machine()
+    baseline["savedAt"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(fileName, "w") as baselineFile:
+        json.dump(baseline, baselineFile, indent=2, sort_keys=True)
+        baselineFile.write("\n")
+
+
+def change(metric: Metric, entry: dict) -> float:
+    return (metric.value - entry["value"]) / entry["value"] if entry["value"] else 0.
+
+
+def regressions(results: dict, baseline: dict, threshold: float, absolute: bool = True) -> list:
+    """ Names of the metrics worse than their baseline beyond the threshold;
+    only the ratios unless absolute. """
+    regressed = []
+    for (metricName, metric) in results.items():
+        entry = baseline["metrics"].get(metricName)
+        if entry is None or not (absolute or metric.relative):
+            continue
+        # Positive is worse, whatever the direction of the metric
+        worse = -change(metric, entry) if metric.higherIsBetter else change(metric, entry)
+        if worse > entry.get("threshold", threshold):
+            regressed.append(metricName)
+    return sorted(regressed)
+
+
+def printComparison(results: dict, baseline: dict, regressed: list, slower: list):
+    print("%-24s %14s %14s %8s %10s" % ("metric", "baseline", "now", "change", "unit"))
+    for (metricName, metric) in sorted(results.items()):
+        entry = baseline["metrics"].get(metricName)
+        if entry is None:
+            print("%-24s %14s %14.2f %8s %10s" % (metricName, "-", metric.value, "new", metric.unit))
+            continue
+        print("%-24s %14.2f %14.2f %+7.1f%% %10s%s" %
+              (metricName, entry["value"], metric.value, change(metric, entry) * 100, metric.unit,
+               "  REGRESSED" if metricName in regressed else "  slower" if metricName in slower else ""))
+
+
+def main():
+    cmdLineParser = argparse.ArgumentParser("Hot path benchmark suite")
+    cmdLineParser.add_argument("--only", nargs="+", default=["*"],
+                               help="benchmarks to run, shell patterns of %s" % ", ".join(BENCHMARKS))
+    cmdLineParser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the best counts")
+    cmdLineParser.add_argument("--confirm", type=int, default=3,
+                               help="extra runs of a benchmark whose metrics look regressed")
+    cmdLineParser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                               help="relative slowdown that fails a metric without its own threshold")
+    cmdLineParser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    cmdLineParser.add_argument("--save-baseline", action="store_true", default=False,
+                               help="store the results as the new baseline instead of comparing")
+    cmdLineParser.add_argument("--absolute", action="store_true", default=False,
+                               help="fail on the absolute timings too, on the machine of the baseline")
+    args = cmdLineParser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    names = [name for name in BENCHMARKS if any(fnmatch.fnmatch(name, pattern) for pattern in args.only)]
+    results = runSuite(names, args.repeat)
+    baseline = loadBaseline(args.baseline)
+
+    if args.save_baseline:
+        saveBaseline(args.baseline, results, baseline)
+        print("Saved %d metrics to %s" % (len(results), args.baseline))
+        return 0
+
+    if baseline["machine"] is not None and baseline["machine"] != machine():
+        print("Warning: the baseline was taken on %s, this is %s" % (baseline["machine"], machine()))
+    regressed = regressions(results, baseline, args.threshold, args.absolute)
+    for _ in range(args.confirm):
+        if not regressed:
+            break
+        suspects = sorted(set(metricName.split(".")[0] for metricName in regressed))
+        runSuite(suspects, 1, results)
+        regressed = regressions(results, baseline, args.threshold, args.absolute)
+
+    # Flagged, but not failing: timings of another machine or a busy one
+    slower = [metricName for metricName in regressions(results, baseline, args.threshold)
+              if metricName not in regressed]
+    printComparison(results, baseline, regressed, slower)
+    if regressed:
+        print("%d metric(s) regressed: %s" % (len(regressed), ", ".join(regressed)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
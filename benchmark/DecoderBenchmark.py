@@ -0,0 +1,119 @@
+"""
+Micro-benchmark of message decoding: comm.read_fields + Decoder.interpret
+against comm.read_fields + FastDecoder.interpret, on the realtimeBar, orderStatus
+and position messages that make up nearly all of our traffic, and on the
+mix of the three. The wrapper only records the calls, so the numbers are
+the cost of decoding and dispatch alone. Both decoders are checked to make
+the same wrapper calls first.
+
+    python benchmark/DecoderBenchmark.py --messages 200000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from ibapi import comm
+from ibapi.decoder import Decoder
+from ibapi.message import IN
+from ibapi.wrapper import EWrapper
+
+from FakeTwsServer import FakeTwsServer
+from FastDecoder import FastDecoder
+
+
+class SinkWrapper(EWrapper):
+
+    """ Keeps the arguments of the last call instead of logging them. """
+
+    def __init__(self):
+        EWrapper.__init__(self)
+        self.last = None
+
+    def realtimeBar(self, *args):
+        self.last = ("realtimeBar", args)
+
+    def orderStatus(self, *args):
+        self.last = ("orderStatus", args)
+
+    def position(self, account, contract, position, avgCost):
+        self.last = ("position", (account, vars(contract), position, avgCost))
+
+
+def payload(*fields) -> bytes:
+    # What the EReader queues: the message without its length prefix
+    return FakeTwsServer.makeMsg(*fields)[4:]
+
+
+def makeMessages() -> dict:
+    return {
+        "realtimeBar": [payload(IN.REAL_TIME_BARS, 3, 8800 + i % 500, 1600000000 + 5 * i,
+                                100.0 + i % 7, 100.5 + i % 7, 99.5 + i % 7, 100.25 + i % 7, 100 + i, 100.1, 12)
+                        for i in range(1000)],
+        "orderStatus": [payload(IN.ORDER_STATUS, i, ("Submitted", "Filled")[i % 2], 100.0 * (i % 2),
+                                100.0 * (1 - i % 2), 100.25, 1000 + i, 0, 100.25, 1, "", 0.0)
+                        for i in range(1000)],
+        "position": [payload(IN.POSITION_DATA, 3, "DU123456", 265598, "S%03d" % (i % 500), "STK", "",
+                             0.0, "", "", "SMART", "USD", "S%03d" % (i % 500), "NMS", 100.0 * i, 99.5)
+                     for i in range(1000)],
+    }
+
+
+def interpretOf(decoder):
+    return lambda text: decoder.interpret(comm.read_fields(text))
+
+
+def checkSameCalls(messages: list, stock, fast, sink: SinkWrapper):
+    for text in messages:
+        stock(text)
+        expected = sink.last
+        fast(text)
+        if sink.last != expected:
+            raise AssertionError("decoders differ on %r: %r != %r" % (text, expected, sink.last))
+
+
+def messagesPerSecond(messages: list, interpret, nMessages: int) -> float:
+    nRounds = max(1, nMessages // len(messages))
+    start = time.perf_counter()
+    for _ in range(nRounds):
+        for text in messages:
+            interpret(text)
+    return nRounds * len(messages) / (time.perf_counter() - start)
+
+
+def runBenchmark(nMessages: int, serverVersion: int) -> dict:
+    sink = SinkWrapper()
+    decoder = Decoder(sink, serverVersion)
+    fastDecoder = FastDecoder(sink, decoder)
+    stock = interpretOf(decoder)
+    fast = interpretOf(fastDecoder)
+
+    byType = makeMessages()
+    byType["mix"] = [text for texts in zip(*byType.values()) for text in texts]
+    result = {}
+    for (msgType, messages) in byType.items():
+        checkSameCalls(messages, stock, fast, sink)
+        result[msgType] = (messagesPerSecond(messages, stock, nMessages),
+                           messagesPerSecond(messages, fast, nMessages))
+    return result
+
+
+def main():
+    cmdLineParser = argparse.ArgumentParser("Decoder benchmark")
+    cmdLineParser.add_argument("--messages", type=int, default=200000,
+                               help="messages decoded per measurement")
+    cmdLineParser.add_argument("--server-version", type=int, default=FakeTwsServer.SERVER_VERSION,
+                               help="server version the messages are decoded for")
+    args = cmdLineParser.parse_args()
+
+    result = runBenchmark(args.messages, args.server_version)
+    print("%-12s %14s %14s %8s" % ("message", "stock msg/s", "fast msg/s", "speedup"))
+    for (msgType, (stockRate, fastRate)) in result.items():
+        print("%-12s %14.0f %14.0f %7.2fx" % (msgType, stockRate, fastRate, fastRate / stockRate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+End-to-end benchmark of TestApp against the local FakeTwsServer.
+
+Streams scripted 5-second bars for a generated trading plan and reports the
+sustained bar throughput of the message loop together with the latency from
+writing a triggering bar to the socket until the matching placeOrder reaches
+the server. With -t the app's own per-stage latency histograms are printed
+as well.
+
+    python benchmark/EndToEndBenchmark.py --symbols 2000 --seconds 10
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from FakeTwsServer import FakeTwsServer
+from Program import TestApp
+from RequestPacer import RequestPacer
+from TradingPlan import TradingPlan
+
+
+# Each cycle triggers one buy (99.9 -> 100.1 crosses 100.0) and, once the
+# fill is reported, one sell (99.9 -> 99.6 crosses 99.7).
+TRIGGER_SCRIPT = [99.9, 100.1, 99.9, 99.6]
+
+
+class BenchApp(TestApp):
+    def __init__(self, **kwargs):
+        TestApp.__init__(self, **kwargs)
+        self.barsProcessed = 0
+
+    def realtimeBar(self, reqId, time, open_, high, low, close, volume, wap, count):
+        self.barsProcessed += 1
+        super().realtimeBar(reqId, time, open_, high, low, close, volume, wap, count)
+
+
+def writePlan(fileName: str, nSymbols: int):
+    with open(fileName, "w") as planFile:
+        for i in range(nSymbols):
+            planFile.write("- {SYMBOL: S%05d, ENABLED: True, TARGET_BUY_PRICE: 100.0, "
+                           "TARGET_LONG_POS: 100, BUY_ATTEMPT_LIMIT: 1000000, "
+                           "TARGET_SHORT_POS: 0, SELL_ATTEMPT_LIMIT: 1000000}\n" % i)
+
+
+def percentile(sortedValues: list, pct: float):
+    if not sortedValues:
+        return float("nan")
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * pct / 100))]
+
+
+def runBenchmark(nSymbols: int, seconds: float, barsPerSecond: float, fastDecode: bool = False,
+                 traceLatency: bool = False) -> dict:
+    workDir = tempfile.mkdtemp(prefix="tws_bench_")
+    planFileName = os.path.join(workDir, "trading_plan.yml")
+    writePlan(planFileName, nSymbols)
+
+    server = FakeTwsServer(barsPerSecond=barsPerSecond)
+    for i in range(nSymbols):
+        server.setBarScript("S%05d" % i, TRIGGER_SCRIPT)
+    server.start()
+
+    app = BenchApp(fastDecode=fastDecode, traceLatency=traceLatency)
+    app.tradingPlanFile = planFileName
+    app.tradingPlan = TradingPlan("Benchmark")
+    # The fake server has no pacing limits to respect
+    for requestClass in (None, RequestPacer.REALTIME_BARS, RequestPacer.HISTORICAL_DATA):
+        app.pacer.setRate(requestClass, 1e9, 1e9)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        app.setupTradingPlan(firstTime=True)
+        app.connect("127.0.0.1", server.port, clientId=1)
+        runner = threading.Thread(target=app.run, name="BenchApp-run", daemon=True)
+        runner.start()
+
+        startedAt = time.perf_counter()
+        time.sleep(seconds)
+        server.pauseStreaming()
+        # let the app drain what is still queued
+        while not app.msg_queue.empty():
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - startedAt
+        barsWritten = server.barsWritten
+        barsProcessed = app.barsProcessed
+
+        app.done = True
+        app.disconnect()
+        runner.join(timeout=5)
+        server.stop()
+
+    latenciesUs = sorted(ns / 1000.0 for ns in server.orderLatenciesNs)
+    return {
+        "symbols": nSymbols,
+        "barsWritten": barsWritten,
+        "barsProcessed": barsProcessed,
+        "barsPerSecond": barsProcessed / elapsed,
+        "orders": server.ordersReceived,
+        "latencyP50Us": percentile(latenciesUs, 50),
+        "latencyP99Us": percentile(latenciesUs, 99),
+        "latencyMaxUs": latenciesUs[-1] if latenciesUs else float("nan"),
+        "stages": [] if app.tracer is None else app.tracer.report()[:len(app.tracer.STAGES)],
+    }
+
+
+def main():
+    cmdLineParser = argparse.ArgumentParser("end-to-end TestApp benchmark")
+    cmdLineParser.add_argument("--symbols", type=int, default=1000, help="number of plan symbols")
+    cmdLineParser.add_argument("--seconds", type=float, default=10, help="streaming duration")
+    cmdLineParser.add_argument("--rate", type=float, default=0,
+                               help="bars per second written by the server, 0 for unthrottled")
+    cmdLineParser.add_argument("-f", "--fast-decode", action="store_true", default=False,
+                               help="run TestApp with the fast-path decoder")
+    cmdLineParser.add_argument("-t", "--trace-latency", action="store_true", default=False,
+                               help="print TestApp's per-stage latency histograms")
+    args = cmdLineParser.parse_args()
+
+    logging.basicConfig(filename=os.path.join(tempfile.gettempdir(), "tws_bench.log"),
+                        filemode="w", level=logging.INFO)
+
+    result = runBenchmark(args.symbols, args.seconds, args.rate, args.fast_decode, args.trace_latency)
+    print("symbols=%(symbols)d barsWritten=%(barsWritten)d barsProcessed=%(barsProcessed)d "
+          "bars/s=%(barsPerSecond).0f orders=%(orders)d" % result)
+    print("bar-to-placeOrder latency: p50=%(latencyP50Us).0fus p99=%(latencyP99Us).0fus "
+          "max=%(latencyMaxUs).0fus" % result)
+    for line in result["stages"]:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
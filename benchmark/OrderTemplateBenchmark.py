@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of the trigger path's Contract/Order construction: building
+them from scratch (Contracts.USStockAtSmart + Orders.MarketOrder) against
+the cached contract plus a clone of the market order template.
+
+    python benchmark/OrderTemplateBenchmark.py
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from Contracts import Contracts
+from Orders import Orders
+
+
+def buildFromScratch():
+    return (Contracts.USStockAtSmart("FB"), Orders.MarketOrder("BUY", 100))
+
+
+def buildFromTemplates():
+    return (Contracts.CachedUSStockAtSmart("FB"), Orders.MarketOrderFromTemplate("BUY", 100))
+
+
+def timePerCall(fn, number: int = 20000) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def bytesPerCall(fn, number: int = 1000) -> float:
+    keep = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(number):
+        keep.append(fn())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return allocated / number
+
+
+def runBenchmark() -> dict:
+    Contracts.CacheUSStockAtSmart(["FB"])
+    Orders.CacheMarketOrders()
+    return {
+        "scratchUs": timePerCall(buildFromScratch) * 1e6,
+        "templateUs": timePerCall(buildFromTemplates) * 1e6,
+        "scratchBytes": bytesPerCall(buildFromScratch),
+        "templateBytes": bytesPerCall(buildFromTemplates),
+    }
+
+
+def main():
+    result = runBenchmark()
+    print("from scratch:   %(scratchUs)6.2f us/order %(scratchBytes)8.0f bytes/order" % result)
+    print("from templates: %(templateUs)6.2f us/order %(templateBytes)8.0f bytes/order" % result)
+    print("saved:          %6.2f us/order %8.0f bytes/order" %
+          (result["scratchUs"] - result["templateUs"], result["scratchBytes"] - result["templateBytes"]))
+
+
+if __name__ == "__main__":
+    main()
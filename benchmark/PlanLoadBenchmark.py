@@ -0,0 +1,118 @@
+"""
+Loading time of large trading plans: the original FullLoader parse against
+the libyaml parse plus marshal cache used by TradingPlan.parseYaml, and a
+hot reload (TradingPlan.diffYaml) after one row of the file was edited,
+which only re-parses the edited line.
+
+    python benchmark/PlanLoadBenchmark.py --rows 10000 30000 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from TradingPlan import TradingPlan
+from TradingPlanCache import YamlLoader
+from TradingPlanItem import TradingPlanItem
+
+
+ROW_FORMAT = ("- {SYMBOL: %s, ENABLED: %s, TARGET_BUY_PRICE: %.2f, TARGET_LONG_POS: %d, "
+              "BUY_ATTEMPT_LIMIT: %d, TARGET_SHORT_POS: %d, SELL_ATTEMPT_LIMIT: %d}\n")
+
+
+def makeRow(i: int, rnd: random.Random) -> str:
+    return ROW_FORMAT % ("S%05d" % i, rnd.choice(("True", "False")), rnd.uniform(5, 500),
+                         rnd.choice((100, 200, 500)), rnd.randint(1, 4), 0, rnd.randint(1, 4))
+
+
+def writePlan(fileName: str, nRows: int, seed: int = 1):
+    rnd = random.Random(seed)
+    with open(fileName, "w") as planFile:
+        for i in range(nRows):
+            planFile.write(makeRow(i, rnd))
+
+
+def editOneRow(fileName: str):
+    with open(fileName) as planFile:
+        lines = planFile.readlines()
+    lines[len(lines) // 2] = lines[len(lines) // 2].replace("TARGET_LONG_POS: ", "TARGET_LONG_POS: 1")
+    with open(fileName, "w") as planFile:
+        planFile.writelines(lines)
+
+
+def timed(fn) -> float:
+    startedAt = time.perf_counter()
+    fn()
+    return time.perf_counter() - startedAt
+
+
+def loadWithFullLoader(fileName: str):
+    # What parseYaml did before: FullLoader and a 9-argument setup() per item
+    with open(fileName) as planFile:
+        tPlanYaml = yaml.load(planFile, Loader=yaml.FullLoader)
+    plan = TradingPlan("Benchmark")
+    for (reqId, item) in enumerate(tPlanYaml, 8801):
+        tpItem = TradingPlanItem()
+        tpItem.setup(item["SYMBOL"], item["ENABLED"], reqId,
+                     item["TARGET_BUY_PRICE"], round(item["TARGET_BUY_PRICE"] * 0.997, 2),
+                     item["TARGET_LONG_POS"], item["TARGET_SHORT_POS"],
+                     item["BUY_ATTEMPT_LIMIT"], item["SELL_ATTEMPT_LIMIT"])
+        plan.plan.update({tpItem.reqId: tpItem})
+        plan.planKeyedBySymbol.update({tpItem.symbol: tpItem})
+    return plan
+
+
+def loadPlan(fileName: str) -> TradingPlan:
+    plan = TradingPlan("Benchmark")
+    plan.parseYaml(fileName, True, 8800)
+    return plan
+
+
+def runBenchmark(nRows: int) -> dict:
+    with tempfile.TemporaryDirectory() as workDir:
+        fileName = os.path.join(workDir, "trading_plan.yml")
+        writePlan(fileName, nRows)
+
+        result = {"rows": nRows}
+        result["fullLoader"] = timed(lambda: loadWithFullLoader(fileName))
+        result["cold"] = timed(lambda: loadPlan(fileName))
+        result["warm"] = timed(lambda: loadPlan(fileName))
+
+        # Saved again without changes: mtime differs, the hash still matches
+        os.utime(fileName)
+        result["touched"] = timed(lambda: loadPlan(fileName))
+
+        plan = loadPlan(fileName)
+        editOneRow(fileName)
+        update = None
+
+        def reload():
+            nonlocal update
+            update = plan.diffYaml(fileName)
+        result["reload"] = timed(reload)
+        assert len(update.changed) == 1, update
+        return result
+
+
+def main():
+    cmdLineParser = argparse.ArgumentParser("Trading plan load benchmark")
+    cmdLineParser.add_argument("--rows", action="store", type=int, nargs="+", dest="rows",
+                               default=[10000, 30000, 100000], help="plan sizes to load")
+    args = cmdLineParser.parse_args()
+
+    print("YAML loader: %s" % YamlLoader.__name__)
+    print("%8s %12s %10s %10s %10s %10s" % ("Rows", "FullLoader", "Cold", "Warm", "Touched", "Reload"))
+    for nRows in args.rows:
+        result = runBenchmark(nRows)
+        print("%(rows)8d %(fullLoader)11.3fs %(cold)9.3fs %(warm)9.3fs %(touched)9.3fs %(reload)9.3fs" % result)
+
+
+if __name__ == "__main__":
+    main()
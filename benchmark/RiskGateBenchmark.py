@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of the pre-trade RiskGate: the cost of one check() with all
+limits on, and of TestApp.triggerBuy with and without the gate, the order
+going out through placeOrder to a connection that discards it.
+
+    python benchmark/RiskGateBenchmark.py
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from ibapi.connection import Connection
+from ibapi.server_versions import MAX_CLIENT_VER
+
+from Contracts import Contracts
+from Orders import Orders
+from Program import TestApp
+from RiskGate import RiskGate
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+
+class NullConnection(Connection):
+    def __init__(self):
+        Connection.__init__(self, "127.0.0.1", 0)
+
+    def isConnected(self):
+        return True
+
+    def sendMsg(self, msg):
+        return len(msg)
+
+
+def makeGate(tradingPlan: TradingPlan) -> RiskGate:
+    # Limits no order of the benchmark reaches, so every check runs in full
+    gate = RiskGate(maxNotional=1e12, maxAccountNotional=1e18, maxOrderRate=1e12, priceBand=0.1, maxExposure=1e15)
+    gate.load(tradingPlan)
+    return gate
+
+
+def makeApp(nSymbols: int) -> TestApp:
+    app = TestApp()
+    app.tradingPlan = TradingPlan("Benchmark")
+    for i in range(nSymbols):
+        tpItem = TradingPlanItem()
+        tpItem.setup("S%05d" % i, True, 8801 + i, 100.0, 99.7, 100, 0, 4, 4)
+        tpItem.todayOpenPrice = 100.0
+        app.tradingPlan.addPlanItem(tpItem)
+    Contracts.CacheUSStockAtSmart(item.symbol for item in app.tradingPlan.plan.values())
+    Orders.CacheMarketOrders()
+    # The order is serialized as for TWS, then dropped
+    app.conn = NullConnection()
+    app.serverVersion_ = MAX_CLIENT_VER
+    app.nextValidOrderId = 1
+    return app
+
+
+def nsPerCall(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9
+
+
+def runBenchmark(nSymbols: int = 1000, number: int = 20000) -> dict:
+    app = makeApp(nSymbols)
+    items = list(app.tradingPlan.plan.values())
+    gate = makeGate(app.tradingPlan)
+    item = items[nSymbols // 2]
+
+    def trigger():
+        app.triggerBuy(item, 100.1, 99.9)
+
+    loggingWas = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        checkNs = nsPerCall(lambda: gate.check(item, 100, 100.1), number)
+        app.riskGate = None
+        withoutNs = nsPerCall(trigger, number)
+        app.riskGate = gate
+        withNs = nsPerCall(trigger, number)
+    finally:
+        logging.disable(loggingWas)
+    return {
+        "checkNs": checkNs,
+        "triggerUs": withoutNs / 1000,
+        "gatedTriggerUs": withNs / 1000,
+        "overheadNs": withNs - withoutNs,
+    }
+
+
+def main():
+    result = runBenchmark()
+    print("RiskGate.check:          %(checkNs)8.0f ns/order" % result)
+    print("triggerBuy without gate: %(triggerUs)8.2f us/order" % result)
+    print("triggerBuy with gate:    %(gatedTriggerUs)8.2f us/order" % result)
+    print("overhead:                %(overheadNs)8.0f ns/order" % result)
+
+
+if __name__ == "__main__":
+    main()
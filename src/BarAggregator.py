@@ -0,0 +1,130 @@
+import datetime
+import logging
+
+from ibapi.common import *
+
+from TradingPlan import TradingPlan
+
+
+class BarAggregator:
+
+    """ 1-minute, 5-minute and session bars of every plan symbol, built
+    incrementally from the 5-second realtime bars (or trades) as they
+    arrive, so the strategy has longer-horizon context and the session open
+    without asking TWS for historical data.
+
+    Each symbol keeps a ring of the last depth bars per timeframe, the
+    newest one still forming, allocated when the symbol enters the plan:
+    memory is constant per symbol and timeframe. Minute bars are aligned to
+    the clock; a session bar runs from sessionStart in timeZone to the next
+    day's sessionStart, so with RTH data it covers exactly one session. """
+
+    START, OPEN, HIGH, LOW, CLOSE, VOLUME, SUM_PV, COUNT = range(8)
+    # Named like the TWS bar sizes
+    TIMEFRAMES = ("1 min", "5 mins", "session")
+    SESSION = 2
+
+    def __init__(self, tradingPlan: TradingPlan, depth: int = 12, sessionStart: str = "09:30",
+                 sessionLength: float = 6.5 * 3600, timeZone: str = "America/New_York"):
+        self.depth = depth
+        (self.sessionHour, self.sessionMinute) = (int(part) for part in sessionStart.split(":"))
+        self.sessionLength = sessionLength
+        try:
+            import zoneinfo
+            self.timeZone = zoneinfo.ZoneInfo(timeZone)
+        except (ImportError, KeyError, ValueError):
+            logging.warning("Time zone %s is unknown, sessions start at %s local time", timeZone, sessionStart)
+            self.timeZone = None
+        # [sessionFrom, sessionTo) is the session bucket of the latest bar
+        self.sessionFrom = self.sessionTo = 0
+        # symbol -> [counts, rings]; counts[tf] is the number of bars begun
+        # and rings[tf][count % depth] the newest of them
+        self.bySymbol = {}
+        self.reqId2row = {}
+        self.load(tradingPlan)
+
+    def load(self, tradingPlan: TradingPlan):
+        """ Allocates the rows of a (re)loaded plan. Symbols that were in the
+        previous plan keep their bars. """
+        bySymbol = {}
+        self.reqId2row = {}
+        for item in tradingPlan.plan.values():
+            row = self.bySymbol.get(item.symbol)
+            if row is None:
+                row = [[0] * len(self.TIMEFRAMES),
+                       [[[0.] * 8 for _ in range(self.depth)] for _ in self.TIMEFRAMES]]
+            bySymbol[item.symbol] = row
+            self.reqId2row[item.reqId] = row
+        self.bySymbol = bySymbol
+
+    def sessionStartOf(self, time_: float) -> int:
+        """ Start of the latest session bucket begun at or before time_. The
+        bucket is cached, so the time zone is only consulted once a day. """
+        if self.sessionFrom <= time_ < self.sessionTo:
+            return self.sessionFrom
+        # Wall clock arithmetic, so days with a DST change are 23 or 25 hours
+        local = datetime.datetime.fromtimestamp(time_, self.timeZone)
+        start = local.replace(hour=self.sessionHour, minute=self.sessionMinute, second=0, microsecond=0)
+        if start > local:
+            start -= datetime.timedelta(days=1)
+        (self.sessionFrom, self.sessionTo) = (int(start.timestamp()),
+                                              int((start + datetime.timedelta(days=1)).timestamp()))
+        return self.sessionFrom
+
+    def inSession(self, time_: float) -> bool:
+        return time_ - self.sessionStartOf(time_) < self.sessionLength
+
+    def addBar(self, reqId: TickerId, time_: int, open_: float, high: float, low: float,
+               close: float, volume: float, wap: float) -> bool:
+        """ Adds a bar starting at time_, or a trade with open_ = high = low =
+        close = wap. Returns True when the bar begins a new session bar. """
+        row = self.reqId2row.get(reqId)
+        if row is None:
+            return False
+        sessionFrom = self.sessionFrom if self.sessionFrom <= time_ < self.sessionTo else self.sessionStartOf(time_)
+
+        (counts, rings) = row
+        depth = self.depth
+        newSession = False
+        for (tf, start) in enumerate((time_ - time_ % 60, time_ - time_ % 300, sessionFrom)):
+            count = counts[tf]
+            bar = rings[tf][(count - 1) % depth]
+            if count and bar[0] == start:
+                if high > bar[2]:
+                    bar[2] = high
+                if low < bar[3]:
+                    bar[3] = low
+                bar[4] = close
+                bar[5] += volume
+                bar[6] += wap * volume
+                bar[7] += 1
+            else:
+                bar = rings[tf][count % depth]
+                (bar[0], bar[1], bar[2], bar[3], bar[4], bar[5], bar[6], bar[7]) = (
+                    start, open_, high, low, close, volume, wap * volume, 1)
+                counts[tf] = count + 1
+                newSession = tf == self.SESSION
+        return newSession
+
+    # Queries
+
+    def nBars(self, reqId: TickerId, timeframe: str) -> int:
+        """ Number of bars of timeframe begun so far, the forming one included. """
+        return self.reqId2row[reqId][0][self.TIMEFRAMES.index(timeframe)]
+
+    def bar(self, reqId: TickerId, timeframe: str, ago: int = 0):
+        """ (start, open, high, low, close, volume, vwap, nBars) of the bar
+        ago bars before the forming one of timeframe, or None if it is not
+        kept. nBars counts the 5-second bars or trades aggregated. """
+        (counts, rings) = self.reqId2row[reqId]
+        tf = self.TIMEFRAMES.index(timeframe)
+        if ago >= min(counts[tf], self.depth):
+            return None
+        (start, open_, high, low, close, volume, sumPV, count) = rings[tf][(counts[tf] - 1 - ago) % self.depth]
+        return (int(start), open_, high, low, close, volume,
+                sumPV / volume if volume > 0 else float("nan"), int(count))
+
+    def sessionOpen(self, reqId: TickerId) -> float:
+        """ Open of the current session bar, NaN before the first bar. """
+        bar = self.bar(reqId, "session")
+        return float("nan") if bar is None else bar[self.OPEN]
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+
+
+class BarFile:
+
+    """ Recorded 5-second bars, one .npy file per symbol and trading day:
+
+        <dataDir>/<SYMBOL>/<YYYYMMDD>.npy
+
+    Each file holds a structured array with the fields of
+    EWrapper.realtimeBar and is memory-mapped when read, so replaying months
+    of data does not load it all into memory. """
+
+    BAR_DTYPE = np.dtype([("time", "<i8"),
+                          ("open", "<f8"),
+                          ("high", "<f8"),
+                          ("low", "<f8"),
+                          ("close", "<f8"),
+                          ("volume", "<i8"),
+                          ("wap", "<f8"),
+                          ("count", "<i8")])
+
+    @staticmethod
+    def path(dataDir: str, symbol: str, tradingDate: str) -> str:
+        return os.path.join(dataDir, symbol, tradingDate + ".npy")
+
+    @staticmethod
+    def write(fileName: str, bars):
+        """ bars: iterable of (time, open, high, low, close, volume, wap, count) """
+        os.makedirs(os.path.dirname(fileName) or ".", exist_ok=True)
+        np.save(fileName, np.array(list(bars), dtype=BarFile.BAR_DTYPE))
+
+    @staticmethod
+    def read(fileName: str) -> np.ndarray:
+        bars = np.load(fileName, mmap_mode="r")
+        if bars.dtype != BarFile.BAR_DTYPE:
+            raise ValueError("%s does not hold 5-second bars: dtype %s" % (fileName, bars.dtype))
+        return bars
+
+    @staticmethod
+    def listDataset(dataDir: str, fromDate: str = None, toDate: str = None) -> dict:
+        """ Returns {symbol: [tradingDate, ...]} with the dates sorted. """
+        dataset = {}
+        for symbol in sorted(os.listdir(dataDir)):
+            symbolDir = os.path.join(dataDir, symbol)
+            if not os.path.isdir(symbolDir):
+                continue
+            dates = []
+            for fileName in sorted(os.listdir(symbolDir)):
+                (tradingDate, ext) = os.path.splitext(fileName)
+                if ext != ".npy":
+                    continue
+                if fromDate is not None and tradingDate < fromDate:
+                    continue
+                if toDate is not None and tradingDate > toDate:
+                    continue
+                dates.append(tradingDate)
+            if dates:
+                dataset[symbol] = dates
+        return dataset
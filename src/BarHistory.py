@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+from ibapi.common import *
+
+from TradingPlan import TradingPlan
+
+
+class BarHistory:
+
+    """ The last capacity realtime bars of every plan symbol, with indicators
+    that are updated in O(1) as each bar arrives:
+
+        vwap        volume weighted average price over the bars kept
+        high, low   highest high and lowest low over the bars kept
+        ema         exponential moving average of the close, emaPeriod bars
+        atr         Wilder's average true range, atrPeriod bars
+
+    Everything lives in arrays allocated once per plan load, one row per
+    symbol, so memory is fixed at 72 * capacity + 80 bytes per symbol. The
+    rolling high and low use monotonic queues of bar sequence numbers kept
+    in preallocated rows as well. """
+
+    TIME, OPEN, HIGH, LOW, CLOSE, VOLUME, WAP = range(7)
+    # Columns of state: the indicators, the number of bars seen so far and
+    # the [head, tail) ranges of the two monotonic queues
+    EMA, ATR, PREV_CLOSE, SUM_PV, SUM_V, COUNT, MAX_HEAD, MAX_TAIL, MIN_HEAD, MIN_TAIL = range(10)
+    MAX_QUEUE, MIN_QUEUE = range(2)
+
+    def __init__(self, tradingPlan: TradingPlan, capacity: int = 120,
+                 emaPeriod: int = 20, atrPeriod: int = 14):
+        self.capacity = capacity
+        self.emaAlpha = 2. / (emaPeriod + 1)
+        self.atrPeriod = atrPeriod
+        self.symbols = []
+        self.reqId2row = {}
+        self.load(tradingPlan)
+
+    def load(self, tradingPlan: TradingPlan):
+        """ Allocates the rows of a (re)loaded plan. Symbols that were in the
+        previous plan keep their history. """
+        oldRowOf = {symbol: row for (row, symbol) in enumerate(self.symbols)}
+        if oldRowOf:
+            (oldBars, oldState, oldQueues) = (self.bars, self.state, self.queues)
+
+        items = list(tradingPlan.plan.values())
+        self.symbols = [item.symbol for item in items]
+        self.reqId2row = {item.reqId: row for (row, item) in enumerate(items)}
+
+        (n, capacity) = (len(items), self.capacity)
+        # The newest bar of a row is in slot (COUNT - 1) % capacity
+        self.bars = np.zeros((n, capacity, 7), dtype=np.float64)
+        self.state = np.zeros((n, 10), dtype=np.float64)
+        self.state[:, :self.SUM_PV] = np.nan
+        # Bar sequence numbers, oldest first, in the [head, tail) ranges
+        self.queues = np.zeros((n, 2, capacity), dtype=np.int64)
+
+        if oldRowOf:
+            pairs = [(row, oldRowOf[symbol]) for (row, symbol) in enumerate(self.symbols)
+                     if symbol in oldRowOf]
+            if pairs:
+                rows = np.array([row for (row, oldRow) in pairs])
+                oldRows = np.array([oldRow for (row, oldRow) in pairs])
+                self.bars[rows] = oldBars[oldRows]
+                self.state[rows] = oldState[oldRows]
+                self.queues[rows] = oldQueues[oldRows]
+
+    def memoryBytes(self) -> int:
+        return self.bars.nbytes + self.state.nbytes + self.queues.nbytes
+
+    def addBar(self, reqId: TickerId, time_: int, open_: float, high: float, low: float,
+               close: float, volume: float, wap: float) -> bool:
+        row = self.reqId2row.get(reqId)
+        if row is None:
+            return False
+
+        capacity = self.capacity
+        bars = self.bars[row]
+        (ema, atr, prevClose, sumPV, sumV,
+         seq, maxHead, maxTail, minHead, minTail) = self.state[row].tolist()
+        seq = int(seq)
+        slot = seq % capacity
+
+        # The bar that falls out of the window leaves the VWAP sums. Once per
+        # lap of the ring the sums are recomputed, so rounding cannot drift.
+        if seq >= capacity:
+            evictedVolume = bars.item(slot, self.VOLUME)
+            sumPV -= bars.item(slot, self.WAP) * evictedVolume
+            sumV -= evictedVolume
+        bars[slot] = (time_, open_, high, low, close, volume, wap)
+        if slot == capacity - 1:
+            sumPV = float(np.dot(bars[:, self.WAP], bars[:, self.VOLUME]))
+            sumV = float(bars[:, self.VOLUME].sum())
+        else:
+            sumPV += wap * volume
+            sumV += volume
+
+        if math.isnan(prevClose):
+            ema = close
+            trueRange = high - low
+        else:
+            ema += self.emaAlpha * (close - ema)
+            trueRange = max(high - low, abs(high - prevClose), abs(low - prevClose))
+        # Plain average over the first atrPeriod bars, Wilder's smoothing after
+        atr = trueRange if math.isnan(atr) else atr + (trueRange - atr) / min(seq + 1, self.atrPeriod)
+
+        queues = self.queues[row]
+        oldest = seq - capacity + 1
+        (maxHead, maxTail) = self.push(queues, self.MAX_QUEUE, int(maxHead), int(maxTail),
+                                       seq, oldest, bars, self.HIGH, high)
+        (minHead, minTail) = self.push(queues, self.MIN_QUEUE, int(minHead), int(minTail),
+                                       seq, oldest, bars, self.LOW, low)
+
+        self.state[row] = (ema, atr, close, sumPV, sumV, seq + 1, maxHead, maxTail, minHead, minTail)
+        return True
+
+    def push(self, queues, queue: int, head: int, tail: int, seq: int, oldest: int,
+             bars, column: int, value: float) -> tuple:
+        """ Appends seq to a monotonic queue and returns its new (head, tail).
+        Each sequence number is pushed and dropped once, so this is O(1)
+        amortized. """
+        capacity = self.capacity
+        keepMax = queue == self.MAX_QUEUE
+        if head < tail and queues.item(queue, head % capacity) < oldest:
+            head += 1
+        while head < tail:
+            last = bars.item(queues.item(queue, (tail - 1) % capacity) % capacity, column)
+            if (last > value) if keepMax else (last < value):
+                break
+            tail -= 1
+        queues[queue, tail % capacity] = seq
+        return (head, tail + 1)
+
+    # Indicators, NaN until the symbol has a bar
+
+    def bar(self, reqId: TickerId, ago: int = 0):
+        """ (time, open, high, low, close, volume, wap) of the bar ago bars
+        before the newest one, or None if it is not kept. """
+        row = self.reqId2row[reqId]
+        count = self.nBars(reqId)
+        if ago >= min(count, self.capacity):
+            return None
+        return tuple(self.bars[row, (count - 1 - ago) % self.capacity].tolist())
+
+    def history(self, reqId: TickerId) -> np.ndarray:
+        """ Copy of the bars kept, oldest first. """
+        row = self.reqId2row[reqId]
+        count = self.nBars(reqId)
+        if count <= self.capacity:
+            return self.bars[row, :count].copy()
+        return np.roll(self.bars[row], -(count % self.capacity), axis=0)
+
+    def nBars(self, reqId: TickerId) -> int:
+        return int(self.state[self.reqId2row[reqId], self.COUNT])
+
+    def vwap(self, reqId: TickerId) -> float:
+        (sumPV, sumV) = self.state[self.reqId2row[reqId], self.SUM_PV:self.COUNT].tolist()
+        return sumPV / sumV if sumV > 0 else float("nan")
+
+    def ema(self, reqId: TickerId) -> float:
+        return float(self.state[self.reqId2row[reqId], self.EMA])
+
+    def atr(self, reqId: TickerId) -> float:
+        return float(self.state[self.reqId2row[reqId], self.ATR])
+
+    def high(self, reqId: TickerId) -> float:
+        return self.extreme(reqId, self.MAX_QUEUE, self.MAX_HEAD, self.HIGH)
+
+    def low(self, reqId: TickerId) -> float:
+        return self.extreme(reqId, self.MIN_QUEUE, self.MIN_HEAD, self.LOW)
+
+    def extreme(self, reqId: TickerId, queue: int, headColumn: int, column: int) -> float:
+        row = self.reqId2row[reqId]
+        if self.state[row, self.COUNT] == 0:
+            return float("nan")
+        head = int(self.state[row, headColumn])
+        seq = self.queues[row, queue, head % self.capacity]
+        return float(self.bars[row, seq % self.capacity, column])
@@ -0,0 +1,65 @@
+import collections
+import inspect
+
+
+class CallCounter:
+
+    """ Counts the calls of every method of an API class (EClient, EWrapper)
+    and the requests/answers per reqId.
+
+    Nothing is wrapped until install() is called, so a disabled counter costs
+    nothing. Once installed, each wrapped method bumps a preallocated slot
+    indexed by the method's position in methNames, and methods without a
+    reqId parameter skip the reqId bookkeeping entirely. """
+
+    def __init__(self, apiClass, skipMethods=(), countReqId=lambda methName: True):
+        self.apiClass = apiClass
+        self.methNames = []
+        self.methods = []
+        self.reqIdIdx = []
+        for (methName, meth) in inspect.getmembers(apiClass, inspect.isfunction):
+            if methName in skipMethods:
+                continue
+            idx = -1
+            if countReqId(methName):
+                for (paramIdx, paramName) in enumerate(inspect.signature(meth).parameters):
+                    if paramName == "reqId":
+                        idx = paramIdx
+            self.methNames.append(methName)
+            self.methods.append(meth)
+            self.reqIdIdx.append(idx)
+
+        self.callCount = [0] * len(self.methNames)
+        self.reqId2nCall = collections.defaultdict(int)
+        self.installedOn = None
+
+    def makeCounted(self, methIdx: int, fn, sign: int):
+        callCount = self.callCount
+        reqId2nCall = self.reqId2nCall
+        reqIdIdx = self.reqIdIdx[methIdx]
+
+        if reqIdIdx < 0:
+            def counted_(*args, **kwargs):
+                callCount[methIdx] += 1
+                return fn(*args, **kwargs)
+        else:
+            def counted_(*args, **kwargs):
+                callCount[methIdx] += 1
+                reqId2nCall[sign * args[reqIdIdx]] += 1
+                return fn(*args, **kwargs)
+
+        counted_.__name__ = fn.__name__
+        counted_.__doc__ = fn.__doc__
+        return counted_
+
+    def install(self, targetClass, signOf=lambda methName: 1):
+        """ Replaces the methods of targetClass, which must derive from
+        apiClass, by counting versions. Only the first call has an effect. """
+        if self.installedOn is not None:
+            return
+        self.installedOn = targetClass
+        for (methIdx, (methName, meth)) in enumerate(zip(self.methNames, self.methods)):
+            setattr(targetClass, methName, self.makeCounted(methIdx, meth, signOf(methName)))
+
+    def callCounts(self) -> dict:
+        return dict(zip(self.methNames, self.callCount))
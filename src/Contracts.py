@@ -6,12 +6,16 @@ Copyright (C) 2019 Interactive Brokers LLC. All rights reserved. This code is su
 ### Adapted from TWS API samples/Python/Testbed/ContactSamples.py
 
 from ibapi.contract import * # @UnusedWildImport
+from ibapi.utils import isAsciiPrintable
 
 class Contracts:
 
     """ Usually, the easiest way to define a Stock/CASH contract is through 
     these four attributes.  """
 
+    # symbol -> USStockAtSmart contract, see CacheUSStockAtSmart()
+    smartStockCache = {}
+
     @staticmethod
     def USStock(symbol: str):
         #! [stkcontract]
@@ -49,3 +53,28 @@ class Contracts:
         contract.exchange = "SMART"
         return contract
 
+
+    """ Builds the USStockAtSmart contract of every symbol once, typically when
+    the trading plan is loaded or reloaded, so the order path can reuse them.
+    The cache is merged into, not replaced, as the plans sharing a process
+    load theirs in turn. The cached contracts are shared: callers must not
+    modify them. """
+    @staticmethod
+    def CacheUSStockAtSmart(symbols):
+        cache = Contracts.smartStockCache
+        for symbol in symbols:
+            if symbol in cache:
+                continue
+            # Validate now rather than when make_field() rejects it on the order path
+            if not symbol or not isAsciiPrintable(symbol):
+                raise ValueError("Invalid contract symbol %r" % symbol)
+            cache[symbol] = Contracts.USStockAtSmart(symbol)
+
+
+    @staticmethod
+    def CachedUSStockAtSmart(symbol: str):
+        contract = Contracts.smartStockCache.get(symbol)
+        if contract is None:
+            contract = Contracts.USStockAtSmart(symbol)
+            Contracts.smartStockCache[symbol] = contract
+        return contract
@@ -0,0 +1,133 @@
+import collections
+import struct
+import threading
+import time
+
+
+class EventJournal:
+
+    """ Compact append-only binary journal of bars, triggers and order events.
+
+    Recording packs the event into a struct and appends it to an
+    in-memory deque; a background thread writes the pending records to disk,
+    so the message-processing thread never waits for I/O. Each record is a
+    one-byte type and a nanosecond wall-clock timestamp followed by the
+    type's payload. A symbol is not cut to a fixed size: it follows the
+    payload, whose last field is its length. Use read() or the
+    JournalReader tool to render it. """
+
+    MAGIC = b"TWSJRNL2"
+
+    BAR = 1
+    TRIGGER = 2
+    ORDER_STATUS = 3
+    POSITION = 4
+
+    HEADER = struct.Struct("<BQ")
+    PAYLOADS = {
+        BAR: struct.Struct("<iqddddqdi"),
+        TRIGGER: struct.Struct("<q4sdddH"),
+        ORDER_STATUS: struct.Struct("<q16sddd"),
+        POSITION: struct.Struct("<ddH"),
+    }
+    # Record types followed by a symbol -> its place in FIELDS
+    SYMBOL_AT = {TRIGGER: 1, POSITION: 0}
+    RECORDS = {recType: struct.Struct("<BQ" + payload.format[1:])
+               for (recType, payload) in PAYLOADS.items()}
+    FIELDS = {
+        BAR: ("reqId", "time", "open", "high", "low", "close", "volume", "wap", "count"),
+        TRIGGER: ("orderId", "symbol", "action", "quantity", "price", "priceFiveSecsAgo"),
+        ORDER_STATUS: ("orderId", "status", "filled", "remaining", "avgFillPrice"),
+        POSITION: ("symbol", "position", "avgCost"),
+    }
+    NAMES = {BAR: "BAR", TRIGGER: "TRIGGER", ORDER_STATUS: "ORDER_STATUS", POSITION: "POSITION"}
+
+    def __init__(self, fileName: str, flushInterval: float = 0.1):
+        self.fileName = fileName
+        self.flushInterval = flushInterval
+        self.pending = collections.deque()
+        self.file = open(fileName, "ab")
+        if self.file.tell() == 0:
+            self.file.write(self.MAGIC)
+        self.stopping = threading.Event()
+        self.writer = threading.Thread(target=self.writeLoop, name="EventJournal", daemon=True)
+        self.writer.start()
+
+    # Recording, called from the message thread
+
+    def bar(self, reqId: int, time_: int, open_: float, high: float, low: float, close: float,
+            volume: int, wap: float, count: int):
+        self.pending.append(self.RECORDS[self.BAR].pack(
+            self.BAR, time.time_ns(), reqId, time_, open_, high, low, close, volume, wap, count))
+
+    def trigger(self, orderId: int, symbol: str, action: str, quantity: float, price: float,
+                priceFiveSecsAgo: float):
+        symbol = symbol.encode()
+        self.pending.append(self.RECORDS[self.TRIGGER].pack(
+            self.TRIGGER, time.time_ns(), orderId, action.encode(), quantity, price,
+            priceFiveSecsAgo if priceFiveSecsAgo is not None else float("nan"), len(symbol)) + symbol)
+
+    def orderStatus(self, orderId: int, status: str, filled: float, remaining: float,
+                    avgFillPrice: float):
+        self.pending.append(self.RECORDS[self.ORDER_STATUS].pack(
+            self.ORDER_STATUS, time.time_ns(), orderId, status.encode(), filled, remaining,
+            avgFillPrice))
+
+    def position(self, symbol: str, position: float, avgCost: float):
+        symbol = symbol.encode()
+        self.pending.append(self.RECORDS[self.POSITION].pack(
+            self.POSITION, time.time_ns(), position, avgCost, len(symbol)) + symbol)
+
+    # Background writer
+
+    def writeLoop(self):
+        while not self.stopping.wait(self.flushInterval):
+            self.writePending()
+        self.writePending()
+
+    def writePending(self):
+        pending = self.pending
+        chunks = []
+        while pending:
+            chunks.append(pending.popleft())
+        if chunks:
+            self.file.write(b"".join(chunks))
+            self.file.flush()
+
+    def close(self):
+        self.stopping.set()
+        self.writer.join()
+        self.file.close()
+
+    # Reading
+
+    @staticmethod
+    def read(fileName: str):
+        """ Yields (recTypeName, timestampNs, {field: value}) for every record. """
+        with open(fileName, "rb") as journalFile:
+            data = journalFile.read()
+        if not data.startswith(EventJournal.MAGIC):
+            raise ValueError("%s is not an event journal" % fileName)
+
+        offset = len(EventJournal.MAGIC)
+        header = EventJournal.HEADER
+        while offset + header.size <= len(data):
+            (recType, timestampNs) = header.unpack_from(data, offset)
+            payload = EventJournal.PAYLOADS.get(recType)
+            if payload is None:
+                raise ValueError("unknown record type %d at offset %d" % (recType, offset))
+            end = offset + header.size + payload.size
+            if end > len(data):
+                # torn write at the end of the file
+                break
+            values = list(payload.unpack_from(data, offset + header.size))
+            if recType in EventJournal.SYMBOL_AT:
+                symbolEnd = end + values.pop()
+                if symbolEnd > len(data):
+                    break
+                values.insert(EventJournal.SYMBOL_AT[recType], data[end:symbolEnd])
+                end = symbolEnd
+            values = [v.rstrip(b"\0").decode() if isinstance(v, bytes) else v for v in values]
+            yield (EventJournal.NAMES[recType], timestampNs,
+                   dict(zip(EventJournal.FIELDS[recType], values)))
+            offset = end
@@ -0,0 +1,399 @@
+import logging
+import socket
+import struct
+import threading
+import time
+
+from ibapi.message import IN, OUT
+
+
+class FakeTwsSession:
+
+    """ State of one API client connected to the FakeTwsServer. """
+
+    def __init__(self, sock: socket.socket, addr):
+        self.sock = sock
+        self.addr = addr
+        self.sendLock = threading.Lock()
+        self.clientId = None
+        self.connected = True
+        self.wantsPositions = False
+        self.reqId2symbol = {}
+        self.symbol2reqIds = {}
+        # reqId -> "Last"/"AllLast"/"BidAsk" of the tick-by-tick subscriptions
+        self.tickTypes = {}
+
+
+class FakeTwsServer:
+
+    """ A local stand-in for TWS speaking just enough of the socket protocol
+    for TestApp: handshake, nextValidId, reqPositions, reqRealTimeBars,
+    reqTickByTickData, reqHistoricalData, placeOrder/execDetails/orderStatus
+    and reqOpenOrders/reqExecutions.
+
+    Realtime bars are streamed from per-symbol scripts of close prices, which
+    are replayed in a loop at barsPerSecond (0 means as fast as the socket
+    takes them). Tick-by-tick subscriptions get one tick per step of the
+    script instead of a bar, a trade at the close or a quote around it. Market orders are filled at the last streamed close and the
+    new position is pushed to clients that called reqPositions. With
+    fillOrders False they stay open until fillOpenOrders(); reqOpenOrders
+    reports them with their orderStatus only.
+
+    For benchmarking, the server keeps the time each bar was written to the
+    socket and records, for every placeOrder, the delay since the latest bar
+    of the same symbol in orderLatenciesNs. """
+
+    SERVER_VERSION = 151
+    # placeOrder/historical layouts below assume no per-message VERSION field
+    MIN_SERVER_VERSION = 145
+    ACCOUNT = "DU0000000"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, barsPerSecond: float = 0,
+                 firstOrderId: int = 1, fillOrders: bool = True):
+        self.host = host
+        self.port = port
+        self.barsPerSecond = barsPerSecond
+        self.nextOrderId = firstOrderId
+        self.fillOrders = fillOrders
+
+        self.barScripts = {}
+        self.defaultPrice = 100.0
+        self.positions = {}
+        self.lastClose = {}
+        # orderId -> (clientId, symbol, action, quantity) of the unfilled orders
+        self.openOrders = {}
+        # (clientId, orderId, symbol, action, quantity, price, execId) of every fill
+        self.executions = []
+
+        self.sessions = []
+        self.sessionsLock = threading.Lock()
+        self.listenSock = None
+        self.running = False
+        self.streaming = threading.Event()
+        self.threads = []
+
+        self.barsWritten = 0
+        self.nExecutions = 0
+        self.lastBarWriteNs = {}
+        self.orderLatenciesNs = []
+        self.ordersReceived = 0
+
+    def setBarScript(self, symbol: str, closes: list):
+        self.barScripts[symbol] = list(closes)
+
+    def setPosition(self, symbol: str, position: float):
+        self.positions[symbol] = position
+
+    def start(self):
+        self.listenSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listenSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listenSock.bind((self.host, self.port))
+        self.listenSock.listen()
+        self.port = self.listenSock.getsockname()[1]
+        self.running = True
+        self.streaming.set()
+
+        for target in (self.acceptLoop, self.streamLoop):
+            thread = threading.Thread(target=target, name="FakeTws-" + target.__name__, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logging.info("FakeTwsServer listening on %s:%d", self.host, self.port)
+
+    def stop(self):
+        self.running = False
+        self.streaming.set()
+        if self.listenSock is not None:
+            self.listenSock.close()
+        with self.sessionsLock:
+            for session in self.sessions:
+                self.closeSession(session)
+        for thread in self.threads:
+            thread.join(timeout=2)
+
+    def pauseStreaming(self):
+        self.streaming.clear()
+
+    def resumeStreaming(self):
+        self.streaming.set()
+
+    def fillOpenOrders(self):
+        """ Fills the open orders, also those of clients not connected. """
+        with self.sessionsLock:
+            sessions = list(self.sessions)
+        for (orderId, (clientId, symbol, action, quantity)) in list(self.openOrders.items()):
+            del self.openOrders[orderId]
+            session = next((s for s in sessions if s.clientId == clientId and s.connected), None)
+            self.fill(session, orderId, clientId, symbol, action, quantity)
+
+    def dropConnections(self):
+        """ Closes every client socket, as a TWS restart would. """
+        with self.sessionsLock:
+            for session in self.sessions:
+                self.closeSession(session)
+
+    def closeSession(self, session: FakeTwsSession):
+        session.connected = False
+        try:
+            session.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        session.sock.close()
+
+    # Wire format helpers
+
+    @staticmethod
+    def makeMsg(*fields) -> bytes:
+        text = "".join(str(field) + "\0" for field in fields).encode()
+        return struct.pack("!I", len(text)) + text
+
+    def send(self, session: FakeTwsSession, data: bytes) -> bool:
+        try:
+            with session.sendLock:
+                session.sock.sendall(data)
+            return True
+        except OSError:
+            session.connected = False
+            return False
+
+    @staticmethod
+    def recvExactly(sock: socket.socket, size: int) -> bytes:
+        buf = b""
+        while len(buf) < size:
+            chunk = sock.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            buf += chunk
+        return buf
+
+    def recvMsg(self, sock: socket.socket) -> bytes:
+        (size,) = struct.unpack("!I", self.recvExactly(sock, 4))
+        return self.recvExactly(sock, size)
+
+    # Connection handling
+
+    def acceptLoop(self):
+        while self.running:
+            try:
+                (sock, addr) = self.listenSock.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = FakeTwsSession(sock, addr)
+            thread = threading.Thread(target=self.sessionLoop, args=(session,),
+                                      name="FakeTws-session", daemon=True)
+            thread.start()
+
+    def sessionLoop(self, session: FakeTwsSession):
+        try:
+            if not self.handshake(session):
+                return
+            with self.sessionsLock:
+                self.sessions.append(session)
+            while self.running and session.connected:
+                fields = self.recvMsg(session.sock).split(b"\0")[:-1]
+                self.handleRequest(session, fields)
+        except (ConnectionError, OSError, struct.error):
+            pass
+        finally:
+            session.connected = False
+            with self.sessionsLock:
+                if session in self.sessions:
+                    self.sessions.remove(session)
+            session.sock.close()
+            logging.info("FakeTwsServer: client %s disconnected", session.clientId)
+
+    def handshake(self, session: FakeTwsSession) -> bool:
+        prefix = self.recvExactly(session.sock, 4)
+        if prefix != b"API\0":
+            logging.error("FakeTwsServer: bad handshake prefix %s", prefix)
+            return False
+
+        # "v<min>..<max>[ connectOptions]"
+        versions = self.recvMsg(session.sock).decode().split(" ")[0]
+        (minVersion, maxVersion) = (int(v) for v in versions[1:].split(".."))
+        serverVersion = min(maxVersion, self.SERVER_VERSION)
+        if serverVersion < max(minVersion, self.MIN_SERVER_VERSION):
+            logging.error("FakeTwsServer: unsupported client versions %s", versions)
+            return False
+
+        connTime = time.strftime("%Y%m%d %H:%M:%S EST")
+        return self.send(session, self.makeMsg(serverVersion, connTime))
+
+    def handleRequest(self, session: FakeTwsSession, fields: list):
+        if not fields:
+            return
+        msgId = int(fields[0])
+
+        if msgId == OUT.START_API:
+            session.clientId = int(fields[2])
+            self.send(session, self.makeMsg(IN.MANAGED_ACCTS, 1, self.ACCOUNT) +
+                               self.makeMsg(IN.NEXT_VALID_ID, 1, self.nextOrderId))
+
+        elif msgId == OUT.REQ_IDS:
+            self.send(session, self.makeMsg(IN.NEXT_VALID_ID, 1, self.nextOrderId))
+
+        elif msgId == OUT.REQ_POSITIONS:
+            session.wantsPositions = True
+            data = b"".join(self.positionMsg(symbol, position)
+                            for (symbol, position) in self.positions.items())
+            self.send(session, data + self.makeMsg(IN.POSITION_END, 1))
+
+        elif msgId == OUT.REQ_REAL_TIME_BARS:
+            reqId = int(fields[2])
+            symbol = fields[4].decode()
+            session.reqId2symbol[reqId] = symbol
+            session.symbol2reqIds.setdefault(symbol, []).append(reqId)
+
+        elif msgId == OUT.CANCEL_REAL_TIME_BARS:
+            self.unsubscribe(session, int(fields[2]))
+
+        elif msgId == OUT.REQ_TICK_BY_TICK_DATA:
+            reqId = int(fields[1])
+            symbol = fields[3].decode()
+            session.tickTypes[reqId] = fields[14].decode()
+            session.reqId2symbol[reqId] = symbol
+            session.symbol2reqIds.setdefault(symbol, []).append(reqId)
+
+        elif msgId == OUT.CANCEL_TICK_BY_TICK_DATA:
+            self.unsubscribe(session, int(fields[1]))
+
+        elif msgId == OUT.REQ_HISTORICAL_DATA:
+            reqId = int(fields[1])
+            symbol = fields[3].decode()
+            price = self.scriptFor(symbol)[0]
+            today = time.strftime("%Y%m%d")
+            self.send(session, self.makeMsg(IN.HISTORICAL_DATA, reqId, today, today, 1,
+                                            today, price, price, price, price, 0, price, 0))
+
+        elif msgId == OUT.PLACE_ORDER:
+            self.handlePlaceOrder(session, fields)
+
+        elif msgId == OUT.REQ_OPEN_ORDERS:
+            data = b"".join(self.orderStatusMsg(orderId, "Submitted", 0, quantity, 0, clientId)
+                            for (orderId, (clientId, symbol, action, quantity)) in list(self.openOrders.items())
+                            if clientId == session.clientId)
+            self.send(session, data + self.makeMsg(IN.OPEN_ORDER_END, 1))
+
+        elif msgId == OUT.REQ_EXECUTIONS:
+            reqId = int(fields[2])
+            data = b"".join(self.executionMsg(reqId, *execution)
+                            for execution in list(self.executions) if execution[0] == session.clientId)
+            self.send(session, data + self.makeMsg(IN.EXECUTION_DATA_END, 1, reqId))
+
+        elif msgId == OUT.CANCEL_ORDER:
+            orderId = int(fields[2])
+            self.send(session, self.orderStatusMsg(orderId, "Cancelled", 0, 0, 0, session.clientId))
+
+    def unsubscribe(self, session: FakeTwsSession, reqId: int):
+        session.tickTypes.pop(reqId, None)
+        symbol = session.reqId2symbol.pop(reqId, None)
+        if symbol is not None:
+            session.symbol2reqIds[symbol].remove(reqId)
+
+    def handlePlaceOrder(self, session: FakeTwsSession, fields: list):
+        now = time.perf_counter_ns()
+        orderId = int(fields[1])
+        symbol = fields[3].decode()
+        action = fields[16].decode()
+        quantity = float(fields[17])
+
+        self.ordersReceived += 1
+        self.nextOrderId = max(self.nextOrderId, orderId + 1)
+        lastBarWriteNs = self.lastBarWriteNs.get(symbol)
+        if lastBarWriteNs is not None:
+            self.orderLatenciesNs.append(now - lastBarWriteNs)
+
+        submitted = self.orderStatusMsg(orderId, "Submitted", 0, quantity, 0, session.clientId)
+        if not self.fillOrders:
+            self.openOrders[orderId] = (session.clientId, symbol, action, quantity)
+            self.send(session, submitted)
+            return
+        self.fill(session, orderId, session.clientId, symbol, action, quantity, submitted)
+
+    def fill(self, session: FakeTwsSession, orderId: int, clientId: int, symbol: str, action: str,
+             quantity: float, prefix: bytes = b""):
+        """ Fills the order at the last close, reporting it to session
+        unless it is None, and the new position to all that want it. """
+        price = self.lastClose.get(symbol, self.scriptFor(symbol)[0])
+        position = self.positions.get(symbol, 0) + (quantity if action == "BUY" else -quantity)
+        self.positions[symbol] = position
+        self.nExecutions += 1
+        execution = (clientId, orderId, symbol, action, quantity, price,
+                     "%08x.%08d.01" % (orderId, self.nExecutions))
+        self.executions.append(execution)
+        if session is not None:
+            self.send(session, prefix +
+                               self.executionMsg(-1, *execution) +
+                               self.orderStatusMsg(orderId, "Filled", quantity, 0, price, clientId))
+
+        positionMsg = self.positionMsg(symbol, position)
+        with self.sessionsLock:
+            sessions = list(self.sessions)
+        for other in sessions:
+            if other.wantsPositions:
+                self.send(other, positionMsg)
+
+    def orderStatusMsg(self, orderId: int, status: str, filled: float, remaining: float,
+                       avgFillPrice: float, clientId: int) -> bytes:
+        return self.makeMsg(IN.ORDER_STATUS, orderId, status, filled, remaining, avgFillPrice,
+                            orderId, 0, avgFillPrice, clientId, "", 0.0)
+
+    def executionMsg(self, reqId: int, clientId: int, orderId: int, symbol: str, action: str,
+                     quantity: float, price: float, execId: str) -> bytes:
+        return self.makeMsg(IN.EXECUTION_DATA, reqId, orderId,
+                            0, symbol, "STK", "", 0.0, "", "", "SMART", "USD", symbol, symbol,
+                            execId, time.strftime("%Y%m%d  %H:%M:%S"),
+                            self.ACCOUNT, "SMART", "BOT" if action == "BUY" else "SLD", quantity, price,
+                            orderId, clientId, 0, quantity, price, "", "", 0.0, "", 0)
+
+    def positionMsg(self, symbol: str, position: float) -> bytes:
+        return self.makeMsg(IN.POSITION_DATA, 3, self.ACCOUNT,
+                            0, symbol, "STK", "", 0.0, "", "", "SMART", "USD", symbol, symbol,
+                            position, 0.0)
+
+    def tickMsg(self, reqId: int, tickType: str, tickTime: int, price: float) -> bytes:
+        if tickType == "BidAsk":
+            return self.makeMsg(IN.TICK_BY_TICK, reqId, 3, tickTime, price - 0.01, price + 0.01, 100, 100, 0)
+        return self.makeMsg(IN.TICK_BY_TICK, reqId, 1 if tickType == "Last" else 2, tickTime,
+                            price, 100, 0, "SMART", "")
+
+    # Bar streaming
+
+    def scriptFor(self, symbol: str) -> list:
+        return self.barScripts.get(symbol) or [self.defaultPrice]
+
+    def streamLoop(self):
+        barTime = int(time.time())
+        step = 0
+        nextWriteAt = time.perf_counter()
+
+        while self.running:
+            self.streaming.wait()
+            with self.sessionsLock:
+                sessions = [s for s in self.sessions if s.connected and s.reqId2symbol]
+            if not sessions:
+                time.sleep(0.01)
+                continue
+
+            for session in sessions:
+                for (symbol, reqIds) in list(session.symbol2reqIds.items()):
+                    script = self.scriptFor(symbol)
+                    close = script[step % len(script)]
+                    self.lastClose[symbol] = close
+                    data = b"".join(self.tickMsg(reqId, session.tickTypes[reqId], barTime, close)
+                                    if reqId in session.tickTypes else
+                                    self.makeMsg(IN.REAL_TIME_BARS, 3, reqId, barTime,
+                                                 close, close, close, close, 100, close, 1)
+                                    for reqId in reqIds)
+                    if self.barsPerSecond > 0:
+                        nextWriteAt += len(reqIds) / self.barsPerSecond
+                        delay = nextWriteAt - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    self.lastBarWriteNs[symbol] = time.perf_counter_ns()
+                    if not self.send(session, data):
+                        break
+                    self.barsWritten += len(reqIds)
+
+            barTime += 5
+            step += 1
@@ -0,0 +1,166 @@
+import array
+import logging
+import os
+import struct
+import sys
+import time
+
+from ibapi.common import BarData
+
+
+class HistoricalBarStore:
+
+    """ Local store of the historical bars TWS sent us, keyed by symbol, bar
+    size and trading date, so a restart does not have to request them again:
+
+        <storeDir>/<barSize>/<YYYYMMDD>.bars
+
+    A file holds the bars of all symbols for one bar size and trading date
+    as a sequence of columnar segments: a header, the symbols and bar dates
+    as one block of NUL-separated text, then one packed array per numeric
+    BarData field. Reading a day is a few read() calls and array.frombytes()
+    per segment, whatever the number of symbols.
+
+    put() buffers bars in memory; flush() appends them to the files as one
+    segment per file and runs when maxPending bars or flushInterval seconds
+    have accumulated, or when the caller is idle. Files of past trading
+    dates are compacted into a single segment when they are read. A later
+    bar with the same symbol and date replaces an earlier one, so the
+    partial bar of the current day is updated by each new request. """
+
+    MAGIC = b"TWSBARS1"
+    # b"SEGM", number of bars, bytes of text
+    SEGMENT = struct.Struct("<4sII")
+    NUMERIC_FIELDS = (("open", "d"), ("high", "d"), ("low", "d"), ("close", "d"),
+                      ("volume", "q"), ("average", "d"), ("barCount", "q"))
+    COMPACT_SEGMENTS = 16
+
+    def __init__(self, storeDir: str, maxPending: int = 1024, flushInterval: float = 1.0):
+        self.storeDir = storeDir
+        self.maxPending = maxPending
+        self.flushInterval = flushInterval
+        # (barSize, tradingDate) -> {symbol: {bar date: BarData}}
+        self.days = {}
+        # (barSize, tradingDate) -> [(symbol, BarData)] not written yet
+        self.pending = {}
+        self.nPending = 0
+        self.lastFlush = time.monotonic()
+
+    def path(self, barSize: str, tradingDate: str) -> str:
+        return os.path.join(self.storeDir, barSize.replace(" ", ""), tradingDate + ".bars")
+
+    @staticmethod
+    def tradingDateOf(bar: BarData) -> str:
+        # "YYYYMMDD" for daily bars, "YYYYMMDD  HH:MM:SS" for intraday ones
+        return bar.date[:8]
+
+    def bars(self, symbol: str, barSize: str, tradingDate: str) -> list:
+        """ The stored bars of symbol on tradingDate, oldest first. """
+        day = self.day(barSize, tradingDate)
+        return sorted(day.get(symbol, {}).values(), key=lambda bar: bar.date)
+
+    def put(self, symbol: str, barSize: str, bar: BarData):
+        key = (barSize, self.tradingDateOf(bar))
+        self.day(*key).setdefault(symbol, {})[bar.date] = bar
+        self.pending.setdefault(key, []).append((symbol, bar))
+        self.nPending += 1
+        if self.nPending >= self.maxPending or time.monotonic() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        for ((barSize, tradingDate), entries) in self.pending.items():
+            fileName = self.path(barSize, tradingDate)
+            os.makedirs(os.path.dirname(fileName), exist_ok=True)
+            fd = os.open(fileName, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                data = self.packSegment(entries)
+                if os.fstat(fd).st_size == 0:
+                    data = self.MAGIC + data
+                # One write per segment, so concurrent writers of other
+                # symbols never interleave within a segment
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        self.pending = {}
+        self.nPending = 0
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        if self.nPending:
+            self.flush()
+
+    # File format
+
+    def day(self, barSize: str, tradingDate: str) -> dict:
+        key = (barSize, tradingDate)
+        day = self.days.get(key)
+        if day is None:
+            day = self.days[key] = self.readFile(self.path(barSize, tradingDate),
+                                                 compact=tradingDate < time.strftime("%Y%m%d"))
+        return day
+
+    @classmethod
+    def packSegment(cls, entries: list) -> bytes:
+        text = b"\0".join(b"%s\0%s" % (symbol.encode(), bar.date.encode()) for (symbol, bar) in entries)
+        parts = [cls.SEGMENT.pack(b"SEGM", len(entries), len(text)), text]
+        for (field, typeCode) in cls.NUMERIC_FIELDS:
+            column = array.array(typeCode, [getattr(bar, field) for (symbol, bar) in entries])
+            if sys.byteorder != "little":
+                column.byteswap()
+            parts.append(column.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def readFile(cls, fileName: str, compact: bool = False) -> dict:
+        day = {}
+        try:
+            with open(fileName, "rb") as barFile:
+                data = barFile.read()
+        except FileNotFoundError:
+            return day
+        if not data.startswith(cls.MAGIC):
+            logging.warning("Ignoring %s: not a historical bar file", fileName)
+            return day
+
+        (pos, nSegments, nSkipped) = (len(cls.MAGIC), 0, 0)
+        while pos < len(data):
+            (tag, nBars, textSize) = cls.SEGMENT.unpack_from(data, pos) \
+                if len(data) - pos >= cls.SEGMENT.size else (None, 0, 0)
+            end = pos + cls.SEGMENT.size + textSize + 8 * nBars * len(cls.NUMERIC_FIELDS)
+            text = data[pos + cls.SEGMENT.size:pos + cls.SEGMENT.size + textSize].split(b"\0")
+            if tag != b"SEGM" or end > len(data) or len(text) != 2 * nBars:
+                # What a crash left of a segment; appends after it are intact
+                resync = data.find(b"SEGM", pos + 1)
+                resync = len(data) if resync < 0 else resync
+                nSkipped += resync - pos
+                pos = resync
+                continue
+            pos += cls.SEGMENT.size + textSize
+            columns = []
+            for (field, typeCode) in cls.NUMERIC_FIELDS:
+                column = array.array(typeCode)
+                column.frombytes(data[pos:pos + 8 * nBars])
+                if sys.byteorder != "little":
+                    column.byteswap()
+                columns.append(column.tolist())
+                pos += 8 * nBars
+            for (i, values) in enumerate(zip(*columns)):
+                bar = BarData()
+                bar.date = text[2 * i + 1].decode()
+                (bar.open, bar.high, bar.low, bar.close, bar.volume, bar.average, bar.barCount) = values
+                day.setdefault(text[2 * i].decode(), {})[bar.date] = bar
+            nSegments += 1
+
+        if nSkipped:
+            logging.warning("Ignoring %d bytes of truncated segments in %s", nSkipped, fileName)
+        if compact and (nSegments > cls.COMPACT_SEGMENTS or nSkipped):
+            cls.writeFile(fileName, day)
+        return day
+
+    @classmethod
+    def writeFile(cls, fileName: str, day: dict):
+        entries = [(symbol, bar) for (symbol, bars) in day.items() for bar in bars.values()]
+        tmpName = "%s.%d.tmp" % (fileName, os.getpid())
+        with open(tmpName, "wb") as barFile:
+            barFile.write(cls.MAGIC + cls.packSegment(entries))
+        os.replace(tmpName, fileName)
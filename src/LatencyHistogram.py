@@ -0,0 +1,83 @@
+class LatencyHistogram:
+
+    """ Fixed-size histogram of latencies in nanoseconds, HDR style: values
+    below 2**subBucketBits are counted exactly, larger ones in buckets whose
+    width doubles with each power of two, so every recorded value is off by
+    less than 2**(1 - subBucketBits) of itself (1.6% for the default of 7).
+
+    The counts are allocated once, so record() never allocates; values
+    beyond maxValue are counted in the last bucket. """
+
+    def __init__(self, subBucketBits: int = 7, maxValue: int = 1 << 40):
+        self.subBucketBits = subBucketBits
+        self.subBucketCount = 1 << subBucketBits
+        self.maxValue = maxValue
+        self.counts = [0] * (self.indexOf(maxValue) + 1)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def indexOf(self, value: int) -> int:
+        if value < self.subBucketCount:
+            return value
+        shift = value.bit_length() - self.subBucketBits
+        return (shift << (self.subBucketBits - 1)) + (value >> shift)
+
+    def highestValueAt(self, index: int) -> int:
+        if index < self.subBucketCount:
+            return index
+        shift = (index >> (self.subBucketBits - 1)) - 1
+        return ((index - (shift << (self.subBucketBits - 1)) + 1) << shift) - 1
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        elif value > self.maxValue:
+            value = self.maxValue
+        self.counts[self.indexOf(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other):
+        """ Adds the counts of other, which must have the same layout. """
+        for (i, n) in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+
+    def percentile(self, pct: float) -> int:
+        """ The value pct percent of the recorded values are at or below, to
+        the precision of its bucket; 0 when nothing was recorded. """
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * pct // 100))
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.highestValueAt(i), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.
+
+    def summary(self, scale: float = 1e-3, unit: str = "us") -> str:
+        if self.count == 0:
+            return "n=0"
+        return ("n=%d p50=%.1f%s p99=%.1f%s p99.9=%.1f%s max=%.1f%s mean=%.1f%s" %
+                (self.count, self.percentile(50) * scale, unit, self.percentile(99) * scale, unit,
+                 self.percentile(99.9) * scale, unit, self.max * scale, unit, self.mean() * scale, unit))
@@ -0,0 +1,85 @@
+import time
+
+from LatencyHistogram import LatencyHistogram
+
+
+class LatencyTracer:
+
+    """ Where the time goes between a bar arriving from TWS and the order it
+    triggers, as one LatencyHistogram per stage:
+
+        read         socket read returned -> message queued by the reader
+        queue        queued -> taken off the queue by the message loop
+        decode       taken off the queue -> realtimeBar/tickByTick called
+        evaluate     realtimeBar called -> returned, for every bar
+        strategy     bar or tick received by the app -> placeOrder called
+        order        placeOrder called -> returned (serialized and sent)
+        tickToTrade  socket read of the bar or tick -> placeOrder returned
+
+    and a tickToTrade histogram per symbol. Timestamps come from
+    time.perf_counter_ns(), a monotonic clock. The message source sets
+    current to (readAt, queuedAt, dequeuedAt) of the message being
+    dispatched; everything else is recorded on the message thread. """
+
+    STAGES = ("read", "queue", "decode", "evaluate", "strategy", "order", "tickToTrade")
+    NO_MESSAGE = (0, 0, 0)
+
+    def __init__(self, subBucketBits: int = 7, symbolSubBucketBits: int = 5):
+        self.stages = {stage: LatencyHistogram(subBucketBits) for stage in self.STAGES}
+        (self.read, self.queue, self.decode, self.evaluate, self.strategy, self.order,
+         self.tickToTrade) = (self.stages[stage] for stage in self.STAGES)
+        self.symbolSubBucketBits = symbolSubBucketBits
+        # symbol -> tickToTrade histogram, allocated on the first order of
+        # the symbol once its latency has been taken
+        self.bySymbol = {}
+        self.current = self.NO_MESSAGE
+        # reqId -> (readAt, receivedAt) of its latest bar or tick
+        self.lastPrice = {}
+        # Set by SIGUSR1, served by the message loop
+        self.dumpDue = False
+
+    def messageDone(self):
+        (readAt, queuedAt, dequeuedAt) = self.current
+        if dequeuedAt:
+            if readAt:
+                self.read.record(queuedAt - readAt)
+            self.queue.record(dequeuedAt - queuedAt)
+            self.current = self.NO_MESSAGE
+
+    def priceReceived(self, reqId: int) -> int:
+        """ Called as a bar or tick reaches the app; returns the time. """
+        now = time.perf_counter_ns()
+        (readAt, queuedAt, dequeuedAt) = self.current
+        if dequeuedAt:
+            self.decode.record(now - dequeuedAt)
+        self.lastPrice[reqId] = (readAt or queuedAt or now, now)
+        return now
+
+    def priceEvaluated(self, receivedAt: int):
+        self.evaluate.record(time.perf_counter_ns() - receivedAt)
+
+    def orderPlacing(self, reqId: int) -> int:
+        now = time.perf_counter_ns()
+        lastPrice = self.lastPrice.get(reqId)
+        if lastPrice is not None:
+            self.strategy.record(now - lastPrice[1])
+        return now
+
+    def orderPlaced(self, reqId: int, symbol: str, placingAt: int):
+        now = time.perf_counter_ns()
+        self.order.record(now - placingAt)
+        lastPrice = self.lastPrice.get(reqId)
+        if lastPrice is None:
+            return
+        self.tickToTrade.record(now - lastPrice[0])
+        histogram = self.bySymbol.get(symbol)
+        if histogram is None:
+            histogram = self.bySymbol[symbol] = LatencyHistogram(self.symbolSubBucketBits)
+        histogram.record(now - lastPrice[0])
+
+    def report(self) -> list:
+        """ One line per stage, then per symbol with orders. """
+        lines = ["%-12s %s" % (stage, histogram.summary()) for (stage, histogram) in self.stages.items()]
+        for symbol in sorted(self.bySymbol):
+            lines.append("%-12s %s" % (symbol, self.bySymbol[symbol].summary()))
+        return lines
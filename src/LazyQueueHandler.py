@@ -0,0 +1,16 @@
+import logging.handlers
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+
+    """ A QueueHandler that hands records to the listener thread untouched.
+
+    The stock QueueHandler.prepare() formats the message on the calling
+    thread so the record can be pickled. Our queue never leaves the process,
+    so formatting is left to the QueueListener's handlers and the thread that
+    logs only pays for creating the record and a queue put. Log arguments
+    are therefore rendered when the listener gets to them; pass values, not
+    objects that are mutated afterwards. """
+
+    def prepare(self, record):
+        return record
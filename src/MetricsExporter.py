@@ -0,0 +1,190 @@
+import collections
+import http.server
+import logging
+import threading
+import time
+
+
+class MetricsExporter(threading.Thread):
+
+    """ Serves live counters of the TestApps trading over one connection in
+    the Prometheus text format at http://host:port/metrics.
+
+    Every interval seconds this thread samples the apps and renders the
+    page; scrapes get the latest rendering. Rates are worked out between
+    two samples. The message thread keeps counting as it does anyway, in
+    plain ints and dicts. Sampling only reads them: the dicts are copied
+    with dict(), which runs under the GIL without calling back into Python
+    code, and the queue depth is the length of its deque. No lock is taken
+    that the message thread could wait on. """
+
+    PREFIX = "pyibapi_"
+
+    def __init__(self, apps: list, port: int, host: str = "127.0.0.1", interval: float = 5.0):
+        threading.Thread.__init__(self, name="MetricsExporter", daemon=True)
+        self.apps = apps
+        self.interval = interval
+        self.stopping = threading.Event()
+        # (plan, reqId) -> bars counted at the previous sample
+        self.prevBars = {}
+        self.prevAt = None
+        self.page = b""
+        # Bars are only counted for the exporter
+        for app in apps:
+            if app.reqId2nBar is None:
+                app.reqId2nBar = collections.defaultdict(int)
+
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                page = exporter.page
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.HTTPServer((host, port), Handler)
+        self.server.timeout = 0.2
+
+    def run(self):
+        nextSampleAt = 0.
+        try:
+            while not self.stopping.is_set():
+                if time.monotonic() >= nextSampleAt:
+                    nextSampleAt = time.monotonic() + self.interval
+                    try:
+                        self.page = self.render(self.sample()).encode()
+                    except Exception:
+                        logging.exception("Failed to sample the metrics")
+                self.server.handle_request()
+        finally:
+            self.server.server_close()
+
+    def stop(self):
+        self.stopping.set()
+
+    def address(self) -> str:
+        (host, port) = self.server.server_address[:2]
+        return "http://%s:%d/metrics" % (host, port)
+
+    # Sampling, on this thread
+
+    def sample(self) -> list:
+        """ (name, type, help, [(labels, value), ...]) of every metric. """
+        now = time.monotonic()
+        elapsed = None if self.prevAt is None else now - self.prevAt
+        owner = self.apps[0]
+        metrics = [
+            ("connected", "gauge", "1 while connected to TWS",
+             [({}, 1 if owner.isConnected() else 0)]),
+            # The followers of a shared connection share its queue and pacer
+            ("message_queue_depth", "gauge", "messages read from TWS, not yet handled",
+             [({}, len(getattr(owner.msg_queue, "queue", ())))]),
+            ("pacer_pending", "gauge", "requests waiting for the request pacer",
+             [({}, owner.pacer.pending)]),
+        ]
+
+        (requests, answers, errors, bars, barRates, orders, placed, working, positions,
+         attempts, refused) = ([] for _ in range(11))
+        barsNow = {}
+        riskGates = []
+        for app in self.apps:
+            tradingPlan = getattr(app, "tradingPlan", None)
+            if tradingPlan is None:
+                continue
+            plan = {"plan": tradingPlan.name}
+            # Swapped, never changed, by plan reloads
+            items = tradingPlan.plan
+            orders.append((plan, app.nOrdersPlaced))
+
+            # Requests are counted per reqId with --count-calls only, with a
+            # negative reqId for the cancels
+            for (counts, samples) in ((app.reqId2nReq, requests), (app.reqId2nAns, answers),
+                                      (app.reqId2nErr, errors)):
+                for (reqId, count) in sorted(dict(counts).items()):
+                    samples.append((dict(plan, req_id=reqId), count))
+
+            for (reqId, count) in dict(app.reqId2nBar).items():
+                item = items.get(reqId)
+                if item is None:
+                    continue
+                labels = dict(plan, symbol=item.symbol)
+                bars.append((labels, count))
+                prev = self.prevBars.get((plan["plan"], reqId))
+                if elapsed and prev is not None:
+                    barRates.append((labels, (count - prev) / elapsed))
+                barsNow[(plan["plan"], reqId)] = count
+
+            symbol2nOrder = dict(app.symbol2nOrder)
+            workingBySymbol = dict(app.orders.workingBySymbol)
+            for item in list(items.values()):
+                labels = dict(plan, symbol=item.symbol)
+                placed.append((labels, symbol2nOrder.get(item.symbol, 0)))
+                working.append((labels, len(workingBySymbol.get(item.symbol, ()))))
+                positions.append((labels, item.latestPos))
+                attempts.append((dict(labels, action="BUY"), item.buyAttempted))
+                attempts.append((dict(labels, action="SELL"), item.sellAttempted))
+
+            # Plans of the same account share their gate
+            if app.riskGate is not None and all(app.riskGate is not gate for gate in riskGates):
+                riskGates.append(app.riskGate)
+                for (check, count) in dict(app.riskGate.nRefused).items():
+                    refused.append(({"account": app.account, "check": check}, count))
+
+        self.prevBars = barsNow
+        self.prevAt = now
+
+        metrics += [
+            ("orders_placed_total", "counter", "orders placed", orders),
+            ("requests_total", "counter", "requests sent per reqId", requests),
+            ("answers_total", "counter", "answers received per reqId", answers),
+            ("errors_total", "counter", "errors received per reqId", errors),
+            ("bars_total", "counter", "realtime bars received per symbol", bars),
+            ("bars_per_second", "gauge", "realtime bars per second since the previous sample", barRates),
+            ("symbol_orders_placed_total", "counter", "orders placed per symbol", placed),
+            ("symbol_orders_working", "gauge", "orders working per symbol", working),
+            ("symbol_position", "gauge", "position per symbol", positions),
+            ("symbol_attempts_total", "counter", "buy and sell attempts per symbol", attempts),
+            ("risk_refused_total", "counter", "orders refused by the risk gate per check", refused),
+        ]
+
+        reconnector = owner.reconnector
+        if reconnector is not None:
+            metrics.append(("reconnects_total", "counter", "connections to TWS lost and made again",
+                            [({}, reconnector.nDrops)]))
+            metrics.append(("resume_seconds", "gauge", "seconds from the latest drop to each stage of resuming",
+                            [({"stage": stage}, seconds) for (stage, seconds) in dict(reconnector.last).items()]))
+
+        # Method call counts are per class, the same for all the apps
+        if owner.countCalls or owner.countWrapCalls:
+            metrics.append(("client_calls_total", "counter", "EClient method calls",
+                            [({"method": name}, count) for (name, count) in owner.clntMeth2callCount.items()]))
+            metrics.append(("wrapper_calls_total", "counter", "EWrapper method calls",
+                            [({"method": name}, count) for (name, count) in owner.wrapMeth2callCount.items()]))
+        return metrics
+
+    def render(self, metrics: list) -> str:
+        lines = []
+        for (name, type_, help_, samples) in metrics:
+            name = self.PREFIX + name
+            lines.append("# HELP %s %s" % (name, help_))
+            lines.append("# TYPE %s %s" % (name, type_))
+            for (labels, value) in samples:
+                if labels:
+                    lines.append("%s{%s} %s" % (name, ",".join('%s="%s"' % (key, self.escape(labelValue))
+                                                               for (key, labelValue) in labels.items()), value))
+                else:
+                    lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
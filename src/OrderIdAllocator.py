@@ -0,0 +1,28 @@
+import multiprocessing
+
+
+class OrderIdAllocator:
+
+    """ Hands out disjoint blocks of order IDs to the processes sharing one
+    TWS account, so that orders of different workers never collide.
+
+    The counter lives in shared memory; create the allocator before starting
+    the worker processes and pass it to them. """
+
+    def __init__(self, blockSize: int = 1000):
+        self.blockSize = blockSize
+        self.nextId = multiprocessing.Value("q", 0)
+
+    def advanceTo(self, orderId: int):
+        """ Makes sure no block starts below orderId, the nextValidId TWS
+        reported to one of the workers. """
+        with self.nextId.get_lock():
+            if self.nextId.value < orderId:
+                self.nextId.value = orderId
+
+    def allocate(self) -> tuple:
+        """ Returns (firstId, endId) of a block nobody else gets. """
+        with self.nextId.get_lock():
+            firstId = self.nextId.value
+            self.nextId.value = firstId + self.blockSize
+        return (firstId, firstId + self.blockSize)
@@ -0,0 +1,43 @@
+import time
+
+
+class OrderRecord:
+
+    """ What we know about one order, fed by OrderStateManager. """
+
+    # Statuses after which an order can no longer fill
+    DONE = frozenset(("Filled", "Cancelled", "ApiCancelled", "Inactive"))
+
+    def __init__(self, orderId: int, symbol: str, action: str, totalQuantity: float):
+        self.orderId = orderId
+        self.permId = 0
+        self.symbol = symbol
+        self.action = action
+        self.totalQuantity = totalQuantity
+        self.status = "PendingSubmit"
+        self.filled = 0.
+        self.remaining = totalQuantity
+        self.avgFillPrice = 0.
+        self.lastFillPrice = 0.
+        # Quantity reported by execDetails, as opposed to the orderStatus totals
+        self.executed = 0.
+        self.createdAt = time.time()
+        # (time, status) for every change of status
+        self.transitions = [(self.createdAt, self.status)]
+
+    def isWorking(self) -> bool:
+        return self.status not in self.DONE
+
+    def setStatus(self, status: str) -> bool:
+        """ Returns True if the status changed. """
+        if status == self.status:
+            return False
+        self.status = status
+        self.transitions.append((time.time(), status))
+        return True
+
+    def __str__(self):
+        return ("orderId=%d; permId=%d; symbol=%s; action=%s; totalQuantity=%s; status=%s; "
+                "filled=%s; remaining=%s; avgFillPrice=%s." %
+                (self.orderId, self.permId, self.symbol, self.action, self.totalQuantity,
+                 self.status, self.filled, self.remaining, self.avgFillPrice))
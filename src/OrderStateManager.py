@@ -0,0 +1,155 @@
+import logging
+
+from ibapi.contract import Contract
+from ibapi.execution import Execution
+from ibapi.order import Order
+from ibapi.order_state import OrderState
+
+from OrderRecord import OrderRecord
+
+
+class OrderStateManager:
+
+    """ In-memory state of our orders, indexed by orderId, permId and symbol.
+
+    placed() registers an order before it is sent, so the strategy knows
+    right away that the symbol has an order working. orderStatus, openOrder
+    and execDetails keep the records current; execution() returns the signed
+    quantity of every new fill so the caller can move the position without
+    waiting for the position callback.
+
+    TWS sends the execution and the position callback of a fill in either
+    order. Fills are matched against the position changes reported by
+    positionReported(), so a fill is counted once whichever comes first:
+    the position of a symbol is the reported one plus the fills it does not
+    include yet. All methods run on the message thread. """
+
+    def __init__(self):
+        self.byOrderId = {}
+        self.byPermId = {}
+        # symbol -> {orderId: OrderRecord} of the orders still working
+        self.workingBySymbol = {}
+        self.execIds = set()
+        # symbol -> last position reported by the position callback
+        self.reportedPos = {}
+        # symbol -> signed fills the reported position does not include yet
+        self.fillsAhead = {}
+        # symbol -> signed position change reported before its fills
+        self.positionAhead = {}
+
+    def hasWorkingOrder(self, symbol: str) -> bool:
+        return symbol in self.workingBySymbol
+
+    def workingOrders(self, symbol: str) -> list:
+        return list(self.workingBySymbol.get(symbol, {}).values())
+
+    def placed(self, orderId: int, symbol: str, action: str, totalQuantity: float) -> OrderRecord:
+        record = OrderRecord(orderId, symbol, action, totalQuantity)
+        self.byOrderId[orderId] = record
+        self.workingBySymbol.setdefault(symbol, {})[orderId] = record
+        return record
+
+    def setStatus(self, record: OrderRecord, status: str) -> bool:
+        """ Returns True if the order stopped working with this status. """
+        if not record.setStatus(status) or record.isWorking():
+            return False
+        working = self.workingBySymbol.get(record.symbol)
+        if working is not None:
+            working.pop(record.orderId, None)
+            if not working:
+                del self.workingBySymbol[record.symbol]
+        return True
+
+    def rejected(self, orderId: int):
+        """ TWS refused or dropped the order with an error: it is Inactive.
+        Returns (record, finished) as orderStatus() does. """
+        record = self.byOrderId.get(orderId)
+        if record is None:
+            return (None, False)
+        return (record, self.setStatus(record, "Inactive"))
+
+    def orderStatus(self, orderId: int, status: str, filled: float, remaining: float,
+                    avgFillPrice: float, permId: int, lastFillPrice: float):
+        """ Returns (record, finished): record is None for orders we did not
+        place or see in openOrder, finished tells if the order just stopped
+        working. """
+        record = self.byOrderId.get(orderId)
+        if record is None:
+            return (None, False)
+        if permId and not record.permId:
+            record.permId = permId
+            self.byPermId[permId] = record
+        record.filled = filled
+        record.remaining = remaining
+        record.avgFillPrice = avgFillPrice
+        record.lastFillPrice = lastFillPrice
+        return (record, self.setStatus(record, status))
+
+    def openOrder(self, orderId: int, contract: Contract, order: Order, orderState: OrderState):
+        """ Picks up orders placed before we (re)connected or by another client. """
+        record = self.byOrderId.get(orderId)
+        if record is None:
+            record = self.placed(orderId, contract.symbol, order.action, order.totalQuantity)
+        if order.permId and not record.permId:
+            record.permId = order.permId
+            self.byPermId[order.permId] = record
+        return (record, self.setStatus(record, orderState.status))
+
+    def execution(self, contract: Contract, execution: Execution) -> float:
+        """ Returns the signed quantity of a new fill the reported position
+        does not include yet, 0 for a repeated one. """
+        if execution.execId in self.execIds:
+            return 0.
+        self.execIds.add(execution.execId)
+
+        quantity = execution.shares if execution.side == "BOT" else -execution.shares
+        record = self.byOrderId.get(execution.orderId)
+        if record is None and execution.permId:
+            record = self.byPermId.get(execution.permId)
+        if record is not None:
+            record.executed += execution.shares
+        else:
+            logging.info("Execution %s of %s for an order we do not track: %s",
+                         execution.execId, contract.symbol, execution.orderId)
+
+        # Already reported by the position callback
+        quantity -= self.match(self.positionAhead, contract.symbol, quantity)
+        if quantity:
+            self.fillsAhead[contract.symbol] = self.fillsAhead.get(contract.symbol, 0.) + quantity
+        return quantity
+
+    def positionsEnd(self, symbols):
+        """ TWS has reported all positions: those of symbols it left out are
+        0, which their later fills and positions are matched against. """
+        for symbol in symbols:
+            self.reportedPos.setdefault(symbol, 0.)
+
+    def positionReported(self, symbol: str, position: float) -> float:
+        """ Returns the signed fills position does not include yet. The
+        first position of a symbol is taken as it is: it includes the fills
+        seen before it. """
+        if symbol not in self.reportedPos:
+            self.reportedPos[symbol] = position
+            self.fillsAhead.pop(symbol, None)
+            self.positionAhead.pop(symbol, None)
+            return 0.
+        change = position - self.reportedPos[symbol]
+        self.reportedPos[symbol] = position
+        change -= self.match(self.fillsAhead, symbol, change)
+        if change:
+            self.positionAhead[symbol] = self.positionAhead.get(symbol, 0.) + change
+        return self.fillsAhead.get(symbol, 0.)
+
+    @staticmethod
+    def match(ahead: dict, symbol: str, quantity: float) -> float:
+        """ Takes the part of quantity that ahead[symbol] holds in the same
+        direction off it and returns that part. """
+        held = ahead.get(symbol, 0.)
+        if not held or not quantity or (held > 0) != (quantity > 0):
+            return 0.
+        matched = quantity if abs(quantity) <= abs(held) else held
+        if held == matched:
+            del ahead[symbol]
+        else:
+            ahead[symbol] = held - matched
+        return matched
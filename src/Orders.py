@@ -10,6 +10,9 @@ from ibapi.order import (OrderComboLeg, Order)
 
 class Orders:
 
+    # action -> MKT order template, see CacheMarketOrders()
+    marketOrderTemplates = {}
+
     """ <summary>
     #/ A Market order is an order to buy or sell at the market bid or offer price. A market order may increase the likelihood of a fill 
     #/ and the speed of execution, but unlike the Limit order a Market order provides no price protection and may fill at a price far 
@@ -63,3 +66,29 @@ class Orders:
         order.auxPrice = marketOffset  # Offset price
         # ! [pegged_market]
         return order
+
+    """ <summary>
+    #/ Builds the BUY and SELL market order templates once. A market order carries
+    #/ nothing symbol specific, so one template per action is shared by all
+    #/ symbols instead of keeping ~130 identical attributes per symbol.
+    </summary>"""
+    @staticmethod
+    def CacheMarketOrders():
+        Orders.marketOrderTemplates = {action: Orders.MarketOrder(action, 0)
+                                       for action in ("BUY", "SELL")}
+
+    """ <summary>
+    #/ Same order as MarketOrder(), cloned from the cached template: a shallow
+    #/ copy of its attributes instead of running Order.__init__. The clone shares
+    #/ the template's sub-objects (softDollarTier, conditions, ...), which
+    #/ placeOrder only reads; do not modify them on the clone.
+    </summary>"""
+    @staticmethod
+    def MarketOrderFromTemplate(action: str, quantity: float):
+        template = Orders.marketOrderTemplates.get(action)
+        if template is None:
+            return Orders.MarketOrder(action, quantity)
+        order = Order.__new__(Order)
+        order.__dict__.update(template.__dict__)
+        order.totalQuantity = quantity
+        return order
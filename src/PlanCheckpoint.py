@@ -0,0 +1,187 @@
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+
+
+class PlanCheckpoint:
+
+    """ Runtime state of the trading plan items in a memory-mapped file, so a
+    restarted process can pick up where the previous one stopped.
+
+    The file holds two areas, each an area header followed by one fixed-size
+    record per plan item. save() writes the area not holding the latest
+    checkpoint, records first and header last, and the header's CRC covers
+    the records. A crash in the middle of a save leaves the other area intact
+    and load() returns the newest area whose CRC matches. The pages are
+    written back by the kernel, so a checkpoint survives the process dying
+    at any point; close() also syncs them to disk.
+
+    Records are keyed by symbol and stamped with the trading date: a
+    checkpoint from another day is not restored. Items whose symbol does not
+    fit the record are left out, as a cut symbol could match another one. """
+
+    MAGIC = b"TWSCKPT1"
+    # magic, capacity in records
+    FILE_HEADER = struct.Struct("<8sI")
+    # sequence, CRC32 of the records, number of records, saved at, trading date
+    AREA_HEADER = struct.Struct("<QIId8s")
+    # symbol, flags, priceFiveSecsAgo, buyAttempted, sellAttempted, latestPos,
+    # lastPos, lastOrderId, todayOpenPrice
+    RECORD = struct.Struct("<16sBdiiddqd")
+    SYMBOL_SIZE = 16
+
+    POSITION_INITIALIZED = 1
+
+    def __init__(self, fileName: str, capacity: int = 256):
+        self.fileName = fileName
+        self.file = None
+        self.mm = None
+        self.sequence = 0
+        self.nSaved = 0
+        # Symbols too long for a record, logged once
+        self.tooLong = set()
+        if os.path.exists(fileName) and os.path.getsize(fileName) >= self.FILE_HEADER.size:
+            self.open()
+        if self.mm is None:
+            self.create(capacity)
+        else:
+            self.sequence = max(self.readAreaHeader(area)[0] for area in (0, 1))
+            if self.sequence and self.intactRecords(self.sequence % 2) is None:
+                # The next save goes over the torn checkpoint, not over the
+                # intact one before it
+                self.sequence += 1
+
+    def open(self):
+        self.file = open(self.fileName, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        (magic, self.capacity) = self.FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC or len(self.mm) != self.fileSize(self.capacity):
+            logging.warning("Ignoring %s: not a plan checkpoint", self.fileName)
+            self.close(sync=False)
+
+    def create(self, capacity: int, records: bytes = b"", header: tuple = None):
+        """ (Re)creates the file for capacity records, with records and header
+        as its checkpoint if given. The file is replaced atomically. """
+        self.close(sync=False)
+        os.makedirs(os.path.dirname(self.fileName) or ".", exist_ok=True)
+        tmpName = "%s.%d.tmp" % (self.fileName, os.getpid())
+        with open(tmpName, "wb") as tmpFile:
+            tmpFile.truncate(self.fileSize(capacity))
+            tmpFile.write(self.FILE_HEADER.pack(self.MAGIC, capacity))
+            if header is not None:
+                tmpFile.seek(self.areaOffset(header[0] % 2, capacity))
+                tmpFile.write(self.AREA_HEADER.pack(*header) + records)
+        os.replace(tmpName, self.fileName)
+        self.capacity = capacity
+        self.open()
+
+    def areaSize(self, capacity: int) -> int:
+        return self.AREA_HEADER.size + capacity * self.RECORD.size
+
+    def areaOffset(self, area: int, capacity: int) -> int:
+        return self.FILE_HEADER.size + area * self.areaSize(capacity)
+
+    def fileSize(self, capacity: int) -> int:
+        return self.areaOffset(2, capacity)
+
+    def readAreaHeader(self, area: int) -> tuple:
+        return self.AREA_HEADER.unpack_from(self.mm, self.areaOffset(area, self.capacity))
+
+    def intactRecords(self, area: int):
+        """ The records of area, None if its CRC does not match. """
+        (sequence, crc, nItems, savedAt, date) = self.readAreaHeader(area)
+        if nItems > self.capacity:
+            return None
+        recordsAt = self.areaOffset(area, self.capacity) + self.AREA_HEADER.size
+        records = self.mm[recordsAt:recordsAt + nItems * self.RECORD.size]
+        return records if zlib.crc32(records) == crc else None
+
+    # Items <-> records
+
+    @classmethod
+    def packItem(cls, item) -> bytes:
+        flags = cls.POSITION_INITIALIZED if item.positionInitialized else 0
+        return cls.RECORD.pack(
+            item.symbol.encode(), flags,
+            math.nan if item.priceFiveSecsAgo is None else item.priceFiveSecsAgo,
+            item.buyAttempted, item.sellAttempted, item.latestPos, item.lastPos,
+            -1 if item.lastOrderId is None else item.lastOrderId,
+            math.nan if item.todayOpenPrice is None else item.todayOpenPrice)
+
+    @classmethod
+    def restoreItem(cls, item, state: tuple, restorePrice: bool):
+        """ Puts the state returned by load() back into item. Targets that
+        were reset are reset again from the attempts against the limits of
+        the plan, which may have been edited in the meantime. """
+        (flags, priceFiveSecsAgo, item.buyAttempted, item.sellAttempted, latestPos, lastPos,
+         lastOrderId, todayOpenPrice) = state
+        if flags & cls.POSITION_INITIALIZED:
+            item.positionInitialized = True
+            (item.latestPos, item.lastPos) = (latestPos, lastPos)
+        if item.buyAttempted >= item.buyAttemptLimit and item.targetLongPos > 0:
+            item.targetLongPos = 0
+        if item.sellAttempted >= item.sellAttemptLimit and item.targetShortPos < 0:
+            item.targetShortPos = 0
+        if restorePrice and not math.isnan(priceFiveSecsAgo):
+            item.priceFiveSecsAgo = priceFiveSecsAgo
+        item.lastOrderId = None if lastOrderId < 0 else lastOrderId
+        item.todayOpenPrice = None if math.isnan(todayOpenPrice) else todayOpenPrice
+
+    # Checkpointing
+
+    def save(self, items):
+        items = [item for item in items if self.fits(item.symbol)]
+        records = b"".join(map(self.packItem, items))
+        self.sequence += 1
+        header = (self.sequence, zlib.crc32(records), len(items), time.time(),
+                  time.strftime("%Y%m%d").encode())
+        if len(items) > self.capacity:
+            self.create(max(len(items), 2 * self.capacity), records, header)
+        else:
+            offset = self.areaOffset(self.sequence % 2, self.capacity)
+            recordsAt = offset + self.AREA_HEADER.size
+            self.mm[recordsAt:recordsAt + len(records)] = records
+            self.AREA_HEADER.pack_into(self.mm, offset, *header)
+        self.nSaved += 1
+
+    def fits(self, symbol: str) -> bool:
+        if len(symbol.encode()) <= self.SYMBOL_SIZE:
+            return True
+        if symbol not in self.tooLong:
+            self.tooLong.add(symbol)
+            logging.error("Not checkpointing %s: symbols are limited to %d bytes", symbol, self.SYMBOL_SIZE)
+        return False
+
+    def load(self, tradingDate: str = None):
+        """ Returns (savedAt, {symbol: state}) of the newest intact checkpoint
+        of tradingDate (today by default), or None. """
+        tradingDate = (tradingDate or time.strftime("%Y%m%d")).encode()
+        for area in sorted((0, 1), key=lambda area: -self.readAreaHeader(area)[0]):
+            (sequence, crc, nItems, savedAt, date) = self.readAreaHeader(area)
+            if sequence == 0:
+                continue
+            records = self.intactRecords(area)
+            if records is None:
+                logging.warning("Checkpoint %d in %s is torn, trying the previous one", sequence, self.fileName)
+                continue
+            if date != tradingDate:
+                return None
+            states = {}
+            for record in self.RECORD.iter_unpack(records):
+                states[record[0].rstrip(b"\0").decode()] = record[1:]
+            return (savedAt, states)
+        return None
+
+    def close(self, sync: bool = True):
+        if self.mm is not None:
+            if sync:
+                self.mm.flush()
+            self.mm.close()
+            self.mm = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,149 @@
+from ibapi.common import *
+from ibapi.contract import Contract
+from ibapi.execution import Execution
+from ibapi.order import Order
+from ibapi.order_state import OrderState
+
+from OrderIdAllocator import OrderIdAllocator
+from RequestPacer import RequestPacer
+from SubscriptionRegistry import SubscriptionRegistry
+
+
+class PlanRouter:
+
+    """ The EWrapper of a TWS connection shared by several TestApps, one per
+    trading plan: owner makes the connection, the followers trade over it.
+
+    Market data goes through a SubscriptionRegistry, so a symbol is
+    subscribed once however many plans hold it, and every bar or tick is
+    handed to the realtimeBar/tickByTick* of each subscribing app under the
+    reqId of its own item. Order events go to the app that placed the
+    order, positions to the apps of the account holding the symbol and
+    historical data to the app owning the reqId; the rest goes to owner.
+
+    Everything runs on the message thread of owner, which also runs the
+    message loop hooks of the followers, so no app needs a lock. """
+
+    # Plan items of the nth app get reqIds from owner.firstReqId + n * REQ_ID_BLOCK
+    REQ_ID_BLOCK = 100000
+
+    def __init__(self, owner, followers: list):
+        self.owner = owner
+        self.followers = followers
+        self.apps = [owner] + followers
+        self.subscriptions = SubscriptionRegistry(owner.firstReqId + len(self.apps) * self.REQ_ID_BLOCK)
+        if owner.orderIdAllocator is None:
+            owner.orderIdAllocator = OrderIdAllocator()
+
+        for (index, app) in enumerate(self.apps):
+            app.subscriptions = self.subscriptions
+            app.firstReqId = owner.firstReqId + index * self.REQ_ID_BLOCK
+            app.orderIdAllocator = owner.orderIdAllocator
+        for app in followers:
+            app.owner = owner
+        owner.followers = followers
+        # Set before connect(), the decoder is created with it
+        owner.wrapper = self
+
+    def __getattr__(self, name):
+        return getattr(self.owner, name)
+
+    def shareConnection(self):
+        """ Lets the followers use the connection once owner has made it. """
+        for app in self.followers:
+            app.shareConnectionOf(self.owner)
+
+    def appOf(self, reqId: TickerId):
+        for app in reversed(self.apps):
+            if reqId >= app.firstReqId:
+                return app
+        return self.owner
+
+    def appOfOrder(self, orderId: OrderId, account: str = None):
+        for app in self.apps:
+            if orderId in app.orders.byOrderId:
+                return app
+        # Placed before we connected, or by another client
+        for app in self.apps:
+            if app.account and app.account == account:
+                return app
+        return self.owner
+
+    # Market data, fanned out to the subscribers
+
+    def realtimeBar(self, reqId: TickerId, time_: int, open_: float, high: float, low: float,
+                    close: float, volume: int, wap: float, count: int):
+        for (app, itemReqId) in self.subscriptions.subscribers.get(reqId, ()):
+            app.realtimeBar(itemReqId, time_, open_, high, low, close, volume, wap, count)
+
+    def tickByTickAllLast(self, reqId: int, tickType: int, time_: int, price: float, size: int,
+                          tickAttribLast: TickAttribLast, exchange: str, specialConditions: str):
+        for (app, itemReqId) in self.subscriptions.subscribers.get(reqId, ()):
+            app.tickByTickAllLast(itemReqId, tickType, time_, price, size, tickAttribLast, exchange,
+                                  specialConditions)
+
+    def tickByTickBidAsk(self, reqId: int, time_: int, bidPrice: float, askPrice: float,
+                         bidSize: int, askSize: int, tickAttribBidAsk: TickAttribBidAsk):
+        for (app, itemReqId) in self.subscriptions.subscribers.get(reqId, ()):
+            app.tickByTickBidAsk(itemReqId, time_, bidPrice, askPrice, bidSize, askSize, tickAttribBidAsk)
+
+    def error(self, reqId: TickerId, errorCode: int, errorString: str):
+        key = self.subscriptions.keyOf.get(reqId)
+        if key is None:
+            # Order errors come with the orderId as their reqId
+            if any(reqId in app.orders.byOrderId for app in self.apps):
+                self.appOfOrder(reqId).error(reqId, errorCode, errorString)
+            else:
+                self.appOf(reqId).error(reqId, errorCode, errorString)
+            return
+        # Upstream requests share the pacer of owner, which retries them
+        self.owner.error(reqId, errorCode, errorString)
+        if errorCode in self.owner.TICK_BY_TICK_REJECTED and key[0] != SubscriptionRegistry.BARS:
+            self.owner.pacer.done(RequestPacer.TICK_BY_TICK, reqId)
+            for (app, itemReqId) in self.subscriptions.drop(reqId):
+                app.tickByTickRejected(itemReqId, errorCode, errorString)
+
+    def historicalData(self, reqId: int, bar: BarData):
+        self.appOf(reqId).historicalData(reqId, bar)
+
+    def historicalDataEnd(self, reqId: int, start: str, end: str):
+        self.appOf(reqId).historicalDataEnd(reqId, start, end)
+
+    # Orders and positions
+
+    def nextValidId(self, orderId: int):
+        # Every app takes its own block of order IDs from here
+        for app in self.apps:
+            app.nextValidId(orderId)
+
+    def orderStatus(self, orderId: OrderId, status: str, filled: float,
+                    remaining: float, avgFillPrice: float, permId: int,
+                    parentId: int, lastFillPrice: float, clientId: int,
+                    whyHeld: str, mktCapPrice: float):
+        self.appOfOrder(orderId).orderStatus(orderId, status, filled, remaining, avgFillPrice, permId,
+                                             parentId, lastFillPrice, clientId, whyHeld, mktCapPrice)
+
+    def openOrder(self, orderId: OrderId, contract: Contract, order: Order, orderState: OrderState):
+        self.appOfOrder(orderId, order.account).openOrder(orderId, contract, order, orderState)
+
+    def openOrderEnd(self):
+        for app in self.apps:
+            app.openOrderEnd()
+
+    def execDetails(self, reqId: int, contract: Contract, execution: Execution):
+        self.appOfOrder(execution.orderId, execution.acctNumber).execDetails(reqId, contract, execution)
+
+    def execDetailsEnd(self, reqId: int):
+        self.appOf(reqId).execDetailsEnd(reqId)
+
+    def position(self, account: str, contract: Contract, position: float, avgCost: float):
+        # The apps trading the account, else those trading the default one
+        apps = ([app for app in self.apps if app.account == account] or
+                [app for app in self.apps if not app.account])
+        holders = [app for app in apps if contract.symbol in app.tradingPlan.planKeyedBySymbol]
+        for app in holders or [self.owner]:
+            app.position(account, contract, position, avgCost)
+
+    def positionEnd(self):
+        for app in self.apps:
+            app.positionEnd()
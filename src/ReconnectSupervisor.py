@@ -0,0 +1,112 @@
+import logging
+import time
+
+
+class ReconnectSupervisor:
+
+    """ Runs the message loop of a TestApp and, when the TWS connection
+    drops, connects again with exponential backoff from minDelay up to
+    maxDelay seconds, until the app is stopped on purpose (Ctrl-C, or done
+    set by whoever stops it).
+
+    Before reconnecting, app.prepareResume() forgets the requests of the old
+    connection while the plan, positions and orders stay as they are. The
+    nextValidId of the new connection starts the app again: it resumes order
+    IDs from there and queues all market data subscriptions and reqPositions
+    again with the RequestPacer, which sends them as fast as TWS allows.
+
+    Each resume is timed from the drop to
+        reconnected    the new connection is up
+        resumed        its nextValidId: orders can go out again
+        resubscribed   the pacer has sent all the subscriptions
+    and logged; report() sums them up. """
+
+    def __init__(self, app, host: str, port: int, clientId: int, minDelay: float = 0.5,
+                 maxDelay: float = 30., onConnected=None, clock=time.monotonic, sleep=time.sleep):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.clientId = clientId
+        self.minDelay = minDelay
+        self.maxDelay = maxDelay
+        # Called after every successful connect, e.g. PlanRouter.shareConnection
+        self.onConnected = onConnected
+        self.clock = clock
+        self.sleep = sleep
+        app.reconnector = self
+
+        self.nDrops = 0
+        self.nAttempts = 0
+        self.droppedAt = None
+        self.reconnectedAt = None
+        self.resumedAt = None
+        # The latest and the worst seconds from drop to each stage
+        self.last = {}
+        self.worst = {}
+
+    def stopping(self) -> bool:
+        return bool(self.app.nKeybInt or self.app.done)
+
+    def connect(self) -> bool:
+        """ Connects, retrying with backoff. Returns False if the app was
+        stopped first. """
+        delay = self.minDelay
+        while not self.stopping():
+            self.nAttempts += 1
+            self.app.connect(self.host, self.port, clientId=self.clientId)
+            if self.app.isConnected():
+                if self.onConnected is not None:
+                    self.onConnected()
+                return True
+            logging.warning("Could not connect to %s:%d, next attempt in %.1fs", self.host, self.port, delay)
+            self.sleep(delay)
+            delay = min(delay * 2, self.maxDelay)
+        return False
+
+    def run(self):
+        """ app.run(), again after every reconnect. """
+        while True:
+            if self.app.isConnected():
+                self.app.run()
+            if self.stopping():
+                return
+            self.nDrops += 1
+            self.droppedAt = self.clock()
+            self.reconnectedAt = self.resumedAt = None
+            logging.critical("Connection to TWS lost, reconnecting (drop %d)", self.nDrops)
+            self.app.prepareResume()
+            if not self.connect():
+                return
+            self.reconnectedAt = self.clock()
+            self.measured("reconnected", self.reconnectedAt)
+
+    # Called by the app on the message thread
+
+    def resumed(self):
+        if self.droppedAt is None or self.resumedAt is not None:
+            return
+        self.resumedAt = self.clock()
+        self.measured("resumed", self.resumedAt)
+
+    def resubscribed(self):
+        if self.resumedAt is None:
+            return
+        self.measured("resubscribed", self.clock())
+        logging.critical("Resumed after the drop: %s", self.report())
+        self.droppedAt = self.resumedAt = None
+
+    @property
+    def resubscribing(self) -> bool:
+        return self.resumedAt is not None
+
+    def measured(self, stage: str, at: float):
+        seconds = at - self.droppedAt
+        self.last[stage] = seconds
+        self.worst[stage] = max(self.worst.get(stage, 0.), seconds)
+
+    def report(self) -> str:
+        return ("%d drop(s), %d connect attempt(s); %s" %
+                (self.nDrops, self.nAttempts,
+                 ", ".join("%s in %.3fs (worst %.3fs)" % (stage, self.last[stage], self.worst[stage])
+                           for stage in ("reconnected", "resumed", "resubscribed") if stage in self.last)
+                 or "never resumed"))
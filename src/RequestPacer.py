@@ -0,0 +1,189 @@
+import heapq
+import itertools
+import logging
+import time
+
+from TokenBucket import TokenBucket
+
+
+class RequestPacer:
+
+    """ Client-side pacing of subscription requests to TWS.
+
+    Requests are queued with submit() and sent by pump(), which the message
+    thread calls between messages. A request goes out once the shared message
+    bucket (TWS accepts about 50 messages per second) and the bucket of its
+    request class both have a token and, for classes with a limit, fewer
+    requests than maxInFlight are outstanding. Lower priority values go first;
+    within a priority, requests keep their submission order.
+
+    Requests rejected with a pacing error are queued again at their original
+    place, after pausing their class for retryDelay seconds. TWS reports
+    every historical data failure as 162 and several realtime bar failures
+    as 420, so those count as pacing only when the message says so; any
+    other 162, e.g. a query that returned no data, fails at once. """
+
+    REALTIME_BARS = "realtimeBars"
+    HISTORICAL_DATA = "historicalData"
+    TICK_BY_TICK = "tickByTick"
+
+    # errorCode -> the request class it paces out; None for the message rate
+    PACING_ERRORS = {100: None, 162: HISTORICAL_DATA, 420: REALTIME_BARS}
+    # Codes that TWS also uses for failures other than pacing
+    PACING_TEXT_ERRORS = frozenset((162, 420))
+    PACING_TEXT = "pacing violation"
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        now = clock()
+        self.messages = TokenBucket(45., 10., now)
+        self.buckets = {
+            self.REALTIME_BARS: TokenBucket(45., 10., now),
+            self.HISTORICAL_DATA: TokenBucket(45., 10., now),
+            self.TICK_BY_TICK: TokenBucket(45., 10., now),
+        }
+        # TWS allows 50 simultaneous open historical data requests
+        self.maxInFlight = {self.REALTIME_BARS: None, self.HISTORICAL_DATA: 50, self.TICK_BY_TICK: None}
+        self.queues = {requestClass: [] for requestClass in self.buckets}
+        self.inFlight = {requestClass: {} for requestClass in self.buckets}
+        self.sequence = itertools.count()
+        self.pending = 0
+        self.retryDelay = 2.
+        self.maxRetries = 5
+        self.reportInterval = 10.
+        self.lastReportAt = now
+        self.nSent = 0
+        self.nRetried = 0
+        self.totalWait = 0.
+        self.maxWait = 0.
+
+    def setRate(self, requestClass, rate: float, burst: float):
+        """ requestClass None sets the shared message rate. """
+        bucket = TokenBucket(rate, burst, self.clock())
+        if requestClass is None:
+            self.messages = bucket
+        else:
+            self.buckets[requestClass] = bucket
+
+    def submit(self, requestClass: str, reqId: int, send, priority: int = 0):
+        """ Queues send(), a callable without arguments that makes the request. """
+        # [priority, sequence, reqId, send, submittedAt, nRetries]
+        heapq.heappush(self.queues[requestClass],
+                       [priority, next(self.sequence), reqId, send, self.clock(), 0])
+        self.pending += 1
+
+    def canSend(self, requestClass: str, now: float) -> bool:
+        maxInFlight = self.maxInFlight[requestClass]
+        if maxInFlight is not None and len(self.inFlight[requestClass]) >= maxInFlight:
+            return False
+        return self.buckets[requestClass].available(now)
+
+    def pump(self):
+        """ Sends whatever the limits allow right now. """
+        now = self.clock()
+        while self.pending and self.messages.available(now):
+            best = None
+            for (requestClass, queue) in self.queues.items():
+                if queue and (best is None or queue[0] < self.queues[best][0]) \
+                        and self.canSend(requestClass, now):
+                    best = requestClass
+            if best is None:
+                break
+
+            request = heapq.heappop(self.queues[best])
+            self.pending -= 1
+            self.messages.take(now)
+            self.buckets[best].take(now)
+            self.inFlight[best][request[2]] = request
+
+            wait = now - request[4]
+            self.nSent += 1
+            self.totalWait += wait
+            if wait > self.maxWait:
+                self.maxWait = wait
+            request[3]()
+
+        if self.pending == 0 or now - self.lastReportAt >= self.reportInterval:
+            if self.nSent:
+                logging.info("RequestPacer: %s", self.report())
+            self.lastReportAt = now
+
+    def done(self, requestClass: str, reqId: int):
+        """ The request got its answer; it no longer counts as in flight. """
+        self.inFlight[requestClass].pop(reqId, None)
+
+    def discard(self, reqId: int) -> bool:
+        """ Drops the requests of reqId that were not sent yet. Returns whether
+        any of them had been sent already. """
+        wasSent = False
+        for (requestClass, queue) in self.queues.items():
+            kept = [request for request in queue if request[2] != reqId]
+            if len(kept) != len(queue):
+                self.pending -= len(queue) - len(kept)
+                heapq.heapify(kept)
+                self.queues[requestClass] = kept
+            if self.inFlight[requestClass].pop(reqId, None) is not None:
+                wasSent = True
+        return wasSent
+
+    def isQueued(self, reqId: int) -> bool:
+        """ Whether a request of reqId waits to be sent, e.g. for a retry. """
+        return any(request[2] == reqId for queue in self.queues.values() for request in queue)
+
+    def clear(self):
+        """ Drops every request that was not sent yet. """
+        for queue in self.queues.values():
+            queue.clear()
+        self.pending = 0
+
+    def reset(self):
+        """ Forgets every request, sent or not, e.g. after the connection
+        dropped. """
+        self.clear()
+        for inFlight in self.inFlight.values():
+            inFlight.clear()
+
+    @classmethod
+    def isPacingError(cls, errorCode: int, errorString: str) -> bool:
+        if errorCode in cls.PACING_TEXT_ERRORS:
+            return cls.PACING_TEXT in errorString.lower()
+        return errorCode in cls.PACING_ERRORS
+
+    def onError(self, reqId: int, errorCode: int, errorString: str) -> bool:
+        """ Returns True if the error paced out a request that is retried. """
+        if not self.isPacingError(errorCode, errorString):
+            if reqId in self.inFlight[self.HISTORICAL_DATA]:
+                # A failed historical request no longer holds a slot
+                self.done(self.HISTORICAL_DATA, reqId)
+            return False
+
+        now = self.clock()
+        requestClass = self.PACING_ERRORS[errorCode]
+        if requestClass is None:
+            self.messages.pause(now, self.retryDelay)
+            return False
+
+        self.buckets[requestClass].pause(now, self.retryDelay)
+        request = self.inFlight[requestClass].pop(reqId, None)
+        if request is None:
+            return False
+        if request[5] >= self.maxRetries:
+            logging.error("RequestPacer: giving up %s request %d after %d retries: %s",
+                          requestClass, reqId, request[5], errorString)
+            return False
+
+        request[5] += 1
+        heapq.heappush(self.queues[requestClass], request)
+        self.pending += 1
+        self.nRetried += 1
+        return True
+
+    def queueDepth(self) -> dict:
+        return {requestClass: len(queue) for (requestClass, queue) in self.queues.items()}
+
+    def report(self) -> str:
+        return ("queued %s, in flight %s, sent %d, retried %d, wait avg %.3fs max %.3fs" %
+                (self.queueDepth(),
+                 {requestClass: len(inFlight) for (requestClass, inFlight) in self.inFlight.items()},
+                 self.nSent, self.nRetried,
+                 self.totalWait / self.nSent if self.nSent else 0., self.maxWait))
@@ -0,0 +1,165 @@
+import time
+
+from TradingPlan import TradingPlan
+
+
+class RiskGate:
+
+    """ Pre-trade checks of the orders of one account, run by TestApp right
+    before an order is placed:
+
+        symbol notional   |position after the order| * price within the
+                          MAX_NOTIONAL of the plan item, else maxNotional
+        account notional  notional of all orders let through within
+                          maxAccountNotional
+        order rate        at most maxOrderRate orders per second on
+                          average, in bursts of up to one second's worth
+        price band        price within priceBand (a fraction) of the
+                          item's todayOpenPrice; no open, no order
+        exposure          sum of |position| * price over all symbols,
+                          each at the price of its latest order, within
+                          maxExposure
+
+    A limit of 0 is off. The price is the close that triggered the order.
+    Orders that shrink the position pass the notional and exposure checks,
+    so a symbol over its limit can always be brought back. An order is
+    booked as if it filled; orderFinished() gives back the account notional
+    of what it did not fill and, like setPosition(), sets the exposure of
+    its symbol to the position the symbol actually has.
+
+    The limits of a symbol are worked out into one row when the plan is
+    loaded, the band again only when the open price changes, and exposure
+    is a running total adjusted by the symbol's own change. check() is thus
+    a dict lookup and a few comparisons whatever the size of the plan.
+    Plans trading the same account share the gate. """
+
+    MAX_NOTIONAL, OPEN, BAND_LOW, BAND_HIGH, EXPOSURE, PRICE = range(6)
+
+    def __init__(self, maxNotional: float = 0., maxAccountNotional: float = 0., maxOrderRate: float = 0.,
+                 priceBand: float = 0., maxExposure: float = 0., clock=time.monotonic):
+        self.maxNotional = maxNotional
+        self.maxAccountNotional = maxAccountNotional
+        self.priceBand = priceBand
+        self.maxExposure = maxExposure
+        self.clock = clock
+        self.maxOrderRate = maxOrderRate
+        # Orders allowed in a burst, one second's worth
+        self.burst = self.tokens = max(1., maxOrderRate)
+        self.tokensAt = clock()
+        # symbol -> [maxNotional, open, bandLow, bandHigh, exposure, price
+        # of the latest order]
+        self.rows = {}
+        # orderId -> price of the orders let through that are not done yet
+        self.orderPrices = {}
+        self.accountNotional = 0.
+        self.exposure = 0.
+        # reason -> orders refused for it
+        self.nRefused = {}
+
+    def load(self, tradingPlan: TradingPlan):
+        """ Works out the limits of the symbols of a (re)loaded plan. Symbols
+        no longer in it keep their row: their position still counts. """
+        for item in tradingPlan.plan.values():
+            row = self.rows.get(item.symbol)
+            if row is None:
+                row = self.rows[item.symbol] = [0., None, 0., 0., 0., None]
+            row[self.MAX_NOTIONAL] = self.maxNotional if item.maxNotional is None else item.maxNotional
+            self.setOpen(row, item.todayOpenPrice)
+
+    def setOpen(self, row: list, openPrice: float):
+        row[self.OPEN] = openPrice
+        if openPrice is not None:
+            row[self.BAND_LOW] = openPrice * (1. - self.priceBand)
+            row[self.BAND_HIGH] = openPrice * (1. + self.priceBand)
+
+    def check(self, tpItem, quantity: float, price: float) -> str:
+        """ Why the order of quantity (negative to sell) of tpItem must not go
+        out, or None if it may, in which case it is booked against the
+        account notional, exposure and order rate. """
+        row = self.rows.get(tpItem.symbol)
+        if row is None:
+            # Added since the plan was loaded
+            row = self.rows[tpItem.symbol] = [self.maxNotional, None, 0., 0., 0., None]
+        (maxNotional, openPrice, bandLow, bandHigh, symbolExposure, _) = row
+
+        latestPos = tpItem.latestPos
+        position = latestPos + quantity
+        notional = abs(position) * price
+        reduces = abs(position) <= abs(latestPos)
+        if maxNotional and notional > maxNotional and not reduces:
+            return self.refused("symbol notional", "%s notional %.0f over %.0f" %
+                                (tpItem.symbol, notional, maxNotional))
+
+        accountNotional = self.accountNotional + abs(quantity) * price
+        if self.maxAccountNotional and accountNotional > self.maxAccountNotional:
+            return self.refused("account notional", "account notional %.0f over %.0f" %
+                                (accountNotional, self.maxAccountNotional))
+
+        if self.priceBand:
+            if tpItem.todayOpenPrice != openPrice:
+                self.setOpen(row, tpItem.todayOpenPrice)
+                (_, openPrice, bandLow, bandHigh, _, _) = row
+            if openPrice is None:
+                return self.refused("price band", "%s has no open price to check %s against" %
+                                    (tpItem.symbol, price))
+            if not bandLow <= price <= bandHigh:
+                return self.refused("price band", "%s price %s outside %.2f..%.2f" %
+                                    (tpItem.symbol, price, bandLow, bandHigh))
+
+        exposure = self.exposure - symbolExposure + notional
+        if self.maxExposure and exposure > self.maxExposure and not reduces:
+            return self.refused("exposure", "exposure %.0f over %.0f" % (exposure, self.maxExposure))
+
+        if self.maxOrderRate:
+            # A TokenBucket, inlined: this runs on every order
+            now = self.clock()
+            tokens = self.tokens + (now - self.tokensAt) * self.maxOrderRate
+            if tokens > self.burst:
+                tokens = self.burst
+            self.tokensAt = now
+            if tokens < 1.:
+                self.tokens = tokens
+                return self.refused("order rate", "over %g orders/s" % self.maxOrderRate)
+            self.tokens = tokens - 1.
+
+        self.accountNotional = accountNotional
+        self.exposure = exposure
+        row[self.EXPOSURE] = notional
+        row[self.PRICE] = price
+        return None
+
+    def placed(self, orderId: int, price: float):
+        """ Ties the order check() let through last to orderId. """
+        self.orderPrices[orderId] = price
+
+    def orderFinished(self, record, position: float):
+        """ Gives back the account notional of the part of record that did
+        not fill, e.g. all of it when TWS rejected or cancelled the order,
+        and sets the exposure of its symbol to position. """
+        price = self.orderPrices.pop(record.orderId, None)
+        if price is None:
+            return
+        unfilled = record.totalQuantity - max(record.filled, record.executed)
+        if unfilled > 0:
+            self.accountNotional -= unfilled * price
+        if position is not None:
+            self.setPosition(record.symbol, position)
+
+    def setPosition(self, symbol: str, position: float):
+        """ Sets the exposure of symbol to position at the price of its
+        latest order, when TWS reports a position different from the one
+        booked. """
+        row = self.rows.get(symbol)
+        if row is None or row[self.PRICE] is None:
+            return
+        notional = abs(position) * row[self.PRICE]
+        self.exposure += notional - row[self.EXPOSURE]
+        row[self.EXPOSURE] = notional
+
+    def refused(self, check: str, reason: str) -> str:
+        self.nRefused[check] = self.nRefused.get(check, 0) + 1
+        return reason
+
+    def report(self) -> str:
+        return ("ordered %.0f, exposure %.0f, refused %s" %
+                (self.accountNotional, self.exposure, self.nRefused or "none"))
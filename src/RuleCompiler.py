@@ -0,0 +1,124 @@
+import ast
+import math
+
+
+class RuleError(ValueError):
+    pass
+
+
+class RuleCompiler:
+
+    """ Compiles the BUY_RULE and SELL_RULE expressions of a trading plan
+    item into one Python function signal(item, close, prev), which returns
+    1 when the buy rule holds, else -1 when the sell rule holds, else 0.
+
+    A rule is a Python expression over
+
+        close           the close of the bar (or the coalesced tick price)
+        prev            the close of the previous bar, priceFiveSecsAgo
+        open            today's open price, NaN until it is known
+        targetBuyPrice, targetSellPrice, targetLongPos, targetShortPos,
+        latestPos, buyAttempted, sellAttempted, buyAttemptLimit,
+        sellAttemptLimit
+                        the settings and state of the plan item
+
+    with numbers, arithmetic, comparisons, and/or/not, x if c else y, and
+    abs(x), min(x, y, ...), max(x, y, ...). Anything else is rejected when the plan is loaded.
+    Both expressions become the body of one lambda, so the rules cost one
+    call plus the same attribute loads as the hard-coded checks they
+    replace. They are compiled once per distinct pair and shared between
+    items.
+
+    Whether the item is enabled, has prev and has no working order is
+    checked by TestApp before the rules run. A rule that fails on a bar,
+    e.g. dividing by a latestPos of 0, gives 0 for that bar; TestApp
+    catches the ArithmeticError, TypeError or ValueError and logs it. """
+
+    DEFAULT_BUY_RULE = ("latestPos < targetLongPos and close >= targetBuyPrice and "
+                        "close >= prev and targetBuyPrice >= prev")
+    DEFAULT_SELL_RULE = ("latestPos > targetShortPos and close < targetSellPrice and "
+                         "close < prev and targetSellPrice <= prev")
+
+    ITEM_NAMES = frozenset(("targetBuyPrice", "targetSellPrice", "targetLongPos", "targetShortPos",
+                            "latestPos", "buyAttempted", "sellAttempted", "buyAttemptLimit",
+                            "sellAttemptLimit"))
+    ARGUMENT_NAMES = frozenset(("close", "prev"))
+    FUNCTIONS = {"abs": abs, "min": min, "max": max}
+    # function -> (fewest, most) positional arguments
+    ARITY = {"abs": (1, 1), "min": (2, None), "max": (2, None)}
+    NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+             ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Eq, ast.NotEq, ast.Lt,
+             ast.LtE, ast.Gt, ast.GtE, ast.IfExp, ast.Call, ast.Name, ast.Load, ast.Constant)
+
+    # (buy rule, sell rule) -> compiled signal
+    compiled = {}
+
+    @classmethod
+    def compile(cls, buyRule: str = None, sellRule: str = None):
+        """ The signal of the rules; None stands for the default rule. """
+        key = (buyRule or cls.DEFAULT_BUY_RULE, sellRule or cls.DEFAULT_SELL_RULE)
+        signal = cls.compiled.get(key)
+        if signal is None:
+            signal = cls.compiled[key] = cls.build(*key)
+        return signal
+
+    @classmethod
+    def isDefault(cls, signal) -> bool:
+        return signal is cls.compile()
+
+    @classmethod
+    def build(cls, buyRule: str, sellRule: str):
+        # 1 if buyRule else (-1 if sellRule else 0)
+        body = ast.IfExp(cls.parse(buyRule), ast.Constant(1),
+                         ast.IfExp(cls.parse(sellRule), ast.Constant(-1), ast.Constant(0)))
+        lambdaTree = ast.Expression(ast.Lambda(
+            ast.arguments(posonlyargs=[], args=[ast.arg("item"), ast.arg("close"), ast.arg("prev")],
+                          kwonlyargs=[], kw_defaults=[], defaults=[]),
+            body))
+        ast.fix_missing_locations(lambdaTree)
+        namespace = dict(cls.FUNCTIONS, __builtins__={}, nan=math.nan)
+        return eval(compile(lambdaTree, "<rules %s | %s>" % (buyRule, sellRule), "eval"), namespace)
+
+    @classmethod
+    def parse(cls, text: str) -> ast.expr:
+        """ The checked expression of text, its names resolved. """
+        try:
+            tree = ast.parse(text.strip(), mode="eval")
+        except SyntaxError as e:
+            raise RuleError("invalid rule %r: %s" % (text, e.msg))
+        for node in ast.walk(tree):
+            if not isinstance(node, cls.NODES):
+                raise RuleError("%s is not allowed in rule %r" % (type(node).__name__, text))
+            if isinstance(node, ast.Constant) and type(node.value) not in (int, float, bool):
+                raise RuleError("constant %r is not allowed in rule %r" % (node.value, text))
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and
+                                                   node.func.id in cls.FUNCTIONS and not node.keywords):
+                raise RuleError("only %s can be called in rule %r" % (", ".join(cls.FUNCTIONS), text))
+            if isinstance(node, ast.Call):
+                (fewest, most) = cls.ARITY[node.func.id]
+                if len(node.args) < fewest or (most is not None and len(node.args) > most):
+                    raise RuleError("%s() takes %s arguments, not %d, in rule %r" % (
+                        node.func.id, fewest if most == fewest else "%d or more" % fewest,
+                        len(node.args), text))
+
+        try:
+            return cls.ItemNames().visit(tree.body)
+        except RuleError as e:
+            raise RuleError("%s %r" % (e, text))
+
+    class ItemNames(ast.NodeTransformer):
+
+        """ Turns the names of a rule into lambda arguments and item attributes. """
+
+        def visit_Name(self, node):
+            if node.id in RuleCompiler.ARGUMENT_NAMES or node.id in RuleCompiler.FUNCTIONS:
+                return node
+            if node.id in RuleCompiler.ITEM_NAMES:
+                return ast.copy_location(ast.Attribute(ast.Name("item", ast.Load()), node.id, ast.Load()), node)
+            if node.id == "open":
+                # nan if item.todayOpenPrice is None else item.todayOpenPrice
+                openPrice = ast.Attribute(ast.Name("item", ast.Load()), "todayOpenPrice", ast.Load())
+                return ast.copy_location(ast.IfExp(
+                    ast.Compare(openPrice, [ast.Is()], [ast.Constant(None)]),
+                    ast.Name("nan", ast.Load()), openPrice), node)
+            raise RuleError("unknown name %r in rule" % node.id)
@@ -0,0 +1,77 @@
+class SubscriptionRegistry:
+
+    """ The market data subscriptions of the TestApps sharing one TWS
+    connection, one app per trading plan, deduplicated by contract.
+
+    The first plan item that wants the bars (or ticks of a type) of a symbol
+    makes the upstream request, under a reqId of the registry; items of
+    other plans wanting the same data are only added to its subscribers.
+    The upstream request is cancelled with its last subscriber. All plan
+    contracts are USStockAtSmart, so the symbol stands for the contract.
+
+    subscribers maps the upstream reqId to the (app, item reqId) pairs it is
+    fanned out to, so dispatching a bar is one dict lookup. The tuples are
+    replaced rather than changed, so a plan reload in the middle of a
+    fan-out does not disturb it. """
+
+    BARS = "bars"
+
+    def __init__(self, firstReqId: int):
+        self.nextReqId = firstReqId
+        # (kind, symbol) -> upstream reqId, kind being BARS or the tick type
+        self.upstreamByKey = {}
+        self.keyOf = {}
+        # upstream reqId -> ((app, item reqId), ...)
+        self.subscribers = {}
+        # (app, item reqId) -> upstream reqId
+        self.upstreamOf = {}
+
+    def subscribe(self, key: tuple, app, reqId: int) -> tuple:
+        """ Returns (upstream reqId, whether it still has to be requested). """
+        upstream = self.upstreamByKey.get(key)
+        isNew = upstream is None
+        if isNew:
+            upstream = self.nextReqId
+            self.nextReqId += 1
+            self.upstreamByKey[key] = upstream
+            self.keyOf[upstream] = key
+            self.subscribers[upstream] = ()
+        self.subscribers[upstream] += ((app, reqId),)
+        self.upstreamOf[(app, reqId)] = upstream
+        return (upstream, isNew)
+
+    def unsubscribe(self, app, reqId: int):
+        """ Returns the upstream reqId to cancel if reqId was its last
+        subscriber, else None. """
+        upstream = self.upstreamOf.pop((app, reqId), None)
+        if upstream is None:
+            return None
+        remaining = tuple(subscriber for subscriber in self.subscribers[upstream]
+                          if subscriber != (app, reqId))
+        if remaining:
+            self.subscribers[upstream] = remaining
+            return None
+        self.drop(upstream)
+        return upstream
+
+    def drop(self, upstream: int) -> tuple:
+        """ Forgets the subscription, e.g. after TWS turned it down, and
+        returns what its subscribers were. """
+        subscribers = self.subscribers.pop(upstream, ())
+        del self.upstreamByKey[self.keyOf.pop(upstream)]
+        for subscriber in subscribers:
+            self.upstreamOf.pop(subscriber, None)
+        return subscribers
+
+    def clear(self):
+        """ Forgets all subscriptions, e.g. after the connection dropped. """
+        self.upstreamByKey.clear()
+        self.keyOf.clear()
+        self.subscribers.clear()
+        self.upstreamOf.clear()
+
+    def nSubscriptions(self) -> int:
+        return len(self.subscribers)
+
+    def nSubscribers(self) -> int:
+        return len(self.upstreamOf)
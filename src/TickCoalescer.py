@@ -0,0 +1,47 @@
+class TickCoalescer:
+
+    """ Collapses tick-by-tick prices into one price per symbol and window,
+    so a burst of ticks costs the strategy one evaluation per symbol.
+
+    With window 0 the latest price of each symbol is released as soon as the
+    message loop has no backlog, so every tick is evaluated unless newer ones
+    are already waiting. With window > 0 prices are released at the end of
+    each window, aligned to the wall clock; a window of 5 evaluates the close
+    of each 5-second interval, like the realtime bars do. """
+
+    def __init__(self, window: float = 0.):
+        self.window = window
+        # reqId -> latest price within the current window
+        self.latest = {}
+        self.windowEnd = 0.
+        self.nTicks = 0
+        self.nReleased = 0
+
+    def add(self, reqId: int, price: float):
+        self.latest[reqId] = price
+        self.nTicks += 1
+
+    def due(self, now: float, backlog: bool) -> bool:
+        """ backlog tells whether more messages wait to be processed. """
+        if not self.latest:
+            return False
+        if self.window > 0:
+            return now >= self.windowEnd
+        return not backlog
+
+    def drain(self, now: float) -> list:
+        """ Returns [(reqId, price)] and starts the next window. """
+        prices = list(self.latest.items())
+        self.latest.clear()
+        self.nReleased += len(prices)
+        if self.window > 0:
+            self.windowEnd = (now // self.window + 1) * self.window
+        return prices
+
+    def clear(self):
+        """ Drops the prices not released yet, e.g. those of a connection
+        that dropped. """
+        self.latest.clear()
+
+    def report(self) -> str:
+        return "%d ticks coalesced into %d evaluations" % (self.nTicks, self.nReleased)
@@ -0,0 +1,43 @@
+import collections
+import queue
+import time
+
+
+class TimestampedQueue(queue.Queue):
+
+    """ The EReader -> message loop queue, remembering when each message was
+    read from the socket and queued. get() leaves the timestamps of the
+    message it returns, and when it was dequeued, in tracer.current.
+
+    There is one consumer, the message loop, so the tracer needs no lock. """
+
+    def __init__(self, tracer, maxsize: int = 0):
+        queue.Queue.__init__(self, maxsize)
+        self.tracer = tracer
+        # Set by the reader thread after each socket read, see timeReads()
+        self.readAt = 0
+
+    def _init(self, maxsize):
+        queue.Queue._init(self, maxsize)
+        self.stamps = collections.deque()
+
+    def _put(self, item):
+        self.queue.append(item)
+        self.stamps.append((self.readAt, time.perf_counter_ns()))
+
+    def _get(self):
+        (readAt, queuedAt) = self.stamps.popleft()
+        self.tracer.current = (readAt, queuedAt, time.perf_counter_ns())
+        return self.queue.popleft()
+
+    def timeReads(self, conn):
+        """ Stamps the messages queued from each conn.recvMsg() with the time
+        it returned. Only the reader thread calls recvMsg() once connected. """
+        recvMsg = conn.recvMsg
+
+        def timedRecvMsg():
+            data = recvMsg()
+            self.readAt = time.perf_counter_ns()
+            return data
+
+        conn.recvMsg = timedRecvMsg
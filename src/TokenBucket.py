@@ -0,0 +1,39 @@
+class TokenBucket:
+
+    """ Allows rate requests per second on average and bursts of up to burst
+    requests. Time is passed in by the caller, so one clock reading serves a
+    whole round of checks. """
+
+    def __init__(self, rate: float, burst: float, now: float = 0.):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updatedAt = now
+
+    def refill(self, now: float):
+        # updatedAt lies in the future while the bucket is paused
+        if now > self.updatedAt:
+            self.tokens = min(self.burst, self.tokens + (now - self.updatedAt) * self.rate)
+            self.updatedAt = now
+
+    def available(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= 1.
+
+    def take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens < 1.:
+            return False
+        self.tokens -= 1.
+        return True
+
+    def pause(self, now: float, seconds: float):
+        """ Empties the bucket and starts refilling it only seconds from now. """
+        self.tokens = 0.
+        self.updatedAt = max(self.updatedAt, now + seconds)
+
+    def secondsUntilAvailable(self, now: float) -> float:
+        self.refill(now)
+        if self.tokens >= 1.:
+            return 0.
+        return max(0., self.updatedAt - now) + (1. - self.tokens) / self.rate
@@ -1,6 +1,9 @@
-import yaml
+import zlib
+
 from ibapi.common import *
+from TradingPlanCache import TradingPlanCache
 from TradingPlanItem import TradingPlanItem
+from TradingPlanUpdate import TradingPlanUpdate
 
 
 class TradingPlan:
@@ -9,37 +12,97 @@ class TradingPlan:
         self.name = planName
         self.plan = {}
         self.planKeyedBySymbol = {}
+        # symbol -> the settings as last loaded, to diff reloads against
+        self.configBySymbol = {}
+        self.lastReqId = None
+        # (index, count) when this plan is one Supervisor worker's share
+        self.shard = None
 
     def addPlanItem(self, item: TradingPlanItem):
-        self.plan.update({item.reqId: item})
-        self.planKeyedBySymbol.update({item.symbol: item})
+        self.plan[item.reqId] = item
+        self.planKeyedBySymbol[item.symbol] = item
+
+    def inShard(self, symbol: str) -> bool:
+        if self.shard is None:
+            return True
+        # crc32 rather than hash(), which is salted per process
+        return zlib.crc32(symbol.encode()) % self.shard[1] == self.shard[0]
+
+    @staticmethod
+    def readRows(tPlanFileName: str) -> list:
+        """ The plan as TradingPlanCache rows, from the cache when the file is
+        unchanged. """
+        return TradingPlanCache.load(tPlanFileName)
+
+    @staticmethod
+    def configOf(row: tuple) -> tuple:
+        # Everything but the symbol
+        return row[1:]
 
     def parseYaml(self, tPlanFileName: str, firstTime: bool, startingReqId: TickerId):
-        tPlanFile = open(tPlanFileName, "r")
-        tPlanYaml = yaml.load(tPlanFile, Loader=yaml.FullLoader)
-        tPlanFile.close()
+        rows = self.readRows(tPlanFileName)
 
         reqId = startingReqId
+        plan = self.plan
+        planKeyedBySymbol = self.planKeyedBySymbol
+        configBySymbol = self.configBySymbol
 
-        for item in tPlanYaml:
+        for row in rows:
+            symbol = row[0]
+            if self.shard is not None and not self.inShard(symbol):
+                continue
             reqId = reqId + 1
 
             if firstTime:
                 tpItem = TradingPlanItem()
             else:
-                tpItem = self.planKeyedBySymbol[item["SYMBOL"]]
-
-            targetBuyPrice = item["TARGET_BUY_PRICE"]
-            targetSellPrice = round(targetBuyPrice * 0.997, 2)
-            tpItem.setup(item["SYMBOL"],
-                         item["ENABLED"],
-                         reqId,
-                         targetBuyPrice, targetSellPrice,
-                         item["TARGET_LONG_POS"],
-                         item["TARGET_SHORT_POS"],
-                         item["BUY_ATTEMPT_LIMIT"],
-                         item["SELL_ATTEMPT_LIMIT"])
-            self.addPlanItem(tpItem)
+                tpItem = planKeyedBySymbol[symbol]
+
+            tpItem.setupFromRow(row, reqId)
+            plan[reqId] = tpItem
+            planKeyedBySymbol[symbol] = tpItem
+            configBySymbol[symbol] = row[1:]
+
+        self.lastReqId = max(reqId, self.lastReqId or reqId)
+
+    def diffYaml(self, tPlanFileName: str) -> TradingPlanUpdate:
+        """ Builds the next snapshot of this plan from the YAML file without
+        touching this one. Items of unchanged symbols are shared with the new
+        snapshot; changed symbols get a fresh item with the new settings whose
+        runtime state is copied over when the update is applied; added symbols
+        get new reqIds after the highest one used so far. """
+        rows = self.readRows(tPlanFileName)
+
+        update = TradingPlanUpdate(TradingPlan(self.name))
+        newPlan = update.plan
+        newPlan.lastReqId = self.lastReqId
+        newPlan.shard = self.shard
+
+        for row in rows:
+            symbol = row[0]
+            if self.shard is not None and not self.inShard(symbol):
+                continue
+            config = self.configOf(row)
+            oldItem = self.planKeyedBySymbol.get(symbol)
+
+            if oldItem is not None and self.configBySymbol.get(symbol) == config:
+                tpItem = oldItem
+            elif oldItem is not None:
+                tpItem = TradingPlanItem()
+                tpItem.setupFromRow(row, oldItem.reqId)
+                update.changed.append((oldItem, tpItem))
+            else:
+                newPlan.lastReqId += 1
+                tpItem = TradingPlanItem()
+                tpItem.setupFromRow(row, newPlan.lastReqId)
+                update.added.append(tpItem)
+
+            newPlan.addPlanItem(tpItem)
+            newPlan.configBySymbol[symbol] = config
+
+        update.removed = [item for (symbol, item) in self.planKeyedBySymbol.items()
+                          if symbol not in newPlan.planKeyedBySymbol]
+        return update
 
     def __str__(self):
         msg = []
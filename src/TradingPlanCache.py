@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import marshal
+import os
+
+import yaml
+
+# libyaml's loader is an order of magnitude faster; fall back to the pure
+# Python one when PyYAML was built without it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class TradingPlanCache:
+
+    """ Parsed trading plan rows, cached in a marshal file next to the plan.
+
+    A row is (symbol, enabled, targetBuyPrice, targetLongPos, targetShortPos,
+    buyAttemptLimit, sellAttemptLimit, targetSellPrice, buyRule, sellRule,
+    maxNotional); the last four are optional in the plan and None when
+    missing. The cache is trusted as long as the plan's mtime and size are
+    unchanged; otherwise the plan is hashed, and only parsed again if its
+    content really differs from the cached one.
+
+    Plans written one flow mapping per line, like trading_plan.yml, also keep
+    the source line of each row, so after an edit only the lines that are not
+    in the cache go through the YAML parser. """
+
+    FORMAT = 4
+    COLUMNS = ("SYMBOL", "ENABLED", "TARGET_BUY_PRICE", "TARGET_LONG_POS",
+               "TARGET_SHORT_POS", "BUY_ATTEMPT_LIMIT", "SELL_ATTEMPT_LIMIT")
+    OPTIONAL_COLUMNS = ("TARGET_SELL_PRICE", "BUY_RULE", "SELL_RULE", "MAX_NOTIONAL")
+
+    @staticmethod
+    def cacheFileName(tPlanFileName: str) -> str:
+        (dirName, baseName) = os.path.split(tPlanFileName)
+        return os.path.join(dirName, "." + baseName + ".cache")
+
+    @staticmethod
+    def parseYaml(data: bytes) -> list:
+        columns = TradingPlanCache.COLUMNS
+        optionalColumns = TradingPlanCache.OPTIONAL_COLUMNS
+        return [tuple(item[column] for column in columns) + tuple(item.get(column) for column in optionalColumns)
+                for item in yaml.load(data, Loader=YamlLoader)]
+
+    @staticmethod
+    def rowLinesOf(data: bytes):
+        """ The lines of a one-row-per-line plan, or None for any other
+        layout. """
+        rowLines = []
+        for line in data.splitlines():
+            line = line.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            if not (line.startswith(b"- {") and line.endswith(b"}")):
+                return None
+            rowLines.append(line)
+        return rowLines
+
+    @staticmethod
+    def parseIncrementally(data: bytes, cached) -> tuple:
+        """ Returns (rows, rowLines), reusing the rows of cached lines. """
+        rowLines = TradingPlanCache.rowLinesOf(data)
+        if rowLines is None:
+            return (TradingPlanCache.parseYaml(data), None)
+
+        rowOfLine = {}
+        if cached is not None and cached[5] is not None:
+            rowOfLine = dict(zip(cached[5], cached[4]))
+        newLines = [line for line in rowLines if line not in rowOfLine]
+        if newLines:
+            rowOfLine.update(zip(newLines, TradingPlanCache.parseYaml(b"\n".join(newLines))))
+        return ([rowOfLine[line] for line in rowLines], rowLines)
+
+    @staticmethod
+    def readCache(cacheFileName: str):
+        try:
+            with open(cacheFileName, "rb") as cacheFile:
+                cached = marshal.load(cacheFile)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(cached, tuple) or len(cached) != 6 or cached[0] != TradingPlanCache.FORMAT:
+            return None
+        return cached
+
+    @staticmethod
+    def writeCache(cacheFileName: str, cached: tuple):
+        # Written aside and renamed, so concurrent loaders never see a torn file
+        tmpFileName = "%s.%d.tmp" % (cacheFileName, os.getpid())
+        try:
+            with open(tmpFileName, "wb") as cacheFile:
+                marshal.dump(cached, cacheFile)
+            os.replace(tmpFileName, cacheFileName)
+        except OSError as e:
+            logging.warning("Cannot write trading plan cache %s: %s", cacheFileName, e)
+
+    @staticmethod
+    def load(tPlanFileName: str, useCache: bool = True) -> list:
+        if not useCache:
+            with open(tPlanFileName, "rb") as tPlanFile:
+                return TradingPlanCache.parseYaml(tPlanFile.read())
+
+        cacheFileName = TradingPlanCache.cacheFileName(tPlanFileName)
+        cached = TradingPlanCache.readCache(cacheFileName)
+        with open(tPlanFileName, "rb") as tPlanFile:
+            stat = os.fstat(tPlanFile.fileno())
+            if cached is not None and cached[1] == stat.st_mtime_ns and cached[2] == stat.st_size:
+                return cached[4]
+            data = tPlanFile.read()
+
+        digest = hashlib.sha1(data).hexdigest()
+        if cached is not None and cached[3] == digest:
+            (rows, rowLines) = (cached[4], cached[5])
+        else:
+            (rows, rowLines) = TradingPlanCache.parseIncrementally(data, cached)
+        TradingPlanCache.writeCache(cacheFileName,
+                                    (TradingPlanCache.FORMAT, stat.st_mtime_ns, stat.st_size, digest,
+                                     rows, rowLines))
+        return rows
@@ -1,5 +1,7 @@
 from ibapi.common import *
 
+from RuleCompiler import RuleCompiler, RuleError
+
 
 class TradingPlanItem:
 
@@ -21,6 +23,12 @@ class TradingPlanItem:
         self.lastOrderId = None
         self.positionInitialized = False
         self.todayOpenPrice = None
+        # The buy and sell rules as signal(item, close, prev) -> 1, -1 or 0,
+        # see RuleCompiler
+        self.signal = RuleCompiler.compile()
+        # Limit of the position's notional value, None for that of the
+        # RiskGate
+        self.maxNotional = None
 
     def __str__(self):
         return ("symbol=%s; \tenabled=%s;\treqId=%d;\ttargetBuyPrice=%8.2f;\ttargetSellPrice=%8.2f;\t"
@@ -54,3 +62,40 @@ class TradingPlanItem:
         self.targetShortPos = targetShortPos
         self.buyAttemptLimit = buyAttemptLimit
         self.sellAttemptLimit = sellAttemptLimit
+
+    def setupFromRow(self, row: tuple, reqId: TickerId):
+        """ Same as setup() from a TradingPlanCache row, without the
+        intermediate call. Unless the row sets it, the sell target is 0.3%
+        below the buy target; rules the row leaves out are the default ones. """
+        (self.symbol,
+         self.enabled,
+         self.targetBuyPrice,
+         self.targetLongPos,
+         self.targetShortPos,
+         self.buyAttemptLimit,
+         self.sellAttemptLimit,
+         targetSellPrice,
+         buyRule,
+         sellRule,
+         self.maxNotional) = row
+        self.reqId = reqId
+        if targetSellPrice is None:
+            self.targetSellPrice = round(self.targetBuyPrice * 0.997, 2)
+        else:
+            self.targetSellPrice = targetSellPrice
+        try:
+            self.signal = RuleCompiler.compile(buyRule, sellRule)
+        except RuleError as e:
+            raise RuleError("%s: %s" % (self.symbol, e))
+
+    def copyStateFrom(self, other):
+        """ Takes over the runtime state of other, which holds the same symbol
+        under the previous settings. """
+        self.priceFiveSecsAgo = other.priceFiveSecsAgo
+        self.buyAttempted = other.buyAttempted
+        self.sellAttempted = other.sellAttempted
+        self.latestPos = other.latestPos
+        self.lastPos = other.lastPos
+        self.lastOrderId = other.lastOrderId
+        self.positionInitialized = other.positionInitialized
+        self.todayOpenPrice = other.todayOpenPrice
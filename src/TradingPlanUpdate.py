@@ -0,0 +1,29 @@
+class TradingPlanUpdate:
+
+    """ The result of TradingPlan.diffYaml(): the next plan snapshot and what
+    changed compared to the current one.
+
+    changed holds (oldItem, newItem) pairs; newItem carries the new settings
+    and gets the runtime state of oldItem in apply(). """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def isEmpty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+    def apply(self):
+        """ Carries the runtime state over to the changed items. Must run on
+        the thread that evaluates the plan, right before the snapshot is
+        published, so no state update can slip in between. """
+        for (oldItem, newItem) in self.changed:
+            newItem.copyStateFrom(oldItem)
+
+    def __str__(self):
+        return ("added=[%s] removed=[%s] changed=[%s]" %
+                (", ".join(item.symbol for item in self.added),
+                 ", ".join(item.symbol for item in self.removed),
+                 ", ".join(newItem.symbol for (oldItem, newItem) in self.changed)))
@@ -0,0 +1,44 @@
+import logging
+import os
+import threading
+
+
+class TradingPlanWatcher(threading.Thread):
+
+    """ Polls the trading plan file and calls onChange(fileName) from this
+    thread whenever its modification time or size changes. Errors raised by
+    onChange are logged and the watcher keeps going, so a half-saved or
+    invalid file just waits for the next save. """
+
+    def __init__(self, fileName: str, onChange, interval: float = 1.0):
+        threading.Thread.__init__(self, name="TradingPlanWatcher", daemon=True)
+        self.fileName = fileName
+        self.onChange = onChange
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.lastStat = self.statFile()
+
+    def statFile(self):
+        try:
+            stat = os.stat(self.fileName)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def checkOnce(self) -> bool:
+        stat = self.statFile()
+        if stat is None or stat == self.lastStat:
+            return False
+        self.lastStat = stat
+        try:
+            self.onChange(self.fileName)
+        except Exception:
+            logging.exception("Failed to reload trading plan %s", self.fileName)
+        return True
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.checkOnce()
+
+    def stop(self):
+        self.stopping.set()
@@ -0,0 +1,109 @@
+"""
+The session open is the open of the first bar of the session, not of the
+first bar since a restart: pre-market bars fall in the previous session, an
+app started before the open takes the open from the first session bar, and
+one started during the session asks TWS for the day's bar instead.
+"""
+
+import datetime
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+zoneinfo = pytest.importorskip("zoneinfo")
+
+from BarAggregator import BarAggregator
+import Program
+from RequestPacer import RequestPacer
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+NEW_YORK = zoneinfo.ZoneInfo("America/New_York")
+REQ_ID = 8801
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def at(day: str, hhmmss: str) -> int:
+    """ Epoch seconds of a New York wall clock time. """
+    local = datetime.datetime.strptime(day + hhmmss, "%Y%m%d%H:%M:%S").replace(tzinfo=NEW_YORK)
+    return int(local.timestamp())
+
+
+def makePlan() -> TradingPlan:
+    tradingPlan = TradingPlan("Sessions")
+    tpItem = TradingPlanItem()
+    tpItem.setup("AAA", True, REQ_ID, 100.0, 99.7, 100, 0, 1000, 1000)
+    tradingPlan.addPlanItem(tpItem)
+    return tradingPlan
+
+
+def addBar(aggregator: BarAggregator, time_: int, open_: float) -> bool:
+    return aggregator.addBar(REQ_ID, time_, open_, open_ + 1, open_ - 1, open_ + 0.5, 100, open_)
+
+
+@pytest.mark.parametrize("day", ["20240306", "20240311"])
+def test_session_bar_begins_at_the_open(day):
+    # 20240311 is the Monday after the switch to daylight saving time
+    aggregator = BarAggregator(makePlan())
+    assert addBar(aggregator, at(day, "09:00:00"), 90.)
+    assert not addBar(aggregator, at(day, "09:29:55"), 91.)
+    assert addBar(aggregator, at(day, "09:30:00"), 100.)
+    assert not addBar(aggregator, at(day, "09:30:05"), 102.)
+    assert not addBar(aggregator, at(day, "15:59:55"), 104.)
+
+    assert aggregator.sessionOpen(REQ_ID) == 100.
+    (start, open_, high, low, close, volume, vwap, nBars) = aggregator.bar(REQ_ID, "session")
+    assert (start, high, low, close, nBars) == (at(day, "09:30:00"), 105., 99., 104.5, 3)
+    # The pre-market bars went to the session of the day before
+    assert aggregator.bar(REQ_ID, "session", 1)[1:3] == (90., 92.)
+    assert aggregator.inSession(at(day, "15:59:59")) and not aggregator.inSession(at(day, "16:00:00"))
+
+
+def makeApp(now: int, monkeypatch):
+    monkeypatch.setattr(Program.time, "time", lambda: now)
+    app = Program.TestApp()
+    app.tradingPlan = makePlan()
+    app.barAggregator = BarAggregator(app.tradingPlan)
+    app.reqRealTimeBars = lambda *args: None
+    # Only the open matters here, not what the strategy makes of the bars
+    app.evaluatePrice = lambda reqId, close: None
+    app.subscribeMarketData(app.tradingPlan.plan[REQ_ID], "20240306 08:00:00")
+    return app
+
+
+def historicalQueued(app) -> bool:
+    return any(request[2] == REQ_ID for request in app.pacer.queues[RequestPacer.HISTORICAL_DATA])
+
+
+def test_started_before_the_open_takes_the_first_session_bar(monkeypatch):
+    app = makeApp(at("20240306", "08:00:00"), monkeypatch)
+    tpItem = app.tradingPlan.plan[REQ_ID]
+    assert REQ_ID in app.awaitingSessionOpen and not historicalQueued(app)
+
+    for (hhmmss, open_) in (("08:00:00", 90.), ("09:29:55", 91.), ("09:30:00", 100.), ("09:30:05", 102.)):
+        app.realtimeBar(REQ_ID, at("20240306", hhmmss), open_, open_, open_, open_, 100, open_, 1)
+        if open_ < 100.:
+            assert tpItem.todayOpenPrice is None
+    assert tpItem.todayOpenPrice == 100. and not app.awaitingSessionOpen
+
+
+def test_started_during_the_session_asks_for_the_day_bar(monkeypatch):
+    app = makeApp(at("20240306", "11:00:00"), monkeypatch)
+    tpItem = app.tradingPlan.plan[REQ_ID]
+    assert not app.awaitingSessionOpen
+    assert historicalQueued(app)
+
+    # The first bar since the restart is not the open
+    app.realtimeBar(REQ_ID, at("20240306", "11:00:00"), 103., 103., 103., 103., 100, 103., 1)
+    assert tpItem.todayOpenPrice is None
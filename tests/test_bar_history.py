@@ -0,0 +1,111 @@
+"""
+The O(1) indicators of BarHistory agree with a brute-force recomputation over
+the bars kept, across several laps of the ring and a plan reload.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+np = pytest.importorskip("numpy")
+
+from BarHistory import BarHistory
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+
+CAPACITY = 10
+EMA_PERIOD = 5
+ATR_PERIOD = 4
+
+
+def makePlan(*symbols) -> TradingPlan:
+    tradingPlan = TradingPlan("History")
+    for (i, symbol) in enumerate(symbols):
+        tpItem = TradingPlanItem()
+        tpItem.setup(symbol, True, 8801 + i, 100.0, 99.7, 100, 0, 1000, 1000)
+        tradingPlan.addPlanItem(tpItem)
+    return tradingPlan
+
+
+def randomBars(rng: random.Random, n: int) -> list:
+    bars = []
+    close = 100.
+    for i in range(n):
+        open_ = close
+        close = round(open_ + rng.uniform(-1, 1), 2)
+        high = round(max(open_, close) + rng.uniform(0, 0.5), 2)
+        low = round(min(open_, close) - rng.uniform(0, 0.5), 2)
+        bars.append((1600000000 + 5 * i, open_, high, low, close, rng.randint(0, 500),
+                     round((high + low + close) / 3, 4)))
+    return bars
+
+
+def bruteForce(bars: list) -> dict:
+    kept = bars[-CAPACITY:]
+    alpha = 2. / (EMA_PERIOD + 1)
+    ema = bars[0][4]
+    trueRanges = [bars[0][2] - bars[0][3]]
+    for (prev, bar) in zip(bars, bars[1:]):
+        ema += alpha * (bar[4] - ema)
+        trueRanges.append(max(bar[2] - bar[3], abs(bar[2] - prev[4]), abs(bar[3] - prev[4])))
+    atr = sum(trueRanges[:ATR_PERIOD]) / len(trueRanges[:ATR_PERIOD])
+    for trueRange in trueRanges[ATR_PERIOD:]:
+        atr += (trueRange - atr) / ATR_PERIOD
+    volume = sum(bar[5] for bar in kept)
+    return {"vwap": sum(bar[6] * bar[5] for bar in kept) / volume if volume else float("nan"),
+            "high": max(bar[2] for bar in kept),
+            "low": min(bar[3] for bar in kept),
+            "ema": ema,
+            "atr": atr}
+
+
+def check(history: BarHistory, reqId: int, bars: list):
+    expected = bruteForce(bars)
+    assert history.nBars(reqId) == len(bars)
+    assert history.vwap(reqId) == pytest.approx(expected["vwap"], rel=1e-12, nan_ok=True)
+    assert history.high(reqId) == expected["high"]
+    assert history.low(reqId) == expected["low"]
+    assert history.ema(reqId) == pytest.approx(expected["ema"], rel=1e-12)
+    assert history.atr(reqId) == pytest.approx(expected["atr"], rel=1e-12)
+    assert history.history(reqId).tolist() == [list(map(float, bar)) for bar in bars[-CAPACITY:]]
+    assert history.bar(reqId) == tuple(map(float, bars[-1]))
+    assert history.bar(reqId, min(len(bars), CAPACITY)) is None
+
+
+def test_indicators_match_brute_force():
+    rng = random.Random(12)
+    tradingPlan = makePlan("AAA", "BBB")
+    history = BarHistory(tradingPlan, CAPACITY, emaPeriod=EMA_PERIOD, atrPeriod=ATR_PERIOD)
+    assert np.isnan(history.high(8801)) and np.isnan(history.ema(8801))
+
+    seen = {8801: [], 8802: []}
+    allBars = {reqId: randomBars(rng, 47) for reqId in seen}
+    for i in range(47):
+        for reqId in seen:
+            bar = allBars[reqId][i]
+            assert history.addBar(reqId, *bar)
+            seen[reqId].append(bar)
+            check(history, reqId, seen[reqId])
+    assert not history.addBar(9999, *allBars[8801][0])
+
+
+def test_reload_keeps_the_history_of_symbols_kept():
+    rng = random.Random(3)
+    history = BarHistory(makePlan("AAA", "BBB"), CAPACITY, emaPeriod=EMA_PERIOD, atrPeriod=ATR_PERIOD)
+    bars = randomBars(rng, 23)
+    for bar in bars:
+        history.addBar(8802, *bar)
+
+    # BBB moves to the first row, under the reqId AAA had
+    history.load(makePlan("BBB", "CCC"))
+    check(history, 8801, bars)
+    assert history.nBars(8802) == 0
+    more = randomBars(rng, 15)
+    for bar in more:
+        history.addBar(8801, *bar)
+    check(history, 8801, bars + more)
@@ -0,0 +1,89 @@
+"""
+HistoricalBarStore reads back the bars of the segments a crash left intact:
+a segment cut short at the end of a file, or followed by later appends, only
+loses its own bars, and reading a past day compacts the file without them.
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from ibapi.common import BarData
+
+from HistoricalBarStore import HistoricalBarStore
+
+BAR_SIZE = "5 mins"
+DATE = "20240102"
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def makeBar(minute: int, close: float) -> BarData:
+    bar = BarData()
+    bar.date = "%s  09:%02d:00" % (DATE, 30 + minute)
+    (bar.open, bar.high, bar.low, bar.close) = (close, close + 0.5, close - 0.5, close)
+    (bar.volume, bar.average, bar.barCount) = (100 * minute, close, minute)
+    return bar
+
+
+def writeSegments(storeDir: str, *segments) -> str:
+    """ One flush per segment, a list of (symbol, minute, close). """
+    store = HistoricalBarStore(storeDir)
+    for segment in segments:
+        for (symbol, minute, close) in segment:
+            store.put(symbol, BAR_SIZE, makeBar(minute, close))
+        store.flush()
+    return store.path(BAR_SIZE, DATE)
+
+
+def closes(store: HistoricalBarStore, symbol: str) -> list:
+    return [bar.close for bar in store.bars(symbol, BAR_SIZE, DATE)]
+
+
+@pytest.mark.parametrize("cut", [1, 10, 30])
+def test_truncated_last_segment_keeps_the_earlier_bars(tmp_path, cut):
+    fileName = writeSegments(str(tmp_path), [("AAA", 0, 10.), ("BBB", 0, 20.)],
+                             [("AAA", 5, 11.), ("BBB", 5, 21.)])
+    size = os.path.getsize(fileName)
+    with open(fileName, "r+b") as barFile:
+        barFile.truncate(size - cut)
+
+    store = HistoricalBarStore(str(tmp_path))
+    assert closes(store, "AAA") == [10.] and closes(store, "BBB") == [20.]
+    bar = store.bars("AAA", BAR_SIZE, DATE)[0]
+    assert (bar.date, bar.high, bar.volume, bar.barCount) == ("%s  09:30:00" % DATE, 10.5, 0, 0)
+
+
+def test_torn_segment_between_appends_is_skipped(tmp_path):
+    fileName = writeSegments(str(tmp_path), [("AAA", 0, 10.)], [("AAA", 5, 11.)])
+    with open(fileName, "rb") as barFile:
+        data = barFile.read()
+    # A crash cut the second segment short, then the next run appended one
+    second = data.rfind(b"SEGM")
+    with open(fileName, "wb") as barFile:
+        barFile.write(data[:second + 20])
+    writeSegments(str(tmp_path), [("AAA", 10, 12.), ("BBB", 10, 22.)])
+
+    store = HistoricalBarStore(str(tmp_path))
+    assert closes(store, "AAA") == [10., 12.] and closes(store, "BBB") == [22.]
+
+
+def test_reading_a_past_day_compacts_away_the_torn_bytes(tmp_path):
+    fileName = writeSegments(str(tmp_path), [("AAA", 0, 10.)], [("AAA", 5, 11.)])
+    with open(fileName, "r+b") as barFile:
+        barFile.truncate(os.path.getsize(fileName) - 3)
+
+    assert closes(HistoricalBarStore(str(tmp_path)), "AAA") == [10.]
+    with open(fileName, "rb") as barFile:
+        data = barFile.read()
+    assert data == HistoricalBarStore.MAGIC + HistoricalBarStore.packSegment([("AAA", makeBar(0, 10.))])
+    assert closes(HistoricalBarStore(str(tmp_path)), "AAA") == [10.]
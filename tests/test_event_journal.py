@@ -0,0 +1,59 @@
+"""
+What EventJournal records comes back from JournalReader as it was, long
+symbols included, and a record torn at the end of the file is dropped.
+"""
+
+import os
+import sys
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from EventJournal import EventJournal
+import JournalReader
+
+
+def writeJournal(fileName: str):
+    journal = EventJournal(fileName, flushInterval=60)
+    journal.bar(8801, 1700000000, 99.5, 100.5, 99.0, 100.0, 1200, 99.9, 31)
+    journal.trigger(7, "VERYLONGSYMBOL.A", "BUY", 100, 100.1, 99.9)
+    journal.trigger(8, "VERYLONGSYMBOL.B", "SELL", 100, 99.6, None)
+    journal.orderStatus(7, "Filled", 100, 0, 100.1)
+    journal.position("VERYLONGSYMBOL.A", 100, 100.1)
+    journal.close()
+
+
+def test_round_trip(tmp_path):
+    fileName = str(tmp_path / "events.jrnl")
+    writeJournal(fileName)
+    records = list(EventJournal.read(fileName))
+    assert [recType for (recType, _, _) in records] == ["BAR", "TRIGGER", "TRIGGER", "ORDER_STATUS",
+                                                         "POSITION"]
+    assert records[0][2] == {"reqId": 8801, "time": 1700000000, "open": 99.5, "high": 100.5, "low": 99.0,
+                             "close": 100.0, "volume": 1200, "wap": 99.9, "count": 31}
+    assert records[1][2] == {"orderId": 7, "symbol": "VERYLONGSYMBOL.A", "action": "BUY",
+                             "quantity": 100, "price": 100.1, "priceFiveSecsAgo": 99.9}
+    assert records[2][2]["symbol"] == "VERYLONGSYMBOL.B"
+    assert records[3][2] == {"orderId": 7, "status": "Filled", "filled": 100, "remaining": 0,
+                             "avgFillPrice": 100.1}
+    assert records[4][2] == {"symbol": "VERYLONGSYMBOL.A", "position": 100, "avgCost": 100.1}
+
+
+def test_torn_record_is_dropped(tmp_path):
+    fileName = str(tmp_path / "events.jrnl")
+    writeJournal(fileName)
+    with open(fileName, "r+b") as journalFile:
+        journalFile.truncate(os.path.getsize(fileName) - 3)
+    assert [recType for (recType, _, _) in EventJournal.read(fileName)] == ["BAR", "TRIGGER", "TRIGGER",
+                                                                           "ORDER_STATUS"]
+
+
+def test_reader_renders_the_symbols(tmp_path, capsys, monkeypatch):
+    fileName = str(tmp_path / "events.jrnl")
+    writeJournal(fileName)
+    monkeypatch.setattr(sys, "argv", ["JournalReader.py", fileName, "--type", "TRIGGER"])
+    JournalReader.main()
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert "symbol=VERYLONGSYMBOL.A action=BUY" in lines[0]
+    assert "symbol=VERYLONGSYMBOL.B action=SELL" in lines[1]
@@ -0,0 +1,78 @@
+"""
+FastDecoder makes the same wrapper calls as the stock ibapi Decoder on the
+messages FakeTwsServer sends, those it decodes itself as well as those it
+hands over, and falls back on a message laid out otherwise.
+"""
+
+import os
+import sys
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from ibapi import comm
+from ibapi.decoder import Decoder
+from ibapi.message import IN
+from ibapi.wrapper import EWrapper
+
+from FakeTwsServer import FakeTwsServer
+from FastDecoder import FastDecoder
+
+
+class RecordingWrapper(EWrapper):
+
+    """ Records every wrapper call with its arguments, objects by their
+    attributes. """
+
+    def __init__(self):
+        EWrapper.__init__(self)
+        self.calls = []
+
+    def __getattribute__(self, name):
+        attr = object.__getattribute__(self, name)
+        if name.startswith("_") or name == "calls" or not callable(attr):
+            return attr
+        calls = object.__getattribute__(self, "calls")
+        return lambda *args: calls.append(
+            (name, tuple(vars(arg) if hasattr(arg, "__dict__") else arg for arg in args)))
+
+
+def messages(server: FakeTwsServer) -> list:
+    """ The payloads of what the server sends: bars, ticks, order status,
+    executions and positions, plus messages only the stock decoder knows. """
+    msgs = [server.makeMsg(IN.REAL_TIME_BARS, 3, 8801 + i, 1600000000 + 5 * i,
+                           100.0 + i, 100.5 + i, 99.5 + i, 100.25 + i, 100 * i, 100.125, i)
+            for i in range(3)]
+    msgs += [server.orderStatusMsg(7, "Submitted", 0., 100., 0., 1),
+             server.orderStatusMsg(7, "Filled", 100., 0., 100.25, 1),
+             server.executionMsg(-1, 1, 7, "AAA", "BUY", 100., 100.25, "0001"),
+             server.executionMsg(-1, 1, 8, "BBB", "SELL", 50., 20.5, "0002"),
+             server.positionMsg("AAA", 100.),
+             server.positionMsg("BBB", -50.5),
+             server.tickMsg(8801, "Last", 1600000000, 100.25),
+             server.tickMsg(8801, "BidAsk", 1600000000, 100.25),
+             server.tickMsg(8801, "MidPoint", 1600000000, 100.25),
+             server.makeMsg(IN.POSITION_END, 1),
+             server.makeMsg(IN.ERR_MSG, 2, 8801, 162, "Historical data request pacing violation"),
+             # Empty numeric fields, and a position of an older layout
+             server.makeMsg(IN.REAL_TIME_BARS, 3, 8801, 1600000000, 1., 1., 1., 1., "", 1., ""),
+             server.makeMsg(IN.POSITION_DATA, 2, server.ACCOUNT,
+                            0, "CCC", "STK", "", 0.0, "", "", "SMART", "USD", "CCC", "CCC", 10.)]
+    return [msg[4:] for msg in msgs]
+
+
+def test_same_calls_as_the_stock_decoder():
+    server = FakeTwsServer()
+    (stockWrapper, fastWrapper) = (RecordingWrapper(), RecordingWrapper())
+    stock = Decoder(stockWrapper, server.SERVER_VERSION)
+    fast = FastDecoder(fastWrapper, Decoder(fastWrapper, server.SERVER_VERSION))
+
+    for text in messages(server):
+        stock.interpret(comm.read_fields(text))
+        fast.interpret(comm.read_fields(text))
+        assert fastWrapper.calls == stockWrapper.calls, text
+
+    names = [name for (name, args) in stockWrapper.calls]
+    assert names.count("realtimeBar") == 4 and names.count("orderStatus") == 2
+    assert names.count("position") == 3 and names.count("execDetails") == 2
+    # Bars, order status and positions are decoded fast, the old layout falls back
+    assert (fast.nFast, fast.nFallback) == (8, 1)
@@ -0,0 +1,106 @@
+"""
+LatencyHistogram puts every value in a bucket that holds it and is narrow to
+2**(1 - subBucketBits) of it, so its percentiles are those of the recorded
+values to that precision; TimestampedQueue hands the message loop the stamps
+of the message it dequeues.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from LatencyHistogram import LatencyHistogram
+from TimestampedQueue import TimestampedQueue
+
+BITS = 7
+
+
+def edgeValues() -> list:
+    values = list(range(1 << (BITS + 2)))
+    for power in range(BITS, 40):
+        values += [(1 << power) - 1, 1 << power, (1 << power) + 1]
+    return values
+
+
+def test_buckets_hold_their_values_within_the_precision():
+    histogram = LatencyHistogram(BITS)
+    for value in edgeValues():
+        index = histogram.indexOf(value)
+        highest = histogram.highestValueAt(index)
+        assert value <= highest < value * (1 + 2. ** (1 - BITS)) + 1
+        # Below 2**BITS a bucket is a single value
+        if value < 1 << BITS:
+            assert highest == value
+
+
+def test_buckets_are_contiguous():
+    histogram = LatencyHistogram(BITS)
+    for index in range(histogram.indexOf(1 << 30)):
+        assert histogram.indexOf(histogram.highestValueAt(index) + 1) == index + 1
+
+
+def test_percentiles_match_the_sorted_values():
+    rng = random.Random(3)
+    values = [int(rng.lognormvariate(10, 2)) for _ in range(20000)]
+    histogram = LatencyHistogram(BITS)
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for pct in (1, 50, 90, 99, 99.9):
+        exact = values[int(-(-len(values) * pct // 100)) - 1]
+        assert exact <= histogram.percentile(pct) <= exact * (1 + 2. ** (1 - BITS))
+    assert histogram.percentile(100) == histogram.max == values[-1]
+    assert histogram.min == values[0] and histogram.mean() == pytest.approx(sum(values) / len(values))
+
+
+def test_small_counts_and_clamping():
+    histogram = LatencyHistogram(BITS, maxValue=1 << 20)
+    assert histogram.percentile(50) == 0 and histogram.summary() == "n=0"
+    for value in (-5, 3, 7, 1 << 30):
+        histogram.record(value)
+    assert [histogram.percentile(pct) for pct in (25, 50, 75, 100)] == [0, 3, 7, 1 << 20]
+    assert (histogram.min, histogram.max) == (0, 1 << 20)
+
+
+def test_merge_is_recording_both():
+    rng = random.Random(5)
+    (first, second, both) = (LatencyHistogram(BITS), LatencyHistogram(BITS), LatencyHistogram(BITS))
+    for i in range(2000):
+        value = rng.randrange(1 << 24)
+        (first if i % 3 else second).record(value)
+        both.record(value)
+    first.merge(second)
+    assert first.counts == both.counts
+    assert (first.count, first.total, first.min, first.max) == (both.count, both.total, both.min, both.max)
+
+
+class Tracer:
+    current = None
+
+
+class Conn:
+    def recvMsg(self):
+        return b"msg"
+
+
+def test_queue_stamps_each_message():
+    tracer = Tracer()
+    msgQueue = TimestampedQueue(tracer)
+    conn = Conn()
+    msgQueue.timeReads(conn)
+    assert conn.recvMsg() == b"msg"
+    firstRead = msgQueue.readAt
+    msgQueue.put("first")
+    conn.recvMsg()
+    msgQueue.put("second")
+
+    assert msgQueue.get() == "first"
+    (readAt, queuedAt, dequeuedAt) = tracer.current
+    assert readAt == firstRead and 0 < readAt <= queuedAt <= dequeuedAt
+    assert msgQueue.get() == "second"
+    assert tracer.current[0] == msgQueue.readAt > firstRead
+    assert tracer.current[2] >= dequeuedAt and not msgQueue.stamps
@@ -0,0 +1,126 @@
+"""
+The page MetricsExporter serves parses as the Prometheus text format: every
+family is declared once by HELP and TYPE before its samples, names and
+labels are well formed, label values escaped and values numbers.
+"""
+
+import logging
+import os
+import re
+import sys
+import urllib.request
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from MetricsExporter import MetricsExporter
+import Program
+from RiskGate import RiskGate
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+SAMPLE = re.compile(r"(%s)(?:\{(.*)\})? (\S+)$" % NAME)
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\[\\"n])*)"(?:,|$)')
+TYPES = ("counter", "gauge", "histogram", "summary", "untyped")
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def unescape(value: str) -> str:
+    return re.sub(r"\\(.)", lambda m: {"n": "\n"}.get(m.group(1), m.group(1)), value)
+
+
+def parse(page: str) -> dict:
+    """ name -> (type, [(labels, value)]); fails on anything the text format
+    does not allow. """
+    assert page.endswith("\n")
+    families = {}
+    (helped, current) = (set(), None)
+    for line in page[:-1].split("\n"):
+        if line.startswith("# HELP "):
+            (name, _, help_) = line[len("# HELP "):].partition(" ")
+            assert re.fullmatch(NAME, name) and name not in helped and help_
+            helped.add(name)
+            continue
+        if line.startswith("# TYPE "):
+            (name, type_) = line[len("# TYPE "):].split(" ")
+            assert name in helped and name not in families and type_ in TYPES
+            families[name] = (type_, [])
+            current = name
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        (name, labelText, value) = match.groups()
+        assert name == current, line
+        labels = {}
+        pos = 0
+        while labelText and pos < len(labelText):
+            label = LABEL.match(labelText, pos)
+            assert label, line
+            assert label.group(1) not in labels
+            labels[label.group(1)] = unescape(label.group(2))
+            pos = label.end()
+        families[name][1].append((labels, float(value)))
+    return families
+
+
+def makeApp(planName: str) -> Program.TestApp:
+    app = Program.TestApp()
+    app.tradingPlan = TradingPlan(planName)
+    for (i, symbol) in enumerate(("AAA", "BBB")):
+        tpItem = TradingPlanItem()
+        tpItem.setup(symbol, True, 8801 + i, 100.0, 99.7, 100, 0, 1000, 1000)
+        app.tradingPlan.addPlanItem(tpItem)
+    app.riskGate = RiskGate()
+    app.riskGate.load(app.tradingPlan)
+    return app
+
+
+def test_page_parses():
+    # Quotes, backslashes and newlines in label values must be escaped
+    app = makeApp('night "shift"\\\nplan')
+    exporter = MetricsExporter([app, makeApp("other")], 0)
+    try:
+        app.reqId2nBar[8801] += 7
+        app.orders.placed(1, "AAA", "BUY", 100)
+        app.symbol2nOrder["AAA"] += 1
+        app.tradingPlan.planKeyedBySymbol["AAA"].latestPos = -12.5
+        app.riskGate.nRefused["price band"] = 2
+        exporter.sample()
+        app.reqId2nBar[8801] += 3
+        families = parse(exporter.render(exporter.sample()))
+    finally:
+        exporter.server.server_close()
+
+    prefix = MetricsExporter.PREFIX
+    assert families[prefix + "connected"] == ("gauge", [({}, 0.)])
+    (type_, bars) = families[prefix + "bars_total"]
+    assert type_ == "counter" and bars == [({"plan": 'night "shift"\\\nplan', "symbol": "AAA"}, 10.)]
+    (_, rates) = families[prefix + "bars_per_second"]
+    assert len(rates) == 1 and rates[0][1] > 0
+    working = {(labels["plan"], labels["symbol"]): value
+               for (labels, value) in families[prefix + "symbol_orders_working"][1]}
+    assert working[('night "shift"\\\nplan', "AAA")] == 1 and working[("other", "AAA")] == 0
+    assert ({"plan": 'night "shift"\\\nplan', "symbol": "AAA"}, -12.5) in families[prefix + "symbol_position"][1]
+    assert families[prefix + "risk_refused_total"][1][0][1] == 2
+
+
+def test_served_over_http():
+    exporter = MetricsExporter([makeApp("served")], 0, interval=0.05)
+    exporter.start()
+    try:
+        with urllib.request.urlopen(exporter.address(), timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            families = parse(response.read().decode())
+    finally:
+        exporter.stop()
+        exporter.join(5)
+    assert MetricsExporter.PREFIX + "pacer_pending" in families
@@ -0,0 +1,85 @@
+"""
+OrderStateManager counts a fill once, whether its execution or the position
+callback reflecting it comes first, and finishes rejected orders.
+"""
+
+import os
+import sys
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from ibapi.contract import Contract
+from ibapi.execution import Execution
+
+from OrderStateManager import OrderStateManager
+
+
+def execution(orderId: int, execId: str, side: str, shares: float) -> tuple:
+    contract = Contract()
+    contract.symbol = "AAA"
+    fill = Execution()
+    fill.orderId = orderId
+    fill.execId = execId
+    fill.side = side
+    fill.shares = shares
+    return (contract, fill)
+
+
+def test_execution_before_position():
+    orders = OrderStateManager()
+    orders.positionReported("AAA", 0)
+    orders.placed(1, "AAA", "BUY", 100)
+    assert orders.execution(*execution(1, "e1", "BOT", 100)) == 100
+    # The position now includes the fill
+    assert orders.positionReported("AAA", 100) == 0
+
+
+def test_position_before_execution():
+    orders = OrderStateManager()
+    orders.positionReported("AAA", 0)
+    orders.placed(1, "AAA", "BUY", 100)
+    assert orders.positionReported("AAA", 100) == 0
+    # Counted already
+    assert orders.execution(*execution(1, "e1", "BOT", 100)) == 0
+
+
+def test_partial_fills_either_way():
+    orders = OrderStateManager()
+    orders.positionReported("AAA", 200)
+    orders.placed(1, "AAA", "SELL", 200)
+    assert orders.execution(*execution(1, "e1", "SLD", 50)) == -50
+    assert orders.positionReported("AAA", 0) == 0
+    assert orders.execution(*execution(1, "e2", "SLD", 150)) == 0
+    assert orders.execution(*execution(1, "e2", "SLD", 150)) == 0
+    assert orders.fillsAhead == {} and orders.positionAhead == {}
+
+
+def test_rejected_order_stops_working():
+    orders = OrderStateManager()
+    orders.placed(1, "AAA", "BUY", 100)
+    (record, finished) = orders.rejected(1)
+    assert finished and record.status == "Inactive"
+    assert not orders.hasWorkingOrder("AAA")
+    assert orders.rejected(1) == (record, False)
+    assert orders.rejected(2) == (None, False)
+
+
+def test_fill_of_a_symbol_never_reported():
+    orders = OrderStateManager()
+    orders.positionsEnd(["AAA"])
+    orders.placed(1, "AAA", "BUY", 100)
+    assert orders.execution(*execution(1, "e1", "BOT", 100)) == 100
+    # The first position of AAA includes the fill
+    assert orders.positionReported("AAA", 100) == 0
+    assert orders.fillsAhead == {} and orders.positionAhead == {}
+
+
+def test_execution_before_the_first_position():
+    orders = OrderStateManager()
+    orders.placed(1, "AAA", "BUY", 100)
+    assert orders.execution(*execution(1, "e1", "BOT", 100)) == 100
+    # The first position of AAA includes the fill, the next ones as well
+    assert orders.positionReported("AAA", 100) == 0
+    assert orders.fillsAhead == {} and orders.positionAhead == {}
+    assert orders.positionReported("AAA", 100) == 0
+    assert orders.fillsAhead == {} and orders.positionAhead == {}
@@ -0,0 +1,108 @@
+"""
+TradingPlanCache returns the rows of a full load whatever it reuses: after an
+edit only the lines not in the cache are parsed again, and the cache is
+trusted on mtime and size, or on the sha1 of the content when those moved.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from TradingPlanCache import TradingPlanCache
+
+ROW = ("- {SYMBOL: %s, ENABLED: True, TARGET_BUY_PRICE: %s, TARGET_LONG_POS: 100, "
+       "BUY_ATTEMPT_LIMIT: 3, TARGET_SHORT_POS: 0, SELL_ATTEMPT_LIMIT: 3}")
+SYMBOLS = ["S%03d" % i for i in range(50)]
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """ The YAML documents that went through the parser. """
+    documents = []
+    parseYaml = TradingPlanCache.parseYaml
+
+    def counted(data: bytes) -> list:
+        documents.append(data)
+        return parseYaml(data)
+    monkeypatch.setattr(TradingPlanCache, "parseYaml", staticmethod(counted))
+    return documents
+
+
+def writePlan(fileName: str, prices: dict, mtime: int):
+    with open(fileName, "w") as planFile:
+        planFile.write("# generated\n")
+        planFile.write("\n".join(ROW % (symbol, prices[symbol]) for symbol in SYMBOLS) + "\n")
+    os.utime(fileName, (mtime, mtime))
+
+
+def fullLoad(fileName: str) -> list:
+    return TradingPlanCache.load(fileName, useCache=False)
+
+
+def test_edit_parses_only_the_changed_line(tmp_path, parsed):
+    fileName = str(tmp_path / "plan.yml")
+    prices = {symbol: 10.0 + i for (i, symbol) in enumerate(SYMBOLS)}
+    writePlan(fileName, prices, 1600000000)
+    assert TradingPlanCache.load(fileName) == fullLoad(fileName)
+    del parsed[:]
+
+    prices["S017"] = 99.5
+    writePlan(fileName, prices, 1600000010)
+    rows = TradingPlanCache.load(fileName)
+    assert parsed == [(ROW % ("S017", 99.5)).encode()]
+    assert rows == fullLoad(fileName)
+    assert rows[17][:3] == ("S017", True, 99.5)
+
+
+def test_cache_trusted_while_mtime_and_size_hold(tmp_path, parsed):
+    fileName = str(tmp_path / "plan.yml")
+    prices = {symbol: 10.0 for symbol in SYMBOLS}
+    writePlan(fileName, prices, 1600000000)
+    TradingPlanCache.load(fileName)
+
+    # Same size and mtime: not even read
+    prices["S000"] = 20.0
+    writePlan(fileName, prices, 1600000000)
+    assert TradingPlanCache.load(fileName)[0][2] == 10.0
+
+    # Same size, new mtime: the sha1 tells the edit
+    writePlan(fileName, prices, 1600000010)
+    assert TradingPlanCache.load(fileName)[0][2] == 20.0
+
+    # New mtime, same content: the sha1 matches and nothing is parsed
+    del parsed[:]
+    writePlan(fileName, prices, 1600000020)
+    rows = TradingPlanCache.load(fileName)
+    assert parsed == []
+    assert rows == fullLoad(fileName)
+
+
+def test_size_change_alone_invalidates(tmp_path):
+    fileName = str(tmp_path / "plan.yml")
+    prices = {symbol: 10.0 for symbol in SYMBOLS}
+    writePlan(fileName, prices, 1600000000)
+    TradingPlanCache.load(fileName)
+
+    prices["S049"] = 10.25
+    writePlan(fileName, prices, 1600000000)
+    assert TradingPlanCache.load(fileName) == fullLoad(fileName)
+    assert TradingPlanCache.load(fileName)[-1][2] == 10.25
+
+
+def test_other_layouts_and_broken_cache_load_in_full(tmp_path, parsed):
+    fileName = str(tmp_path / "plan.yml")
+    with open(fileName, "w") as planFile:
+        planFile.write("- SYMBOL: AAA\n  ENABLED: True\n  TARGET_BUY_PRICE: 10.0\n  TARGET_LONG_POS: 100\n"
+                       "  BUY_ATTEMPT_LIMIT: 3\n  TARGET_SHORT_POS: 0\n  SELL_ATTEMPT_LIMIT: 3\n")
+    rows = TradingPlanCache.load(fileName)
+    assert rows == fullLoad(fileName) and rows[0][0] == "AAA"
+    assert TradingPlanCache.readCache(TradingPlanCache.cacheFileName(fileName))[5] is None
+
+    with open(TradingPlanCache.cacheFileName(fileName), "wb") as cacheFile:
+        cacheFile.write(b"\x00garbage")
+    del parsed[:]
+    assert TradingPlanCache.load(fileName) == rows
+    assert len(parsed) == 1
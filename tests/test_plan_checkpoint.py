@@ -0,0 +1,85 @@
+"""
+PlanCheckpoint loads the other area when the newest one is torn, starts
+afresh from a truncated file, and leaves out symbols too long for a record.
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from PlanCheckpoint import PlanCheckpoint
+from TradingPlanItem import TradingPlanItem
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def planItem(symbol: str, buyAttempted: int) -> TradingPlanItem:
+    tpItem = TradingPlanItem()
+    tpItem.setup(symbol, True, 8801, 100.0, 99.7, 100, 0, 1000, 1000)
+    tpItem.buyAttempted = buyAttempted
+    return tpItem
+
+
+def buyAttempted(checkpoint: PlanCheckpoint) -> dict:
+    (savedAt, states) = checkpoint.load()
+    return {symbol: state[2] for (symbol, state) in states.items()}
+
+
+def test_torn_area_loads_the_other_one(tmp_path):
+    fileName = str(tmp_path / "plan.ckpt")
+    checkpoint = PlanCheckpoint(fileName)
+    checkpoint.save([planItem("AAA", 1), planItem("BBB", 1)])
+    checkpoint.save([planItem("AAA", 2), planItem("BBB", 2)])
+    assert buyAttempted(checkpoint) == {"AAA": 2, "BBB": 2}
+
+    # A crash while writing the records of the newest checkpoint
+    recordsAt = checkpoint.areaOffset(checkpoint.sequence % 2, checkpoint.capacity) + \
+        PlanCheckpoint.AREA_HEADER.size
+    checkpoint.mm[recordsAt + PlanCheckpoint.RECORD.size + 20] ^= 0xff
+    checkpoint.close()
+
+    checkpoint = PlanCheckpoint(fileName)
+    assert buyAttempted(checkpoint) == {"AAA": 1, "BBB": 1}
+    # The next save goes over the torn area, so a crash in it still leaves
+    # the intact one
+    checkpoint.save([planItem("AAA", 3)])
+    assert buyAttempted(checkpoint) == {"AAA": 3}
+    other = 1 - checkpoint.sequence % 2
+    assert checkpoint.intactRecords(other) is not None and checkpoint.readAreaHeader(other)[2] == 2
+    checkpoint.close()
+
+
+@pytest.mark.parametrize("size", [5, 100])
+def test_truncated_file_starts_afresh(tmp_path, size):
+    fileName = str(tmp_path / "plan.ckpt")
+    checkpoint = PlanCheckpoint(fileName)
+    checkpoint.save([planItem("AAA", 1)])
+    checkpoint.close()
+    with open(fileName, "r+b") as checkpointFile:
+        checkpointFile.truncate(size)
+
+    checkpoint = PlanCheckpoint(fileName)
+    assert checkpoint.load() is None
+    checkpoint.save([planItem("AAA", 2)])
+    assert buyAttempted(checkpoint) == {"AAA": 2}
+    checkpoint.close()
+
+
+def test_long_symbols_are_left_out(tmp_path):
+    checkpoint = PlanCheckpoint(str(tmp_path / "plan.ckpt"))
+    longSymbols = ["ABCDEFGHIJKLMNOP-1", "ABCDEFGHIJKLMNOP-2"]
+    checkpoint.save([planItem(longSymbols[0], 1), planItem(longSymbols[1], 2),
+                     planItem("ABCDEFGHIJKLMNOP", 3)])
+    # Cut to 16 bytes, both would have come back as the third one
+    assert buyAttempted(checkpoint) == {"ABCDEFGHIJKLMNOP": 3}
+    assert checkpoint.tooLong == set(longSymbols)
+    checkpoint.close()
@@ -0,0 +1,135 @@
+"""
+TradingPlan.diffYaml tells the added, removed and changed symbols of a saved
+plan apart, and an update applied while an order is working keeps the state
+of the item, so the order is neither lost nor placed twice.
+"""
+
+import logging
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from Orders import Orders
+import Program
+from TradingPlan import TradingPlan
+
+ROW = ("- {SYMBOL: %s, ENABLED: True, TARGET_BUY_PRICE: %s, TARGET_LONG_POS: %d, "
+       "BUY_ATTEMPT_LIMIT: 3, TARGET_SHORT_POS: 0, SELL_ATTEMPT_LIMIT: 3}")
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+class PlanFile:
+
+    """ A plan file whose every save gets a later mtime, so that the cache
+    never takes it for the previous one. """
+
+    def __init__(self, fileName: str):
+        self.fileName = fileName
+        self.mtime = 1600000000
+
+    def save(self, *rows):
+        with open(self.fileName, "w") as planFile:
+            planFile.write("\n".join(ROW % row for row in rows) + "\n")
+        self.mtime += 10
+        os.utime(self.fileName, (self.mtime, self.mtime))
+
+
+def loadPlan(planFile: PlanFile, *rows) -> TradingPlan:
+    planFile.save(*rows)
+    tradingPlan = TradingPlan("Reload")
+    tradingPlan.parseYaml(planFile.fileName, True, 8800)
+    return tradingPlan
+
+
+def test_diff_tells_added_removed_and_changed(tmp_path):
+    planFile = PlanFile(str(tmp_path / "plan.yml"))
+    tradingPlan = loadPlan(planFile, ("AAA", 100.0, 100), ("BBB", 50.0, 100), ("CCC", 20.0, 100))
+    (aaa, bbb) = (tradingPlan.planKeyedBySymbol["AAA"], tradingPlan.planKeyedBySymbol["BBB"])
+    bbb.buyAttempted = 2
+
+    planFile.save(("AAA", 100.0, 100), ("BBB", 51.0, 100), ("DDD", 10.0, 100))
+    update = tradingPlan.diffYaml(planFile.fileName)
+    assert [item.symbol for item in update.added] == ["DDD"]
+    assert [item.symbol for item in update.removed] == ["CCC"]
+    ((oldBbb, newBbb),) = update.changed
+    assert oldBbb is bbb and newBbb.targetBuyPrice == 51.0 and newBbb.reqId == bbb.reqId
+    # Unchanged items are shared, new ones numbered after the last reqId
+    assert update.plan.planKeyedBySymbol["AAA"] is aaa
+    assert update.added[0].reqId == tradingPlan.lastReqId + 1 == update.plan.lastReqId
+    # The live plan is left alone until the update is applied
+    assert sorted(tradingPlan.planKeyedBySymbol) == ["AAA", "BBB", "CCC"] and bbb.targetBuyPrice == 50.0
+    update.apply()
+    assert newBbb.buyAttempted == 2
+
+    planFile.save(("AAA", 100.0, 100), ("BBB", 50.0, 100), ("CCC", 20.0, 100))
+    assert tradingPlan.diffYaml(planFile.fileName).isEmpty()
+
+
+def test_update_applied_while_an_order_is_working(tmp_path):
+    planFile = PlanFile(str(tmp_path / "plan.yml"))
+    planFile.save(("AAA", 100.0, 100), ("BBB", 50.0, 100))
+    app = Program.TestApp()
+    app.tradingPlanFile = planFile.fileName
+    app.tradingPlan = TradingPlan("Reload")
+    app.setupTradingPlan(firstTime=True)
+    app.nextValidOrderId = 1
+    placed = []
+    app.placeOrder = lambda orderId, contract, order: placed.append((orderId, contract.symbol))
+    Orders.CacheMarketOrders()
+
+    reqId = app.tradingPlan.planKeyedBySymbol["AAA"].reqId
+    app.evaluatePrice(reqId, 99.9)
+    app.evaluatePrice(reqId, 100.1)
+    assert placed == [(1, "AAA")] and app.orders.hasWorkingOrder("AAA")
+
+    planFile.save(("AAA", 100.0, 200), ("BBB", 50.0, 100))
+    app.prepareTradingPlanReload(planFile.fileName)
+    app.msgLoopTmo()
+    assert app.pendingPlanUpdate is None
+    aaa = app.tradingPlan.planKeyedBySymbol["AAA"]
+    assert aaa.targetLongPos == 200 and aaa.reqId == reqId
+    assert aaa.lastOrderId == 1 and aaa.buyAttempted == 1 and aaa.priceFiveSecsAgo == 100.1
+
+    # The order still holds the new settings back until it is done
+    app.evaluatePrice(reqId, 99.9)
+    app.evaluatePrice(reqId, 100.1)
+    assert placed == [(1, "AAA")]
+    app.orderStatus(1, "Cancelled", 0, 100, 0., 0, 0, 0., 0, "", 0.)
+    app.evaluatePrice(reqId, 99.9)
+    app.evaluatePrice(reqId, 100.1)
+    assert placed == [(1, "AAA"), (2, "AAA")] and aaa.buyAttempted == 2
+
+
+def test_next_reload_waits_for_the_pending_one(tmp_path):
+    planFile = PlanFile(str(tmp_path / "plan.yml"))
+    planFile.save(("AAA", 100.0, 100))
+    app = Program.TestApp()
+    app.planReloadInterval = 0.01
+    app.tradingPlanFile = planFile.fileName
+    app.tradingPlan = TradingPlan("Reload")
+    app.setupTradingPlan(firstTime=True)
+
+    planFile.save(("AAA", 100.0, 100), ("BBB", 50.0, 100))
+    app.prepareTradingPlanReload(planFile.fileName)
+    planFile.save(("AAA", 100.0, 100), ("BBB", 50.0, 100), ("CCC", 20.0, 100))
+    reload = threading.Thread(target=app.prepareTradingPlanReload, args=(planFile.fileName,))
+    reload.start()
+    reload.join(0.1)
+    assert reload.is_alive()
+
+    app.applyPendingPlanUpdate()
+    reload.join(5)
+    assert not reload.is_alive()
+    # Diffed against the plan holding BBB, so only CCC is new
+    assert [item.symbol for item in app.pendingPlanUpdate.added] == ["CCC"]
@@ -0,0 +1,120 @@
+"""
+PlanRouter subscribes a symbol held by several plans once, hands each bar
+to every plan holding it and cancels it with its last subscriber; the
+errors of an order go to the app of the plan that placed it, whatever plan
+the orderId falls in the reqId range of.
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from PlanRouter import PlanRouter
+import Program
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+class SentRequests(list):
+
+    """ Stands in for the requests of the apps, which all go out over the
+    connection of owner. """
+
+    def install(self, app):
+        app.reqRealTimeBars = lambda reqId, contract, *args: self.append(("bars", reqId, contract.symbol))
+        app.cancelRealTimeBars = lambda reqId: self.append(("cancel", reqId))
+
+
+def sharedConnection(*plans):
+    """ owner and a follower per further plan, each with an item per symbol
+    of its plan, subscribed to the bars. """
+    (owner, followers) = (Program.TestApp(), [Program.TestApp() for _ in plans[1:]])
+    router = PlanRouter(owner, followers)
+    router.shareConnection()
+    sent = SentRequests()
+    for (app, symbols) in zip(router.apps, plans):
+        sent.install(app)
+        app.tradingPlan = TradingPlan("Plan%d" % app.firstReqId)
+        for (i, symbol) in enumerate(symbols):
+            tpItem = TradingPlanItem()
+            tpItem.setup(symbol, True, app.firstReqId + 1 + i, 100.0, 99.7, 100, 0, 1000, 1000)
+            app.tradingPlan.addPlanItem(tpItem)
+            app.subscribeRealTimeBars(tpItem, 0)
+    owner.pacer.pump()
+    return (router, sent)
+
+
+def test_shared_symbol_is_subscribed_once():
+    (router, sent) = sharedConnection(["AAA", "BBB"], ["AAA"])
+    assert sorted(symbol for (_, _, symbol) in sent) == ["AAA", "BBB"]
+    assert router.subscriptions.nSubscriptions() == 2 and router.subscriptions.nSubscribers() == 3
+
+
+def test_bar_reaches_every_plan_holding_the_symbol():
+    (router, sent) = sharedConnection(["AAA", "BBB"], ["AAA"])
+    (owner, follower) = router.apps
+    upstream = {symbol: reqId for (_, reqId, symbol) in sent}
+    router.realtimeBar(upstream["AAA"], 0, 99.9, 99.9, 99.9, 99.9, 100, 99.9, 1)
+    assert owner.tradingPlan.planKeyedBySymbol["AAA"].priceFiveSecsAgo == 99.9
+    assert follower.tradingPlan.planKeyedBySymbol["AAA"].priceFiveSecsAgo == 99.9
+    assert owner.tradingPlan.planKeyedBySymbol["BBB"].priceFiveSecsAgo is None
+
+
+def test_cancelled_with_the_last_subscriber():
+    (router, sent) = sharedConnection(["AAA"], ["AAA"], ["AAA"])
+    upstream = sent[0][1]
+    for app in router.apps:
+        app.cancelMarketData(app.tradingPlan.planKeyedBySymbol["AAA"].reqId)
+        if app is not router.apps[-1]:
+            assert sent[1:] == []
+    assert sent[1:] == [("cancel", upstream)]
+    assert router.subscriptions.nSubscriptions() == 0
+
+
+def test_pacer_is_pumped_once_per_message():
+    (router, sent) = sharedConnection(["AAA"], ["BBB"])
+    (owner, follower) = router.apps
+    assert follower.pacer is owner.pacer
+    pumps = []
+    owner.pacer.pump = lambda: pumps.append(1)
+    owner.pacer.pending = 1
+    owner.msgLoopRec()
+    owner.msgLoopTmo()
+    # Once per message and once per timeout, not once per plan
+    assert len(pumps) == 2
+
+
+def test_follower_order_is_rejected():
+    owner = Program.TestApp()
+    follower = Program.TestApp()
+    router = PlanRouter(owner, [follower])
+    follower.tradingPlan = TradingPlan("Follower")
+    follower.orders.placed(5000, "AAA", "BUY", 100)
+
+    router.error(5000, 201, "Order rejected")
+    assert not follower.orders.hasWorkingOrder("AAA")
+    assert follower.orders.byOrderId[5000].status == "Inactive"
+    assert follower.reqId2nErr[5000] == 1 and owner.reqId2nErr[5000] == 0
+
+
+def test_request_errors_go_by_reqId():
+    owner = Program.TestApp()
+    follower = Program.TestApp()
+    router = PlanRouter(owner, [follower])
+
+    router.error(follower.firstReqId + 3, 200, "No security definition")
+    assert follower.reqId2nErr[follower.firstReqId + 3] == 1
+    router.error(owner.firstReqId + 3, 200, "No security definition")
+    assert owner.reqId2nErr[owner.firstReqId + 3] == 1
@@ -0,0 +1,74 @@
+"""
+An order that fills while the connection to TWS is down ends as Filled once
+the app has reconnected, its fill counted once in the position.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from FakeTwsServer import FakeTwsServer
+from Orders import Orders
+import Program
+from ReconnectSupervisor import ReconnectSupervisor
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+
+def waitFor(condition, timeout: float = 10.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def test_order_filled_while_disconnected():
+    server = FakeTwsServer(barsPerSecond=50, fillOrders=False)
+    # Buys once 99.9 -> 100.1 crosses 100.0
+    server.setBarScript("AAA", [99.9, 100.1])
+    server.start()
+
+    app = Program.TestApp()
+    app.tradingPlan = TradingPlan("Reconnect")
+    tpItem = TradingPlanItem()
+    tpItem.setup("AAA", True, 8801, 100.0, 99.7, 100, 0, 1000, 1000)
+    app.tradingPlan.addPlanItem(tpItem)
+    Orders.CacheMarketOrders()
+    reconnector = ReconnectSupervisor(app, server.host, server.port, 7, minDelay=0.05)
+    loop = threading.Thread(target=reconnector.run, daemon=True)
+    try:
+        assert reconnector.connect()
+        loop.start()
+        waitFor(lambda: app.orders.hasWorkingOrder("AAA"))
+        (record,) = app.orders.workingOrders("AAA")
+        waitFor(lambda: record.orderId in server.openOrders)
+
+        server.dropConnections()
+        server.fillOpenOrders()
+        waitFor(lambda: reconnector.nDrops == 1 and not app.orders.hasWorkingOrder("AAA"))
+        assert record.status == "Filled" and record.executed == 100
+        # Both the execution and the position of the new connection report the fill
+        waitFor(lambda: tpItem.positionInitialized)
+        waitFor(lambda: app.orders.fillsAhead == {})
+        assert tpItem.latestPos == 100
+        assert app.orders.byOrderId.keys() == {record.orderId}
+    finally:
+        app.done = True
+        app.disconnect()
+        loop.join(timeout=5)
+        server.stop()
@@ -0,0 +1,135 @@
+"""
+TokenBucket refills at its rate up to its burst, and RequestPacer keeps to
+the buckets and the in-flight cap, retries paced out requests and gives
+them up after maxRetries.
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from RequestPacer import RequestPacer
+from TokenBucket import TokenBucket
+
+HISTORICAL = RequestPacer.HISTORICAL_DATA
+PACING = "Historical Market Data Service error message:Historical data request pacing violation"
+NO_DATA = "Historical Market Data Service error message:HMDS query returned no data: AAA@SMART Trades"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def makePacer():
+    clock = Clock()
+    pacer = RequestPacer(clock)
+    sent = []
+    return (pacer, clock, sent)
+
+
+def submitHistorical(pacer: RequestPacer, sent: list, reqIds):
+    for reqId in reqIds:
+        pacer.submit(HISTORICAL, reqId, lambda reqId=reqId: sent.append(reqId))
+
+
+def test_bucket_refills_at_its_rate_up_to_its_burst():
+    bucket = TokenBucket(10., 5., 0.)
+    assert all(bucket.take(0.) for _ in range(5))
+    assert not bucket.take(0.)
+    assert bucket.secondsUntilAvailable(0.) == pytest.approx(0.1)
+    assert not bucket.available(0.09)
+    assert bucket.take(0.1) and not bucket.take(0.1)
+    # Three tokens after 0.3s, and never more than burst
+    assert sum(bucket.take(0.4) for _ in range(10)) == 3
+    assert sum(bucket.take(100.) for _ in range(10)) == 5
+
+
+def test_paused_bucket_refills_only_after_the_pause():
+    bucket = TokenBucket(10., 5., 0.)
+    bucket.pause(0., 2.)
+    assert not bucket.available(1.9)
+    assert bucket.secondsUntilAvailable(1.) == pytest.approx(1.1)
+    assert bucket.available(2.1)
+
+
+def test_pacer_sends_at_the_bucket_rate():
+    (pacer, clock, sent) = makePacer()
+    pacer.setRate(HISTORICAL, 10., 5.)
+    submitHistorical(pacer, sent, range(20))
+    pacer.pump()
+    assert sent == [0, 1, 2, 3, 4]
+    clock.now += 0.5
+    pacer.pump()
+    assert sent == list(range(10)) and pacer.pending == 10
+
+
+def test_at_most_50_historical_requests_in_flight():
+    (pacer, clock, sent) = makePacer()
+    pacer.setRate(HISTORICAL, 1000., 1000.)
+    pacer.setRate(None, 1000., 1000.)
+    submitHistorical(pacer, sent, range(60))
+    pacer.pump()
+    assert len(sent) == 50
+    clock.now += 10.
+    pacer.pump()
+    assert len(sent) == 50
+    pacer.done(HISTORICAL, 0)
+    # A failed request frees its slot as well
+    assert not pacer.onError(1, 162, NO_DATA)
+    pacer.pump()
+    assert sent[50:] == [50, 51] and pacer.pending == 8
+
+
+def test_paced_out_request_is_retried_then_given_up():
+    (pacer, clock, sent) = makePacer()
+    submitHistorical(pacer, sent, [7])
+    pacer.pump()
+    for nRetries in range(pacer.maxRetries):
+        assert pacer.onError(7, 162, PACING)
+        assert pacer.isQueued(7)
+        pacer.pump()
+        # The whole class waits out retryDelay
+        assert len(sent) == nRetries + 1
+        clock.now += pacer.retryDelay + 0.1
+        pacer.pump()
+        assert len(sent) == nRetries + 2
+    assert not pacer.onError(7, 162, PACING)
+    assert not pacer.isQueued(7) and pacer.pending == 0
+    assert pacer.nRetried == pacer.maxRetries
+
+
+def test_other_162_fails_at_once_without_pausing():
+    (pacer, clock, sent) = makePacer()
+    submitHistorical(pacer, sent, [7, 8])
+    pacer.pump()
+    assert not pacer.onError(7, 162, NO_DATA)
+    assert not pacer.isQueued(7) and 7 not in pacer.inFlight[HISTORICAL]
+    submitHistorical(pacer, sent, [9])
+    pacer.pump()
+    assert sent == [7, 8, 9]
+
+
+def test_message_rate_error_pauses_every_class():
+    (pacer, clock, sent) = makePacer()
+    assert not pacer.onError(-1, 100, "Max rate of messages per second has been exceeded")
+    submitHistorical(pacer, sent, [1])
+    pacer.pump()
+    assert sent == []
+    clock.now += pacer.retryDelay + 0.1
+    pacer.pump()
+    assert sent == [1]
@@ -0,0 +1,135 @@
+"""
+RiskGate refuses the orders over each of its limits, lets through those
+that bring a position back, and gives back what an order did not fill.
+"""
+
+import os
+import sys
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")]
+
+from OrderRecord import OrderRecord
+from RiskGate import RiskGate
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+def makePlan(*symbols) -> TradingPlan:
+    tradingPlan = TradingPlan("Risk")
+    for (i, symbol) in enumerate(symbols):
+        tpItem = TradingPlanItem()
+        tpItem.setup(symbol, True, 8801 + i, 100.0, 99.7, 100, 0, 1000, 1000)
+        tpItem.todayOpenPrice = 100.0
+        tradingPlan.addPlanItem(tpItem)
+    return tradingPlan
+
+
+def makeGate(tradingPlan: TradingPlan, **limits) -> RiskGate:
+    gate = RiskGate(clock=Clock(), **limits)
+    gate.load(tradingPlan)
+    return gate
+
+
+def test_symbol_notional():
+    tradingPlan = makePlan("AAA", "BBB")
+    tradingPlan.planKeyedBySymbol["BBB"].maxNotional = 50000
+    gate = makeGate(tradingPlan, maxNotional=10000)
+    (aaa, bbb) = (tradingPlan.planKeyedBySymbol["AAA"], tradingPlan.planKeyedBySymbol["BBB"])
+    assert gate.check(aaa, 100, 100.) is None
+    assert gate.check(aaa, 101, 100.) is not None
+    # MAX_NOTIONAL of the plan item comes first
+    assert gate.check(bbb, 400, 100.) is None
+    assert gate.nRefused == {"symbol notional": 1}
+
+
+def test_reducing_order_passes_over_the_limit():
+    tradingPlan = makePlan("AAA")
+    aaa = tradingPlan.planKeyedBySymbol["AAA"]
+    aaa.latestPos = 500
+    gate = makeGate(tradingPlan, maxNotional=10000, maxExposure=10000)
+    assert gate.check(aaa, 100, 100.) is not None
+    assert gate.check(aaa, -300, 100.) is None
+
+
+def test_account_notional():
+    tradingPlan = makePlan("AAA", "BBB")
+    gate = makeGate(tradingPlan, maxAccountNotional=15000)
+    assert gate.check(tradingPlan.planKeyedBySymbol["AAA"], 100, 100.) is None
+    assert gate.check(tradingPlan.planKeyedBySymbol["BBB"], 100, 100.) is not None
+    assert gate.nRefused == {"account notional": 1}
+
+
+def test_order_rate():
+    tradingPlan = makePlan("AAA")
+    aaa = tradingPlan.planKeyedBySymbol["AAA"]
+    gate = makeGate(tradingPlan, maxOrderRate=2)
+    assert [gate.check(aaa, 1, 100.) is None for i in range(3)] == [True, True, False]
+    gate.clock.now += 0.5
+    assert gate.check(aaa, 1, 100.) is None
+    assert gate.check(aaa, 1, 100.) is not None
+
+
+def test_price_band():
+    tradingPlan = makePlan("AAA")
+    aaa = tradingPlan.planKeyedBySymbol["AAA"]
+    gate = makeGate(tradingPlan, priceBand=0.05)
+    assert gate.check(aaa, 1, 104.) is None
+    assert gate.check(aaa, 1, 106.) is not None
+    assert gate.check(aaa, 1, 94.) is not None
+    # The band follows a new open price
+    aaa.todayOpenPrice = 110.
+    assert gate.check(aaa, 1, 106.) is None
+    aaa.todayOpenPrice = None
+    assert gate.check(aaa, 1, 100.) is not None
+    assert gate.nRefused == {"price band": 3}
+
+
+def test_exposure():
+    tradingPlan = makePlan("AAA", "BBB")
+    gate = makeGate(tradingPlan, maxExposure=25000)
+    (aaa, bbb) = (tradingPlan.planKeyedBySymbol["AAA"], tradingPlan.planKeyedBySymbol["BBB"])
+    assert gate.check(aaa, 200, 100.) is None
+    aaa.latestPos = 200
+    assert gate.check(bbb, 100, 100.) is not None
+    assert gate.check(bbb, 50, 100.) is None
+    assert gate.exposure == 25000
+
+
+def test_rejected_order_is_given_back():
+    tradingPlan = makePlan("AAA", "BBB")
+    gate = makeGate(tradingPlan, maxAccountNotional=15000, maxExposure=15000)
+    (aaa, bbb) = (tradingPlan.planKeyedBySymbol["AAA"], tradingPlan.planKeyedBySymbol["BBB"])
+    assert gate.check(aaa, 100, 100.) is None
+    gate.placed(1, 100.)
+    assert gate.check(bbb, 100, 100.) is not None
+
+    record = OrderRecord(1, "AAA", "BUY", 100)
+    record.status = "Inactive"
+    gate.orderFinished(record, aaa.latestPos)
+    assert gate.accountNotional == 0 and gate.exposure == 0
+    assert gate.check(bbb, 100, 100.) is None
+
+
+def test_partial_fill_keeps_what_filled():
+    tradingPlan = makePlan("AAA")
+    aaa = tradingPlan.planKeyedBySymbol["AAA"]
+    gate = makeGate(tradingPlan)
+    assert gate.check(aaa, 100, 100.) is None
+    gate.placed(1, 100.)
+    record = OrderRecord(1, "AAA", "BUY", 100)
+    record.executed = 40
+    gate.orderFinished(record, 40)
+    assert gate.accountNotional == 4000 and gate.exposure == 4000
+    # Finished once
+    gate.orderFinished(record, 0)
+    assert gate.accountNotional == 4000 and gate.exposure == 4000
+    gate.setPosition("AAA", -10)
+    assert gate.exposure == 1000
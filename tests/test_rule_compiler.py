@@ -0,0 +1,80 @@
+"""
+RuleCompiler rejects what is not a plain expression over the item, and its
+default rules trigger exactly where the hard-coded checks did.
+"""
+
+import itertools
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from RuleCompiler import RuleCompiler, RuleError
+from TradingPlan import TradingPlan
+from TradingPlanItem import TradingPlanItem
+import Program
+
+
+def planItem(latestPos: float = 0) -> TradingPlanItem:
+    tpItem = TradingPlanItem()
+    tpItem.setup("AAA", True, 8801, 100.0, 99.7, 100, 0, 1000, 1000)
+    tpItem.latestPos = latestPos
+    return tpItem
+
+
+@pytest.mark.parametrize("rule", ["__import__('os')", "item.symbol", "close.real > 0",
+                                  "'a' < 'b'", "print(close)", "max(close, key=abs) > 0",
+                                  "[close][0] > 0", "lambda: 1", "symbol > 0", "close >= b'x'",
+                                  "abs(close, prev) > 0", "abs() > 0", "min(close) > 0",
+                                  "max(close) > 0", "max() > 0", "min(*close) > 0"])
+def test_rejected(rule):
+    with pytest.raises(RuleError):
+        RuleCompiler.compile(rule, None)
+
+
+def test_invalid_syntax():
+    with pytest.raises(RuleError):
+        RuleCompiler.compile("close >", None)
+
+
+def test_open_is_nan_until_known():
+    signal = RuleCompiler.compile("close > open", "close < open")
+    tpItem = planItem()
+    assert signal(tpItem, 100.0, 99.0) == 0
+    tpItem.todayOpenPrice = 99.5
+    assert signal(tpItem, 100.0, 99.0) == 1
+    assert signal(tpItem, 99.0, 99.0) == -1
+    # Only NaN differs from itself
+    assert RuleCompiler.compile("open != open", "False")(planItem(), 1., 1.) == 1
+
+
+def test_default_rules_match_the_hard_coded_checks():
+    signal = RuleCompiler.compile()
+    assert RuleCompiler.isDefault(signal)
+    prices = (99.5, 99.6, 99.7, 99.8, 100.0, 100.1)
+    for (latestPos, close, prev) in itertools.product((-100, 0, 50, 100), prices, prices):
+        tpItem = planItem(latestPos)
+        buy = (tpItem.latestPos < tpItem.targetLongPos and close >= tpItem.targetBuyPrice and
+               close >= prev and tpItem.targetBuyPrice >= prev)
+        sell = (tpItem.latestPos > tpItem.targetShortPos and close < tpItem.targetSellPrice and
+                close < prev and tpItem.targetSellPrice <= prev)
+        assert signal(tpItem, close, prev) == (1 if buy else -1 if sell else 0)
+
+
+def test_failing_rule_does_not_trigger():
+    app = Program.TestApp()
+    tpItem = planItem(0)
+    tpItem.signal = RuleCompiler.compile("close / latestPos > 1", None)
+    tpItem.priceFiveSecsAgo = 99.9
+    app.tradingPlan = TradingPlan("Rules")
+    app.tradingPlan.addPlanItem(tpItem)
+    logging.disable(logging.CRITICAL)
+    try:
+        app.evaluatePrice(tpItem.reqId, 100.1)
+    finally:
+        logging.disable(logging.NOTSET)
+    assert tpItem.buyAttempted == 0 and tpItem.priceFiveSecsAgo == 100.1
@@ -0,0 +1,89 @@
+"""
+TickCoalescer releases only the latest price of each symbol that ticked: at
+once when the message loop has no backlog, or at the end of each window of
+the wall clock. Prices of a dropped connection are not released.
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "application")]
+
+from ibapi.common import TickAttribBidAsk, TickAttribLast
+
+import Program
+from TickCoalescer import TickCoalescer
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def test_keeps_only_the_latest_price():
+    coalescer = TickCoalescer()
+    for price in (10.0, 10.5, 10.25):
+        coalescer.add(1, price)
+    coalescer.add(2, 20.0)
+    assert sorted(coalescer.drain(1000.)) == [(1, 10.25), (2, 20.0)]
+    assert coalescer.drain(1000.) == []
+    assert (coalescer.nTicks, coalescer.nReleased) == (4, 2)
+
+
+def test_without_window_due_when_there_is_no_backlog():
+    coalescer = TickCoalescer()
+    assert not coalescer.due(1000., False)
+    coalescer.add(1, 10.0)
+    assert not coalescer.due(1000., True)
+    assert coalescer.due(1000., False)
+
+
+def test_window_ends_on_the_wall_clock():
+    coalescer = TickCoalescer(5.)
+    coalescer.add(1, 10.0)
+    # The first window ends at once, the next ones on multiples of 5s
+    assert coalescer.due(1001.5, True)
+    assert coalescer.drain(1001.5) == [(1, 10.0)]
+    coalescer.add(1, 10.5)
+    coalescer.add(1, 10.75)
+    assert not coalescer.due(1004.9, False)
+    assert coalescer.due(1005., True)
+    assert coalescer.drain(1005.) == [(1, 10.75)]
+    assert coalescer.windowEnd == 1010.
+
+
+def test_app_evaluates_the_latest_tick_of_each_symbol():
+    app = Program.TestApp()
+    app.tickCoalescer = TickCoalescer()
+    evaluated = []
+    app.evaluatePrice = lambda reqId, close: evaluated.append((reqId, close))
+    for price in (10.0, 10.5, 10.25):
+        app.tickByTickAllLast(8801, 1, 1600000000, price, 100, TickAttribLast(), "SMART", "")
+    app.tickByTickBidAsk(8802, 1600000000, 19.9, 20.1, 100, 100, TickAttribBidAsk())
+    # A one-sided quote has no midpoint
+    app.tickByTickBidAsk(8802, 1600000001, 0., 20.3, 0, 100, TickAttribBidAsk())
+    app.flushTicks()
+    assert sorted(evaluated) == [(8801, 10.25), (8802, pytest.approx(20.0))]
+    app.flushTicks()
+    assert len(evaluated) == 2
+
+
+def test_ticks_of_a_dropped_connection_are_not_evaluated():
+    app = Program.TestApp()
+    app.tickCoalescer = TickCoalescer()
+    evaluated = []
+    app.evaluatePrice = lambda reqId, close: evaluated.append((reqId, close))
+    app.tickByTickAllLast(8801, 1, 1600000000, 10.0, 100, TickAttribLast(), "SMART", "")
+    app.prepareResume()
+    assert not app.tickCoalescer.due(1000., False)
+    app.flushTicks()
+    assert evaluated == []
+    app.tickByTickAllLast(8801, 1, 1600000060, 10.5, 100, TickAttribLast(), "SMART", "")
+    app.flushTicks()
+    assert evaluated == [(8801, 10.5)]